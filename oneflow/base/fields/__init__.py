@@ -23,11 +23,14 @@ import uuid
 import time
 import redis
 import logging
+import threading
+
+from contextlib import contextmanager
 
 from django.conf import settings
 
 from ..utils import (RedisExpiringLock, AlreadyLockedException,
-                     eventually_deferred)
+                     eventually_deferred, redis_script)
 from ..utils.dateutils import ftstamp
 
 LOGGER = logging.getLogger(__name__)
@@ -36,6 +39,10 @@ REDIS = redis.StrictRedis(host=settings.REDIS_DESCRIPTORS_HOST,
                           port=settings.REDIS_DESCRIPTORS_PORT,
                           db=settings.REDIS_DESCRIPTORS_DB)
 
+# Holds the prefetched values and the write pipeline
+# of the current RedisCachedDescriptor.batch(), if any.
+BATCH = threading.local()
+
 
 class RedisCachedDescriptor(object):
     """ A simple descriptor that uses values from a REDIS database.
@@ -160,6 +167,99 @@ class RedisCachedDescriptor(object):
         # for the default descriptor, this is the identity method.
         return value
 
+    def redis_get(self, key):
+
+        prefetched = getattr(BATCH, 'prefetched', None)
+
+        if prefetched is not None and key in prefetched:
+            return prefetched[key]
+
+        return self.REDIS.get(key)
+
+    def redis_client(self, key, value):
+        """ Return the pipeline of the current batch if any (noting the
+            new ``value`` for next reads of ``key`` in the batch), else
+            the REDIS connection. """
+
+        pipe = getattr(BATCH, 'pipe', None)
+
+        if pipe is None:
+            return self.REDIS
+
+        BATCH.prefetched[key] = value
+
+        return pipe
+
+    @staticmethod
+    def descriptors_of(klass):
+
+        descriptors = {}
+
+        for parent in reversed(klass.__mro__):
+            for name, attr in parent.__dict__.items():
+                if isinstance(attr, RedisCachedDescriptor):
+                    descriptors[name] = attr
+
+        return descriptors
+
+    @classmethod
+    @contextmanager
+    def batch(cls):
+        """ Inside the block, values fetched by :meth:`prefetch` are served
+            to any instance with the same ID (templates often get fresh
+            instances from properties), and writes are buffered into one
+            pipeline, executed at the end of the block. Nested batches
+            are merged into the outer one.
+        """
+
+        if getattr(BATCH, 'pipe', None) is not None:
+            yield
+            return
+
+        BATCH.prefetched = {}
+        BATCH.pipe       = cls.REDIS.pipeline(transaction=False)
+
+        try:
+            yield
+
+        finally:
+            pipe = BATCH.pipe
+
+            BATCH.prefetched = None
+            BATCH.pipe       = None
+
+            pipe.execute()
+
+    @classmethod
+    def prefetch(cls, instances, attr_names=None):
+        """ Get the values of all descriptors (or only ``attr_names``) of
+            ``instances`` with one ``MGET``, and fill their caches. The
+            missing values are left to the descriptors defaults, computed
+            at first access as usual. """
+
+        lookups = []
+
+        for instance in instances:
+            for name, descriptor in cls.descriptors_of(
+                    type(instance)).items():
+                if attr_names is None or name in attr_names:
+                    lookups.append((instance, descriptor,
+                                    descriptor.key_name % instance.id))
+
+        if not lookups:
+            return
+
+        values     = cls.REDIS.mget([key for _, _, key in lookups])
+        prefetched = getattr(BATCH, 'prefetched', None)
+
+        for (instance, descriptor, key), value in zip(lookups, values):
+            if prefetched is not None:
+                prefetched[key] = value
+
+            if value is not None and descriptor.cache:
+                setattr(instance, '_r_c_d_' + descriptor.cache_key,
+                        descriptor.to_python(value))
+
     def to_redis(self, value):
 
         return value
@@ -171,10 +271,10 @@ class RedisCachedDescriptor(object):
         if self.default is None:
 
             # Let REDIS return None, anyway.
-            return self.to_python(self.REDIS.get(self.key_name % instance.id))
+            return self.to_python(self.redis_get(self.key_name % instance.id))
 
         else:
-            val = self.REDIS.get(self.key_name % instance.id)
+            val = self.redis_get(self.key_name % instance.id)
 
             if val is None:
                 if callable(self.default):
@@ -246,7 +346,10 @@ class RedisCachedDescriptor(object):
             value = self.max_value
 
         # Always store into REDIS, whatever the cache. We need persistence.
-        self.REDIS.set(self.key_name % instance.id, self.to_redis(value))
+        key_name = self.key_name % instance.id
+        to_redis = self.to_redis(value)
+
+        self.redis_client(key_name, to_redis).set(key_name, to_redis)
 
         if self.cache:
             # LOGGER.warning('SET-cache: %s %s %s', instance,
@@ -259,7 +362,9 @@ class RedisCachedDescriptor(object):
 
         # LOGGER.warning('DELETE-redis: %s', self.key_name % instance.id)
 
-        self.REDIS.delete(self.key_name % instance.id)
+        key_name = self.key_name % instance.id
+
+        self.redis_client(key_name, None).delete(key_name)
 
         if self.cache:
             # LOGGER.warning('DELETE-cache: %s %s', instance,
@@ -306,6 +411,122 @@ class IntRedisDescriptor(RedisCachedDescriptor):
     #       Already covered by base class.
     #
 
+    # Increment only existing keys: a missing one will be computed from
+    # the database by the descriptor default, which already includes the
+    # change. Clamp to the descriptor minimum, like __set__() does.
+    INCR_SCRIPT = """
+        if redis.call('exists', KEYS[1]) == 1 then
+            local value = redis.call('incrby', KEYS[1], ARGV[1])
+            if ARGV[2] ~= '' and value < tonumber(ARGV[2]) then
+                redis.call('set', KEYS[1], ARGV[2])
+                return tonumber(ARGV[2])
+            end
+            return value
+        end
+        return nil
+    """
+
+    @staticmethod
+    def get_descriptor(instance, attr_name):
+
+        for klass in type(instance).__mro__:
+            if attr_name in klass.__dict__:
+                return klass.__dict__[attr_name]
+
+        raise AttributeError(u'%s has no descriptor %s' % (
+                             type(instance).__name__, attr_name))
+
+    @classmethod
+    def incr_many(cls, deltas):
+        """ Apply signed deltas to many counters, possibly on different
+            instances, in one pipelined REDIS round-trip.
+
+            :param deltas: an iterable of ``(instance, attr_name, delta)``.
+                Null deltas are skipped.
+
+            The instance-level caches are updated with the new values.
+        """
+
+        deltas = [(instance, cls.get_descriptor(instance, attr_name), delta)
+                  for instance, attr_name, delta in deltas if delta]
+
+        if not deltas:
+            return
+
+        # Writes buffered in a batch must happen before the increments.
+        if getattr(BATCH, 'pipe', None) is not None:
+            BATCH.pipe.execute()
+
+        script = redis_script(cls.REDIS, cls.INCR_SCRIPT)
+
+        def run():
+            # EVALSHA directly, not script(client=pipe): that would
+            # send a SCRIPT EXISTS before the pipeline.
+            pipe = cls.REDIS.pipeline()
+
+            for instance, descriptor, delta in deltas:
+                pipe.evalsha(script.sha, 1,
+                             descriptor.key_name % instance.id, delta,
+                             '' if descriptor.min_value is None
+                             else descriptor.min_value)
+
+            return pipe.execute()
+
+        try:
+            values = run()
+
+        except redis.exceptions.NoScriptError:
+            # The REDIS server lost it (restart, SCRIPT FLUSH). Every
+            # command of the transaction failed, none was applied.
+            script.sha = cls.REDIS.script_load(cls.INCR_SCRIPT)
+            values     = run()
+
+        prefetched = getattr(BATCH, 'prefetched', None)
+
+        for (instance, descriptor, delta), value in zip(deltas, values):
+            if prefetched is not None:
+                prefetched[descriptor.key_name % instance.id] = value
+
+            if not descriptor.cache:
+                continue
+
+            cache_name = '_r_c_d_' + descriptor.cache_key
+
+            if value is None:
+                if hasattr(instance, cache_name):
+                    delattr(instance, cache_name)
+
+            else:
+                setattr(instance, cache_name, int(value))
+
+    @classmethod
+    def set_many(cls, values):
+        """ Set many counters in one pipelined REDIS round-trip, and
+            return the number of them which had another value before.
+
+            :param values: an iterable of ``(instance, attr_name, value)``.
+        """
+
+        values = [(instance, cls.get_descriptor(instance, attr_name), value)
+                  for instance, attr_name, value in values]
+
+        pipe = cls.REDIS.pipeline()
+
+        for instance, descriptor, value in values:
+            pipe.getset(descriptor.key_name % instance.id, value)
+
+        changed = 0
+
+        for (instance, descriptor, value), old_value in zip(values,
+                                                            pipe.execute()):
+            if descriptor.to_python(old_value) != value:
+                changed += 1
+
+            if descriptor.cache:
+                setattr(instance, '_r_c_d_' + descriptor.cache_key, value)
+
+        return changed
+
 
 class DatetimeRedisDescriptor(RedisCachedDescriptor):
     """ Datetime specific version of the
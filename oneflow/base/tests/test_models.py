@@ -27,7 +27,7 @@ import logging
 from django.conf import settings
 from django.test import TestCase  # TransactionTestCase
 
-from ..utils import RedisSemaphore
+from ..utils import RedisSemaphore, RedisExpiringLock, RedisTokenBucket
 from ..fields import RedisCachedDescriptor, IntRedisDescriptor
 
 LOGGER = logging.getLogger(__file__)
@@ -38,6 +38,8 @@ TEST_REDIS = redis.StrictRedis(host=settings.REDIS_TEST_HOST,
 
 # Use the test database not to pollute the production/development one.
 RedisSemaphore.REDIS = TEST_REDIS
+RedisExpiringLock.REDIS = TEST_REDIS
+RedisTokenBucket.REDIS = TEST_REDIS
 RedisCachedDescriptor.REDIS = TEST_REDIS
 
 TEST_REDIS.flushdb()
@@ -162,6 +164,104 @@ class RedisSemaphoreTests(TestCase):
 
         self.assertEquals(self.sem1.holders(), 0)
 
+    def test_dead_holder_expires(self):
+
+        self.sem1 = RedisSemaphore('test6', 1, expire_time=60)
+        self.sem2 = RedisSemaphore('test6', 1, expire_time=60)
+
+        self.assertTrue(self.sem1.acquire())
+        self.assertFalse(self.sem2.acquire())
+
+        # Simulate a holder which died without releasing, long ago.
+        RedisSemaphore.REDIS.zadd(self.sem1.lock_id, 0, self.sem1.tokens[0])
+
+        self.assertEquals(self.sem1.holders(), 0)
+        self.assertTrue(self.sem2.acquire())
+
+        # The dead holder can't release the resource of the new one.
+        self.assertFalse(self.sem1.release())
+        self.assertEquals(self.sem2.holders(), 1)
+        self.assertTrue(self.sem2.release())
+
+
+class RedisExpiringLockTests(TestCase):
+
+    def test_acquire_release(self):
+
+        lock  = RedisExpiringLock('test_lock1', expire_time=10)
+        other = RedisExpiringLock('test_lock1', lock_value='other')
+
+        self.assertFalse(lock.is_locked())
+        self.assertTrue(lock.acquire())
+        self.assertTrue(lock.is_locked())
+
+        # Not the holder, the lock stays.
+        self.assertFalse(other.release())
+        self.assertTrue(lock.is_locked())
+
+        self.assertTrue(lock.release())
+        self.assertFalse(lock.is_locked())
+
+    def test_release_after_expiry(self):
+
+        first  = RedisExpiringLock('test_lock2', expire_time=10)
+        second = RedisExpiringLock('test_lock2', expire_time=10)
+
+        self.assertTrue(first.acquire())
+
+        # Simulate the expiration of the first holder lock.
+        RedisExpiringLock.REDIS.delete(first.lock_id)
+
+        self.assertTrue(second.acquire())
+
+        # Same key, same instance type: still not the holder.
+        self.assertFalse(first.release())
+        self.assertTrue(second.is_locked())
+
+        self.assertTrue(first.release(force=True))
+        self.assertFalse(second.is_locked())
+
+    def test_reentrant(self):
+
+        lock = RedisExpiringLock('test_lock3', lock_value='me',
+                                 expire_time=10)
+
+        self.assertTrue(lock.acquire(reentrant_id='me'))
+        self.assertTrue(RedisExpiringLock('test_lock3', lock_value='me'
+                                          ).acquire(reentrant_id='me'))
+        self.assertFalse(RedisExpiringLock('test_lock3', lock_value='you'
+                                           ).acquire(reentrant_id='you'))
+        self.assertTrue(lock.release())
+
+    def test_locked_among(self):
+
+        class LockedThing(object):
+            def __init__(self, id):
+                self.id = id
+
+        RedisExpiringLock(LockedThing(1), lock_name='fetch',
+                          expire_time=10).acquire()
+
+        self.assertEquals(RedisExpiringLock.locked_among(LockedThing,
+                          [1, 2], lock_name='fetch'), set([1]))
+        self.assertEquals(RedisExpiringLock.locked_among(LockedThing,
+                          [1, 2]), set())
+
+
+class RedisTokenBucketTests(TestCase):
+
+    def test_consume(self):
+
+        bucket = RedisTokenBucket('test_bucket1', 0.5, burst=2)
+
+        self.assertEquals(bucket.consume(), 0)
+        self.assertEquals(bucket.consume(), 0)
+
+        # Burst exhausted: about 2 seconds until the next token.
+        wait = bucket.consume()
+
+        self.assertTrue(1 < wait <= 2)
+
 
 class IntRedisCachedDescriptorTest(TestCase):
 
@@ -229,3 +329,63 @@ class IntRedisCachedDescriptorTest(TestCase):
         tmax.imax -= 200
 
         self.assertEquals(tmax.imax, -100)
+
+    def test_incr_many(self):
+
+        t1 = self.IRCDT(uuid.uuid4().hex)
+        t2 = self.IRCDT(uuid.uuid4().hex)
+        t3 = self.IRCDT(uuid.uuid4().hex)
+
+        t1.i1   = 5
+        t2.imin = 2
+
+        IntRedisDescriptor.incr_many([(t1, 'i1', 3), (t2, 'imin', -5),
+                                      (t3, 'i1', 7)])
+
+        self.assertEquals(t1.i1, 8)
+        self.assertEquals(self.IRCDT(t1.id).i1, 8)
+
+        # Clamped to min_value.
+        self.assertEquals(t2.imin, 0)
+
+        # Missing keys are left to the default.
+        self.assertEquals(t3.i1, None)
+
+    def test_set_many(self):
+
+        t1 = self.IRCDT(uuid.uuid4().hex)
+        t1.i1 = 5
+
+        self.assertEquals(IntRedisDescriptor.set_many([(t1, 'i1', 5),
+                                                       (t1, 'imax', 3)]), 1)
+        self.assertEquals(self.IRCDT(t1.id).imax, 3)
+
+    def test_prefetch_and_batch(self):
+
+        t1 = self.IRCDT(uuid.uuid4().hex)
+        t1.i1   = 5
+        t1.imin = 3
+
+        # A fresh instance, as templates often get.
+        t2 = self.IRCDT(t1.id)
+
+        RedisCachedDescriptor.prefetch([t2], attr_names=('i1', ))
+
+        self.assertEquals(t2._r_c_d_test_redis_descr_1_, 5)
+
+        with RedisCachedDescriptor.batch():
+            RedisCachedDescriptor.prefetch([t1])
+
+            t3 = self.IRCDT(t1.id)
+            self.assertEquals(t3.imin, 3)
+
+            t3.i1 = 12
+
+            # Buffered until the end of the batch…
+            self.assertEquals(TEST_REDIS.get('test_redis_descr_1_'
+                                             + t1.id), '5')
+
+            # … but already seen inside it.
+            self.assertEquals(self.IRCDT(t1.id).i1, 12)
+
+        self.assertEquals(TEST_REDIS.get('test_redis_descr_1_' + t1.id), '12')
@@ -21,11 +21,14 @@
 
 import six
 import time
+import uuid
 import redis
 import urllib2
 import logging
 import importlib
 
+from collections import OrderedDict
+
 try:
     import blinker
 except:
@@ -50,6 +53,9 @@ REDIS = redis.StrictRedis(host=settings.REDIS_HOST,
                           port=settings.REDIS_PORT,
                           db=settings.REDIS_DB)
 
+# Lua scripts registered on REDIS clients, see `redis_script()`.
+REDIS_SCRIPTS = {}
+
 boolcast = {
     'True': True,
     'False': False,
@@ -107,6 +113,27 @@ def connect_mongoengine_signals(module_globals):
                      connected)
 
 
+def redis_script(client, script):
+    """ Return the :class:`redis.client.Script` of :param:`script` on
+        :param:`client`, creating it only once: ``register_script()``
+        sends a ``SCRIPT LOAD`` at each call. The script is reloaded by
+        redis-py if the server lost it.
+
+        .. note:: on pipelines, prefer ``pipe.evalsha(script.sha, …)``
+            over ``script(client=pipe)``, which sends a ``SCRIPT EXISTS``
+            before ``execute()``; handle :class:`NoScriptError` there.
+    """
+
+    try:
+        return REDIS_SCRIPTS[(client, script)]
+
+    except KeyError:
+        registered = REDIS_SCRIPTS[(client, script)] = \
+            client.register_script(script)
+
+        return registered
+
+
 def request_context_celery(request, *args, **kwargs):
     """ Create a standard Django :class:`Context`, and add it some useful
         things from the current RequestContext, without all the fudge. Eg.::
@@ -355,6 +382,15 @@ class RedisExpiringLock(object):
     key_base  = 'rxl'
     exc_class = AlreadyLockedException
 
+    # Compare-and-delete, to never release a lock taken by someone else
+    # after ours expired, in one round-trip.
+    RELEASE_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
     def __init__(self, instance, lock_name=None,
                  lock_value=None, expire_time=None):
 
@@ -364,16 +400,19 @@ class RedisExpiringLock(object):
             self.expire_time = expire_time or 3600
 
         else:
-            self.lock_id = '%s:%s:%s:%s' % (self.key_base,
-                                            instance.__class__.__name__,
-                                            instance.id, lock_name or 'giant')
+            self.lock_id = self.instance_lock_id(instance.__class__,
+                                                 instance.id, lock_name)
             self.expire_time = expire_time or getattr(instance,
                                                       'fetch_interval',
                                                       3600)
 
-        self.lock_value  = ('locked_by:%s' % lock_value
+        self.lock_prefix = ('locked_by:%s' % lock_value
                             ) if lock_value else 'locked'
 
+        # Set by acquire(): unique for each holder, for release()
+        # to never delete a lock taken by another one after ours expired.
+        self.lock_value  = None
+
     def __enter__(self):
         if not self.acquire():
             raise self.exc_class()
@@ -390,44 +429,72 @@ class RedisExpiringLock(object):
             method is not guaranteed to run atomically, but it's small
             in a multi-node networked environment.
         """
-        val = self.REDIS.set(self.lock_id, self.lock_value,
+        lock_value = '%s:%s' % (self.lock_prefix, uuid.uuid4().hex)
+
+        val = self.REDIS.set(self.lock_id, lock_value,
                              ex=self.expire_time, nx=True)
 
-        if reentrant_id:
-            if val is None:
-                return self.REDIS.get(self.lock_id)[10:] == reentrant_id
+        if val:
+            self.lock_value = lock_value
+
+        elif reentrant_id:
+            current = self.REDIS.get(self.lock_id)
+
+            # Strip 'locked_by:' and the holder token.
+            return current is not None \
+                and current[10:].rsplit(':', 1)[0] == reentrant_id
 
         return val
 
-    def release(self):
-        val = self.REDIS.get(self.lock_id)
+    def release(self, force=False):
+        """ Release the lock if we hold it. With ``force``, release it
+            whoever holds it (eg. to take it over from a stalled task). """
 
-        if val == self.lock_value:
-            try:
-                self.REDIS.delete(self.lock_id)
+        if force:
+            self.lock_value = None
+            return bool(self.REDIS.delete(self.lock_id))
 
-            except ValueError:
-                # When used as a simple lock, the 'locked' value we use
-                # produces “ValueError: invalid literal for int() with
-                # base 10: 'locked'”. This is completely harmless. Other
-                # values and exceptions must raise, though.
-                if val != 'locked':
-                    raise
+        if self.lock_value is None:
+            return False
 
-            return True
+        released = bool(redis_script(self.REDIS, self.RELEASE_SCRIPT)(
+                        keys=[self.lock_id], args=[self.lock_value]))
 
-        return False
+        self.lock_value = None
+
+        return released
 
     def is_locked(self):
-        """ OMG this method costs so much,
-            and can even have a race condition.
-            Hope we don't need it too often.
+        """ One ``EXISTS``, without touching the lock. """
+
+        return bool(self.REDIS.exists(self.lock_id))
+
+    @classmethod
+    def instance_lock_id(cls, klass, instance_id, lock_name=None):
+
+        return '%s:%s:%s:%s' % (cls.key_base, klass.__name__,
+                                instance_id, lock_name or 'giant')
+
+    @classmethod
+    def locked_among(cls, klass, instances_ids, lock_name=None):
+        """ Return the set of :param:`instances_ids` whose lock
+            is currently held, checked in one REDIS pipeline.
+
+            :param klass: the class of the instances, eg. ``Feed``.
         """
 
-        if self.acquire():
-            self.release()
-            return False
-        return True
+        instances_ids = list(instances_ids)
+
+        if not instances_ids:
+            return set()
+
+        pipe = cls.REDIS.pipeline(transaction=False)
+
+        for instance_id in instances_ids:
+            pipe.exists(cls.instance_lock_id(klass, instance_id, lock_name))
+
+        return set(instance_id for instance_id, exists
+                   in zip(instances_ids, pipe.execute()) if exists)
 
 # By default take the normal REDIS connection, but still allow
 # to override it in tests via the class attribute.
@@ -456,11 +523,13 @@ class RedisSemaphore(RedisExpiringLock):
     """
 
     REDIS     = None
-    key_base  = 'rsm'
+    # Holders were a plain counter under `rsm`, don't collide with them.
+    key_base  = 'rsz'
     exc_class = NoResourceAvailableException
 
-    def __init__(self, instance, resources_number=None):
-        super(RedisSemaphore, self).__init__(instance=instance)
+    def __init__(self, instance, resources_number=None, expire_time=None):
+        super(RedisSemaphore, self).__init__(instance=instance,
+                                             expire_time=expire_time)
 
         #
         # NOT A GOOD Idea to reset semaphore at instanciation,
@@ -468,41 +537,45 @@ class RedisSemaphore(RedisExpiringLock):
         #
         self.sem_limit = resources_number or 1
 
-        #LOGGER.warning('SEMinit: %s %s', self.lock_id, self.holders())
+        # The tokens of our acquisitions, last one first released.
+        self.tokens = []
 
-    def acquire(self):
+        #LOGGER.warning('SEMinit: %s %s', self.lock_id, self.holders())
 
-        #LOGGER.warning('>> ACQUIRE before: %s', self.holders())
+    # Holders are tracked individually in a sorted set, scored by their
+    # deadline: the ones of dead workers are pruned at next acquisition,
+    # instead of leaking their resource forever on a busy semaphore.
+    # The time is given by the caller, see RedisTokenBucket.
+    ACQUIRE_SCRIPT = """
+        redis.call('zremrangebyscore', KEYS[1], '-inf', ARGV[3])
+        if redis.call('zcard', KEYS[1]) < tonumber(ARGV[1]) then
+            redis.call('zadd', KEYS[1], ARGV[3] + ARGV[4], ARGV[2])
+            redis.call('expire', KEYS[1], ARGV[4])
+            return 1
+        end
+        return 0
+    """
 
-        val = self.REDIS.incr(self.lock_id)
+    def acquire(self):
 
-        #LOGGER.warning('>> ACQUIRE after: %s', self.holders())
+        token = uuid.uuid4().hex
 
-        if val <= self.sem_limit:
+        if redis_script(self.REDIS, self.ACQUIRE_SCRIPT)(
+                keys=[self.lock_id],
+                args=[self.sem_limit, token, time.time(),
+                      self.expire_time]):
+            self.tokens.append(token)
             return True
 
-        else:
-            #LOGGER.warning('>> WILL -1: %s', self.holders())
-
-            self.release()
-            return False
+        return False
 
     def release(self):
 
-        #LOGGER.warning('>> RELEASE before: %s', self.REDIS.get(self.lock_id))
-
-        val = self.REDIS.decr(self.lock_id)
-
-        #LOGGER.warning('>> RELEASE after: %s', val)
-
-        if val < 0:
-            # This should happen only during test, but just in case…
-            LOGGER.warning(u'Semaphore value %s is under zero (%s), resetting.',
-                           self.lock_id, val)
-            self.REDIS.set(self.lock_id, 0)
+        if not self.tokens:
             return False
 
-        return True
+        # False if our resource expired meanwhile.
+        return bool(self.REDIS.zrem(self.lock_id, self.tokens.pop()))
 
     def set_limit(self, limit=None):
 
@@ -516,10 +589,15 @@ class RedisSemaphore(RedisExpiringLock):
 
         return limit
 
+    def is_locked(self):
+        """ The semaphore is "locked" when all its resources are taken. """
+
+        return self.holders() >= self.sem_limit
+
     def holders(self):
-        # LOGGER.warning('>> HOLDERS: %s %s', self.lock_id,
-        #                int(self.REDIS.get(self.lock_id) or 0))
-        return int(self.REDIS.get(self.lock_id) or 0)
+        """ Number of resources taken, not counting the expired ones. """
+
+        return self.REDIS.zcount(self.lock_id, time.time(), '+inf')
 
 
 # By default take the normal REDIS connection, but still allow
@@ -527,6 +605,62 @@ class RedisSemaphore(RedisExpiringLock):
 RedisSemaphore.REDIS = REDIS
 
 
+class RedisTokenBucket(object):
+    """ A networked-machines-safe token bucket rate limiter: :param:`rate`
+        tokens are added each second, up to :param:`burst` tokens.
+
+        :meth:`consume` takes one token and returns ``0``, or returns the
+        number of seconds to wait until a token is available, without
+        taking any. The caller should defer its work rather than sleep.
+    """
+
+    REDIS    = None
+    key_base = 'rtb'
+
+    # The time is given by the caller: scripts which write
+    # are not allowed to call TIME on our REDIS version.
+    CONSUME_SCRIPT = """
+        local rate   = tonumber(ARGV[1])
+        local burst  = tonumber(ARGV[2])
+        local now    = tonumber(ARGV[3])
+        local bucket = redis.call('hmget', KEYS[1], 'tokens', 'stamp')
+        local tokens = tonumber(bucket[1] or ARGV[2])
+        local stamp  = tonumber(bucket[2] or ARGV[3])
+
+        tokens = math.min(burst, tokens + math.max(0, now - stamp) * rate)
+
+        if tokens < 1 then
+            return tostring((1 - tokens) / rate)
+        end
+
+        redis.call('hmset', KEYS[1], 'tokens', tokens - 1, 'stamp', now)
+        redis.call('expire', KEYS[1], math.ceil(burst / rate) + 1)
+        return '0'
+    """
+
+    def __init__(self, instance, rate, burst=None):
+
+        if isinstance(instance, str):
+            self.bucket_id = '%s:str:%s' % (self.key_base, instance)
+
+        else:
+            self.bucket_id = '%s:%s:%s' % (self.key_base,
+                                           instance.__class__.__name__,
+                                           instance.id)
+
+        self.rate  = float(rate)
+        self.burst = burst or max(1, int(rate))
+
+    def consume(self):
+
+        return float(redis_script(self.REDIS, self.CONSUME_SCRIPT)(
+                     keys=[self.bucket_id],
+                     args=[self.rate, self.burst, time.time()]))
+
+# Same as for the locks, tests can override this.
+RedisTokenBucket.REDIS = REDIS
+
+
 class HttpResponseLogProcessor(urllib2.BaseHandler):
         """ urllib2 processor that maintains a log of HTTP responses.
             See http://code.google.com/p/feedparser/issues/detail?id=390
@@ -641,6 +775,87 @@ class RedisStatsCounter(object):
 RedisStatsCounter.REDIS = REDIS
 
 
+class SimpleLRUCache(object):
+    """ A minimal process-local LRU mapping, on top of an ``OrderedDict``.
+        When :param:`max_size` is reached, the least recently used
+        entries are evicted. Not thread-safe, like most of our
+        worker-process-level caches.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.data     = OrderedDict()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+
+        try:
+            value = self.data.pop(key)
+
+        except KeyError:
+            return default
+
+        # Re-insert to mark the key as the most recently used.
+        self.data[key] = value
+
+        return value
+
+    def set(self, key, value):
+
+        self.data.pop(key, None)
+        self.data[key] = value
+
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def clear(self):
+        self.data.clear()
+
+
+class RedisGenerationLRUCache(SimpleLRUCache):
+    """ A :class:`SimpleLRUCache` that can be invalidated network-wide.
+
+        A generation counter is stored in REDIS. Any process can bump it
+        via :meth:`invalidate`; all processes will clear their local copy
+        at their next :meth:`check_generation` call, which costs one
+        REDIS ``GET``, instead of the database queries the cache avoids.
+    """
+
+    REDIS    = None
+    key_base = 'rgc'
+
+    def __init__(self, name, max_size=1024):
+        super(RedisGenerationLRUCache, self).__init__(max_size=max_size)
+
+        self.generation_key = '%s:%s' % (self.key_base, name)
+        self.generation     = None
+
+    def check_generation(self):
+
+        generation = self.REDIS.get(self.generation_key)
+
+        if generation != self.generation:
+            self.clear()
+            self.generation = generation
+
+    def invalidate(self):
+
+        self.clear()
+        self.REDIS.incr(self.generation_key)
+
+# By default take the normal REDIS connection, but still allow
+# to override it in tests via the class attribute.
+RedisGenerationLRUCache.REDIS = REDIS
+
+
 def word_match_consecutive_once(term, word):
     """ Eat letters as far as we find them
         to get a quite-enough fuzy match. """
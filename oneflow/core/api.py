@@ -21,9 +21,16 @@
 
 import logging
 
+from urllib import urlencode
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
 from tastypie_mongoengine.resources import MongoEngineResource
 from tastypie_mongoengine.fields import ReferencedListField, ReferenceField
 
+from tastypie.exceptions import BadRequest
+from tastypie.paginator import Paginator
 from tastypie.resources import ALL
 from tastypie.fields import CharField
 
@@ -38,6 +45,49 @@ from ..base.api import (UserResource,
 LOGGER = logging.getLogger(__name__)
 
 
+class CursorPaginator(Paginator):
+    """ When the request holds an ``after`` cursor (a read ID), the
+        resource has already filtered and ordered the objects; just slice
+        them, without the ``count()`` and ``skip()`` of the standard
+        paginator. ``meta.next`` holds the URI of the next page. """
+
+    def page(self):
+
+        if 'after' not in self.request_data:
+            return super(CursorPaginator, self).page()
+
+        limit   = self.get_limit()
+        objects = list(self.objects[:limit + 1])
+        meta    = {'limit': limit, 'next': None, 'previous': None,
+                   'after': self.request_data.get('after')}
+
+        if len(objects) > limit:
+            objects = objects[:limit]
+
+            params = dict((key, value) for key, value
+                          in self.request_data.items()
+                          if key not in ('after', 'offset'))
+            params.update(limit=limit, after=objects[-1].id)
+
+            meta['next'] = u'%s?%s' % (self.resource_uri, urlencode(params))
+
+        return {self.collection_name: objects, 'meta': meta}
+
+
+class ReadsPaginator(CursorPaginator):
+    """ Dereference the reads of the page in batch, see
+        :meth:`Read.prefetch`. """
+
+    def page(self):
+
+        page = super(ReadsPaginator, self).page()
+
+        page[self.collection_name] = Read.prefetch(
+            page[self.collection_name])
+
+        return page
+
+
 class FeedResource(MongoEngineResource):
 
     class Meta:
@@ -129,6 +179,26 @@ class ReadResource(MongoEngineResource):
         # These are specific to 1flow functionnals.
         authentication     = SessionAndApiKeyAuthentications()
         authorization      = UserObjectsOnlyAuthorization()
+        paginator_class    = ReadsPaginator
+
+    def apply_filters(self, request, applicable_filters):
+        """ Implement ``?after=<read_id>`` keyset pagination. """
+
+        reads = super(ReadResource, self).apply_filters(request,
+                                                        applicable_filters)
+        after = request.GET.get('after', None)
+
+        if after is None:
+            return reads
+
+        if after:
+            try:
+                reads = reads.filter(id__lt=ObjectId(after))
+
+            except InvalidId:
+                raise BadRequest(u'Invalid cursor “%s”.' % after)
+
+        return reads.order_by('-id')
 
 
 class PreferencesResource(MongoEngineResource):
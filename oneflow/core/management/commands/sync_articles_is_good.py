@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+    Copyright 2013-2014 Olivier Cortès <oc@1flow.io>
+
+    This file is part of the 1flow project.
+
+    1flow is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of
+    the License, or (at your option) any later version.
+
+    1flow is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public
+    License along with 1flow.  If not, see http://www.gnu.org/licenses/
+
+"""
+
+import logging
+
+from django.core.management.base import BaseCommand
+
+from oneflow.core.models.nonrel import Article
+from oneflow.base.utils.dateutils import benchmark
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'set the stored `is_good` of all articles.'
+
+    def handle(self, *args, **options):
+        """ `Article.is_good` is now stored, to be indexed. Existing
+            articles default to `False` until they are saved again,
+            which makes all of them look bad to the feeds and the reads
+            checkers. Run this once at deploy, before restarting the
+            workers; `global_reads_checker()` only repairs the drift.
+        """
+
+        with benchmark(u'Synchronize `is_good` of all articles'):
+            good, bad = Article.sync_is_good()
+
+        self.stdout.write('Set `is_good` on %s good and %s bad articles.'
+                          % (good, bad))
@@ -26,6 +26,8 @@ import re
 import gc
 import ast
 import uuid
+import difflib
+import hashlib
 import mistune
 import requests
 import strainer
@@ -54,6 +56,7 @@ from mongoengine.fields import (IntField, StringField, URLField, BooleanField,
 from mongoengine.errors import NotUniqueError, ValidationError
 
 from django.conf import settings
+from django.core.cache import cache
 from django.utils.translation import ugettext_lazy as _
 from django.utils.text import slugify
 from django.template.loader import render_to_string
@@ -81,12 +84,13 @@ from .common import (DocumentHelperMixin,
                      ORIGIN_TYPE_WEBIMPORT,
                      ORIGIN_TYPE_GOOGLE_READER,
                      ARTICLE_ORPHANED_BASE,
-                     REQUEST_BASE_HEADERS,
+                     ResponseTooLargeException,
+                     http_get,
                      )
 
 from .tag import Tag
 from .source import Source
-from .website import WebSite
+from .website import WebSite, WebSiteBusyException
 from .author import Author
 
 LOGGER                = logging.getLogger(__name__)
@@ -129,7 +133,13 @@ global_ghost_lock = RedisExpiringLock('__ghost.py__')
 def article_absolutize_url(article_id, *args, **kwargs):
 
     article = Article.objects.get(id=article_id)
-    return article.absolutize_url(*args, **kwargs)
+
+    try:
+        return article.absolutize_url(*args, **kwargs)
+
+    except WebSiteBusyException, e:
+        # The retry keeps the `link`ed post-absolutize chain.
+        raise article_absolutize_url.retry(exc=e, countdown=e.countdown)
 
 
 @task(name='Article.postprocess_original_data', queue='low')
@@ -158,7 +168,12 @@ def article_find_image(article_id, *args, **kwargs):
 def article_fetch_content(article_id, *args, **kwargs):
 
     article = Article.objects.get(id=article_id)
-    return article.fetch_content(*args, **kwargs)
+
+    try:
+        return article.fetch_content(*args, **kwargs)
+
+    except WebSiteBusyException, e:
+        raise article_fetch_content.retry(exc=e, countdown=e.countdown)
 
 
 @task(name='Article.post_create', queue='high')
@@ -199,6 +214,11 @@ class Article(Document, DocumentHelperMixin):
                                           u'anymore, or is unfetchable for '
                                           u'some reason.'))
 
+    # Denormalized :meth:`compute_is_good`, maintained in pre_save.
+    is_good    = BooleanField(default=False, verbose_name=_(u'good for use?'),
+                              help_text=_(u'The article is ready to be seen '
+                                          u'by final users.'))
+
     word_count = IntField(verbose_name=_(u'Word count'))
 
     authors    = ListField(ReferenceField(u'Author', reverse_delete_rule=PULL))
@@ -296,7 +316,8 @@ class Article(Document, DocumentHelperMixin):
             'url_error',
             'date_published',
             {'fields': ('duplicate_of', ), 'sparse': True},
-            {'fields': ('source', ), 'sparse': True}
+            {'fields': ('source', ), 'sparse': True},
+            ('feeds', 'is_good'),
 
         ]
     }
@@ -421,6 +442,79 @@ class Article(Document, DocumentHelperMixin):
         else:
             od.save()
 
+    # Bump this when the Markdown to HTML rendering changes,
+    # for cached renders of the previous version to be ignored.
+    RENDERER_VERSION = 1
+
+    @property
+    def rendered_content_cache_key(self):
+        """ Content-addressed: any change of the title or the content
+            gives a new key; stale renders just expire from the cache. """
+
+        content_hash = hashlib.sha1((u'%s\n%s' % (self.title or u'',
+                                    self.content or u'')).encode('utf-8'))
+
+        return 'a.rc:%s:%s:%s' % (self.RENDERER_VERSION, self.id,
+                                  content_hash.hexdigest())
+
+    def render_content(self):
+        """ Return the HTML rendering of the Markdown content,
+            from the cache if possible (see :meth:`render_content_raw`). """
+
+        cache_key = self.rendered_content_cache_key
+        html      = cache.get(cache_key)
+
+        if html is None:
+            html = self.render_content_raw()
+
+            if html is not None:
+                cache.set(cache_key, html, config.ARTICLE_RENDERED_CACHE_TTL)
+
+        return html
+
+    def render_content_raw(self):
+        """ Convert the Markdown content to HTML, without any cache. The
+            title is stripped from the content start, if found there. """
+
+        # START temporary measure.
+        # TODO: please get rid of this…
+
+        title_len = len(self.title or u'')
+
+        transient_content = self.content
+
+        if title_len > 10:
+            search_len = title_len * 2
+
+            diff = difflib.SequenceMatcher(None,
+                                           self.content[:search_len],
+                                           self.title)
+
+            if diff.ratio() > 0.51:
+                for blk in reversed(diff.matching_blocks):
+                    # Sometimes, last match is the empty string… Skip it.
+                    if blk[-1] != 0:
+                        transient_content = self.content[blk[0] + blk[2]:]
+                        break
+
+        # END temporary measure.
+
+        try:
+            return mistune.markdown(transient_content)
+
+        except:
+            LOGGER.exception(u'Live Markdown to HTML conversion '
+                             u'failed for article %s, trying '
+                             u'alternate parser.', self)
+
+            try:
+                return mk2_markdown(transient_content)
+
+            except:
+                LOGGER.exception(u'Alternate live Markdown to HTML '
+                                 u'conversion failed for article %s', self)
+                return None
+
     def make_excerpt(self, save=False):
         """ This method assumes a markdown content. Test it before calling.
 
@@ -586,6 +680,114 @@ class Article(Document, DocumentHelperMixin):
         # last URL we got. Better than nothing.
         return clean_url(requests_response.url)
 
+    @staticmethod
+    def resolved_url_cache_key(url):
+
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+
+        return 'a.ru:%s' % hashlib.sha1(url).hexdigest()
+
+    @classmethod
+    def resolved_url_get(cls, url):
+        """ Return the cached ``(final_url, url_error, orphaned)`` result
+            of a previous :meth:`absolutize_url_resolve` of ``url``, or
+            ``None``. The cache is shared by all workers: feeds going
+            through the same redirectors resolve each URL only once. """
+
+        return cache.get(cls.resolved_url_cache_key(url))
+
+    @classmethod
+    def resolved_urls_get(cls, urls):
+        """ Bulk version of :meth:`resolved_url_get`, in one cache round
+            trip. Returns a ``{url: final_url}`` dict of the URLs whose
+            cached absolutization points somewhere else. """
+
+        keys   = dict((cls.resolved_url_cache_key(url), url) for url in urls)
+        cached = cache.get_many(keys.keys()) if keys else {}
+        result = {}
+
+        for key, resolved in cached.items():
+            url       = keys[key]
+            final_url = resolved[0]
+
+            if final_url is not None and final_url != url:
+                result[url] = final_url
+
+        return result
+
+    @classmethod
+    def resolved_url_set(cls, url, final_url, url_error=None, orphaned=False):
+        """ Failures are cached too, but not as long as successes. """
+
+        if url_error:
+            ttl = config.ARTICLE_RESOLVED_URL_ERROR_CACHE_TTL
+
+        else:
+            ttl = config.ARTICLE_RESOLVED_URL_CACHE_TTL
+
+        if ttl:
+            cache.set(cls.resolved_url_cache_key(url),
+                      (final_url, url_error, orphaned), ttl)
+
+    @classmethod
+    def get_by_resolved_url(cls, url):
+        """ Return the article whose URL is the cached absolutization of
+            ``url``, if any. Lets :meth:`create_article` find duplicates
+            without creating them first and resolving their URL again. """
+
+        resolved = cls.resolved_url_get(url)
+
+        if resolved is None:
+            return None
+
+        final_url = resolved[0]
+
+        if final_url is None or final_url == url:
+            return None
+
+        return cls.objects(url=final_url).first()
+
+    def absolutize_url_resolve(self, requests_response=None):
+        """ Follow the redirections of the current article URL. Returns
+            a ``(final_url, url_error, orphaned)`` tuple; ``final_url``
+            is ``None`` if ``url_error`` is set. Nothing is saved. """
+
+        if requests_response is None:
+            try:
+                with WebSite.fetch_slot_for_url(self.url):
+                    requests_response = http_get(self.url)
+
+            except (requests.ConnectionError, requests.Timeout,
+                    ResponseTooLargeException), e:
+                LOGGER.error(u'Connection failed while absolutizing URL or %s.',
+                             self)
+                return None, str(e), False
+
+        if not requests_response.ok or requests_response.status_code != 200:
+
+            message = u'HTTP Error %s (%s) while resolving %s.'
+            args = (requests_response.status_code, requests_response.reason,
+                    requests_response.url)
+
+            LOGGER.error(message, *args)
+            return None, message % args, True
+
+        #
+        # NOTE: we could also get it eventually from r.headers['link'],
+        #       which contains '<another_url>'. We need to strip out
+        #       the '<>', and re-absolutize this link, because in the
+        #       example it's another redirector. Also r.links is a good
+        #       candidate but in the example I used, it contains the
+        #       shortlink, which must be re-resolved too.
+        #
+        #       So: as we already are at the final address *now*, no need
+        #       bothering re-following another which would lead us to the
+        #       the same final place.
+        #
+
+        return self.absolutize_url_post_process(requests_response), None, False
+
     def absolutize_url(self, requests_response=None, force=False, commit=True):
         """ Make the current article URL absolute. Eg. transform:
 
@@ -617,52 +819,35 @@ class Article(Document, DocumentHelperMixin):
         if self.absolutize_url_must_abort(force=force, commit=commit):
             return
 
-        if requests_response is None:
-            try:
-                requests_response = requests.get(self.url,
-                                                 headers=REQUEST_BASE_HEADERS)
+        resolved = None
 
-            except requests.ConnectionError, e:
-                statsd.gauge('articles.counts.url_errors', 1, delta=True)
-                self.url_error = str(e)
-                self.save()
+        # A given response must be processed, whatever the cache says.
+        if requests_response is None and not force:
+            resolved = Article.resolved_url_get(self.url)
 
-                LOGGER.error(u'Connection failed while absolutizing URL or %s.',
-                             self)
-                return
+        if resolved is None:
+            resolved = self.absolutize_url_resolve(requests_response)
+            Article.resolved_url_set(self.url, *resolved)
 
-        if not requests_response.ok or requests_response.status_code != 200:
+        else:
+            statsd.incr('articles.absolutize.cache_hits')
 
-            message = u'HTTP Error %s (%s) while resolving %s.'
-            args = (requests_response.status_code, requests_response.reason,
-                    requests_response.url)
+        final_url, url_error, orphaned = resolved
 
+        if url_error:
             with statsd.pipeline() as spipe:
-                spipe.gauge('articles.counts.orphaned', 1, delta=True)
+                if orphaned:
+                    spipe.gauge('articles.counts.orphaned', 1, delta=True)
+
                 spipe.gauge('articles.counts.url_errors', 1, delta=True)
 
-            self.orphaned  = True
-            self.url_error = message % args
-            self.save()
+            if orphaned:
+                self.orphaned = True
 
-            LOGGER.error(message, *args)
+            self.url_error = url_error
+            self.save()
             return
 
-        #
-        # NOTE: we could also get it eventually from r.headers['link'],
-        #       which contains '<another_url>'. We need to strip out
-        #       the '<>', and re-absolutize this link, because in the
-        #       example it's another redirector. Also r.links is a good
-        #       candidate but in the example I used, it contains the
-        #       shortlink, which must be re-resolved too.
-        #
-        #       So: as we already are at the final address *now*, no need
-        #       bothering re-following another which would lead us to the
-        #       the same final place.
-        #
-
-        final_url = self.absolutize_url_post_process(requests_response)
-
         if final_url != self.url:
 
             # Just for displaying purposes, see below.
@@ -706,7 +891,11 @@ class Article(Document, DocumentHelperMixin):
                 statsd.gauge('articles.counts.url_errors', -1, delta=True)
 
             statsd.gauge('articles.counts.absolutes', 1, delta=True)
-            self.update(set__url_absolute=True, set__url_error='')
+
+            # update() doesn't go through pre_save.
+            self.url_absolute = True
+            self.update(set__url_absolute=True, set__url_error='',
+                        set__is_good=self.compute_is_good())
             self.safe_reload()
 
         return True
@@ -887,38 +1076,52 @@ class Article(Document, DocumentHelperMixin):
             attributes as they are.
         """
 
-        need_reload = False
+        # Avoid an import cycle.
+        from .read import Read
 
-        for feed in duplicate.feeds:
-            try:
-                self.update(add_to_set__feeds=feed)
+        if self.__class__.merge_duplicates_feeds({duplicate.id: self.id}):
+            self.safe_reload()
 
-            except:
-                # We have to continue to replace reads,
-                # and reload() at the end of the method.
-                LOGGER.exception(u'Could not add feed %s to feeds of '
-                                 u'article %s!', feed, self)
-            else:
-                need_reload = True
+        Read.replace_duplicates_bulk({duplicate.id: self.id})
 
-        if need_reload:
-            self.safe_reload()
+        LOGGER.info(u'Article %s replaced by %s everywhere.', duplicate, self)
 
-        for read in duplicate.reads:
-            read.article = self
+    @classmethod
+    def merge_duplicates_feeds(cls, duplicates):
+        """ Add the feeds of duplicates to their masters, with one
+            query and one update for each master.
 
-            try:
-                read.save()
+            :param duplicates: a ``{duplicate_id: master_id}`` dict.
 
-            except (NotUniqueError, DuplicateKeyError):
-                # Already registered, simply delete the read.
-                read.delete()
+            Returns the number of updated masters.
+        """
+
+        if not duplicates:
+            return 0
+
+        collection      = cls._get_collection()
+        feeds_by_master = {}
+
+        for duplicate in collection.find({'_id': {'$in': duplicates.keys()},
+                                          'feeds': {'$ne': []}},
+                                         fields=['feeds']):
+            feeds_by_master.setdefault(duplicates[duplicate['_id']],
+                                       set()).update(duplicate['feeds'])
+
+        updated = 0
+
+        for master_id, feeds_ids in feeds_by_master.items():
+            try:
+                updated += collection.update(
+                    {'_id': master_id},
+                    {'$addToSet': {'feeds': {'$each': list(feeds_ids)}}}
+                )['n']
 
             except:
-                LOGGER.exception(u'Could not replace current article in '
-                                 u'read %s by %s!' % (read, self))
+                LOGGER.exception(u'Could not add feeds %s to feeds of '
+                                 u'article %s!', feeds_ids, master_id)
 
-        LOGGER.info(u'Article %s replaced by %s everywhere.', duplicate, self)
+        return updated
 
     @classmethod
     def create_article(cls, title, url, feeds, **kwargs):
@@ -938,15 +1141,22 @@ class Article(Document, DocumentHelperMixin):
 
         new_article = cls(title=title, url=url)
 
-        try:
-            new_article.save()
+        # Feeds often route the same items through the same redirectors:
+        # when the final URL is already known, don't create a duplicate
+        # that would just be found out later by absolutize_url().
+        cur_article = None if reset_url else cls.get_by_resolved_url(url)
+
+        if cur_article is None:
+            try:
+                new_article.save()
+
+            except (DuplicateKeyError, NotUniqueError):
+                cur_article = cls.objects.get(url=url)
 
-        except (DuplicateKeyError, NotUniqueError):
+        if cur_article is not None:
             LOGGER.info(u'Duplicate article “%s” (url: %s) in feed(s) %s.',
                         title, url, u', '.join(unicode(f) for f in feeds))
 
-            cur_article = cls.objects.get(url=url)
-
             created_retval = False
 
             if len(feeds) == 1 and feeds[0] not in cur_article.feeds:
@@ -963,43 +1173,41 @@ class Article(Document, DocumentHelperMixin):
 
             return cur_article, created_retval
 
-        else:
-
-            tags = kwargs.pop('tags', [])
+        tags = kwargs.pop('tags', [])
 
-            if tags:
-                new_article.update(add_to_set__tags=tags)
-                new_article.safe_reload()
+        if tags:
+            new_article.update(add_to_set__tags=tags)
+            new_article.safe_reload()
 
-            need_save = False
+        need_save = False
 
-            if kwargs:
-                need_save = True
-                for key, value in kwargs.items():
-                    setattr(new_article, key, value)
+        if kwargs:
+            need_save = True
+            for key, value in kwargs.items():
+                setattr(new_article, key, value)
 
-            if reset_url:
-                need_save       = True
-                new_article.url = \
-                    ARTICLE_ORPHANED_BASE + unicode(new_article.id)
-                new_article.orphaned = True
-                statsd.gauge('articles.counts.orphaned', 1, delta=True)
+        if reset_url:
+            need_save       = True
+            new_article.url = \
+                ARTICLE_ORPHANED_BASE + unicode(new_article.id)
+            new_article.orphaned = True
+            statsd.gauge('articles.counts.orphaned', 1, delta=True)
 
-            if need_save:
-                # Need to save because we will reload just after.
-                new_article.save()
+        if need_save:
+            # Need to save because we will reload just after.
+            new_article.save()
 
-            if feeds:
-                for feed in feeds:
-                    new_article.update(add_to_set__feeds=feed)
+        if feeds:
+            for feed in feeds:
+                new_article.update(add_to_set__feeds=feed)
 
-                new_article.safe_reload()
+            new_article.safe_reload()
 
-            LOGGER.info(u'Created %sarticle %s in feed(s) %s.', u'orphaned '
-                        if reset_url else u'', new_article,
-                        u', '.join(unicode(f) for f in feeds))
+        LOGGER.info(u'Created %sarticle %s in feed(s) %s.', u'orphaned '
+                    if reset_url else u'', new_article,
+                    u', '.join(unicode(f) for f in feeds))
 
-            return new_article, True
+        return new_article, True
 
     def fetch_content_must_abort(self, force=False, commit=True):
 
@@ -1063,6 +1271,10 @@ class Article(Document, DocumentHelperMixin):
                         u'an internal caller: %s.', self, e)
             return
 
+        except WebSiteBusyException:
+            # Not an error, the caller task will defer the fetch.
+            raise
+
         except SoftTimeLimitExceeded, e:
             statsd.gauge('articles.counts.content_errors', 1, delta=True)
             self.content_error = str(e)
@@ -1170,14 +1382,12 @@ class Article(Document, DocumentHelperMixin):
             context['LANGUAGE_CODE'] = lang
             render_to_string('snippets/read/article-body.html', context)
 
-    @property
-    def is_good(self):
-        """ Return ``True`` if the current article
-            is ready to be seen by final users. """
+    def compute_is_good(self):
+        """ Return ``True`` if the current article is ready to be seen
+            by final users. Stored in :attr:`is_good` at each save.
 
-        #
-        # NOTE: sync the conditions with @Feed.good_articles
-        #
+            .. note:: sync the conditions with :meth:`sync_is_good`.
+        """
 
         if self.orphaned:
             return False
@@ -1193,6 +1403,39 @@ class Article(Document, DocumentHelperMixin):
 
         return True
 
+    @classmethod
+    def sync_is_good(cls):
+        """ Fix the stored :attr:`is_good` of all articles with two multi
+            updates, for the ones not saved since the field exists or
+            modified behind our back. Returns the ``(good, bad)`` numbers
+            of fixed articles.
+
+            .. note:: sync the conditions with :meth:`compute_is_good`.
+        """
+
+        good_spec = {'orphaned': {'$ne': True},
+                     'url_absolute': True,
+                     'duplicate_of': None,
+                     'content_type': {'$in': list(CONTENT_TYPES_FINAL)}}
+
+        bad_spec = {'$or': [{'orphaned': True},
+                            {'url_absolute': {'$ne': True}},
+                            {'duplicate_of': {'$ne': None}},
+                            {'content_type': {
+                                '$nin': list(CONTENT_TYPES_FINAL)}}]}
+
+        collection = cls._get_collection()
+
+        good = collection.update({'$and': [good_spec,
+                                           {'is_good': {'$ne': True}}]},
+                                 {'$set': {'is_good': True}}, multi=True)
+
+        bad = collection.update({'$and': [bad_spec,
+                                          {'is_good': {'$ne': False}}]},
+                                {'$set': {'is_good': False}}, multi=True)
+
+        return good['n'], bad['n']
+
     def activate_reads(self, force=False, verbose=False, extended_check=False):
 
         if self.is_good or force:
@@ -1331,8 +1574,9 @@ class Article(Document, DocumentHelperMixin):
             if ghost is None:
                 LOGGER.warning(u'Ghost module is not available, content of '
                                u'article %s will be incomplete.', self)
-                return requests.get(fetch_url,
-                                    headers=REQUEST_BASE_HEADERS).content
+
+                with WebSite.fetch_slot_for_url(fetch_url):
+                    return http_get(fetch_url).content
 
                 # The lock will raise an exception if it is already acquired.
                 with global_ghost_lock:
@@ -1344,7 +1588,8 @@ class Article(Document, DocumentHelperMixin):
                     #
                     return page
 
-        response = requests.get(fetch_url, headers=REQUEST_BASE_HEADERS)
+        with WebSite.fetch_slot_for_url(fetch_url):
+            response = http_get(fetch_url)
 
         content_type = response.headers.get('content-type', u'unspecified')
 
@@ -1665,6 +1910,11 @@ class Article(Document, DocumentHelperMixin):
             spipe.gauge('articles.counts.html', -1, delta=True)
             spipe.gauge('articles.counts.markdown', 1, delta=True)
 
+        # Warm the render cache, readers will get
+        # the HTML without any conversion CPU cost.
+        if len(self.content) > config.READ_ARTICLE_MIN_LENGTH:
+            self.render_content()
+
         if config.ARTICLE_FETCHING_DEBUG:
             LOGGER.info(u'————————— #%s Markdown %s —————————'
                         u'\n%s\n'
@@ -1746,6 +1996,13 @@ class Article(Document, DocumentHelperMixin):
             if commit:
                 self.save()
 
+    @classmethod
+    def signal_pre_save_handler(cls, sender, document, **kwargs):
+
+        article = document
+
+        article.is_good = article.compute_is_good()
+
     @classmethod
     def signal_post_save_handler(cls, sender, document,
                                  created=False, **kwargs):
@@ -1782,7 +2039,7 @@ class Article(Document, DocumentHelperMixin):
         # Randomize the absolutization a little, to avoid
         # http://dev.1flow.net/development/1flow-dev-alternate/group/1243/
         # as much as possible. This is not yet a full-featured solution,
-        # but it's completed by the `fetch_limit` thing.
+        # but it's completed by the `WebSite.fetch_slot()` thing.
         #
         # Absolutization conditions everything else. If it doesn't succeed:
         #   - no bother trying to post-process author data for example,
@@ -1866,19 +2123,45 @@ class OriginalData(Document, DocumentHelperMixin):
 
 
 def Tag_replace_duplicate_in_articles_method(self, duplicate, force=False):
+    """ Replace :param:`duplicate` by myself in the tags of all articles
+        carrying it, and in the tags of their reads.
+
+        Articles are handled by chunks of ``config.TAG_MERGE_CHUNK_SIZE``,
+        with two multi updates on articles and two on reads for each chunk
+        (MongoDB cannot pull and add to the same array at once). Returns
+        a tuple ``(articles_count, reads_count)`` of updated documents.
+    """
 
     #
     # TODO: update search engine indexes…
     #
 
-    for article in Article.objects(tags=duplicate).no_cache():
-        for read in article.reads:
-            if duplicate in read.tags:
-                read.update(pull__tags=duplicate)
-                read.update(add_to_set__tags=self)
+    # Avoid an import cycle.
+    from .read import Read
+
+    articles_ids   = list(Article.objects(tags=duplicate).scalar('id'))
+    articles_total = len(articles_ids)
+    chunk_size     = config.TAG_MERGE_CHUNK_SIZE
+    articles_count = 0
+    reads_count    = 0
+
+    for index in xrange(0, articles_total, chunk_size):
+        chunk = articles_ids[index:index + chunk_size]
+
+        # Add first, else the documents would not match anymore.
+        articles = Article.objects(id__in=chunk, tags=duplicate)
+        articles.update(add_to_set__tags=self)
+        articles_count += articles.update(pull__tags=duplicate)
+
+        reads = Read.objects(article__in=chunk, tags=duplicate)
+        reads.update(add_to_set__tags=self)
+        reads_count += reads.update(pull__tags=duplicate)
+
+        LOGGER.info(u'Tag %s replaced by %s in %s/%s articles (%s reads) '
+                    u'so far.', duplicate, self, articles_count,
+                    articles_total, reads_count)
 
-        article.update(pull__tags=duplicate)
-        article.update(add_to_set__tags=self)
+    return articles_count, reads_count
 
 
 Tag.replace_duplicate_in_articles = Tag_replace_duplicate_in_articles_method
@@ -52,8 +52,10 @@ import sys
 import errno
 import logging
 import requests
+import threading
 
 from statsd import statsd
+from cookielib import DefaultCookiePolicy
 from operator import attrgetter
 from constance import config
 
@@ -157,6 +159,130 @@ class NotTextHtmlException(Exception):
         self.response = response
 
 
+class ResponseTooLargeException(Exception):
+    """ Raised by :func:`http_get` when a response body exceeds the
+        configured size, to avoid eating a worker memory. """
+    def __init__(self, message, response):
+        Exception.__init__(self, message)
+        self.response = response
+
+
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••• pooled HTTP sessions
+
+HTTP_SESSION      = {}
+HTTP_SESSION_LOCK = threading.Lock()
+
+
+def http_session():
+    """ Return the HTTP session of the current worker process. It keeps
+        connections alive between requests, with one pool of at most
+        ``config.HTTP_POOL_PER_HOST`` connections for each of the last
+        ``config.HTTP_POOL_HOSTS`` hosts.
+
+        Created lazily, and again after a fork: celery workers must not
+        share sockets with their parent. Like ``requests.get()``, it keeps
+        no cookie between requests.
+    """
+
+    with HTTP_SESSION_LOCK:
+        if HTTP_SESSION.get('pid') != os.getpid():
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=config.HTTP_POOL_HOSTS,
+                pool_maxsize=config.HTTP_POOL_PER_HOST,
+                max_retries=requests.adapters.DEFAULT_RETRIES)
+
+            session = requests.Session()
+            session.headers.update(REQUEST_BASE_HEADERS)
+
+            # The session is shared by all sites, feeds and articles of
+            # the worker: no cookie must leak from a fetch to the next.
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+            HTTP_SESSION.update(pid=os.getpid(), session=session,
+                                adapter=adapter)
+
+        return HTTP_SESSION['session']
+
+
+def http_get(url, timeout=None, max_size=None, **kwargs):
+    """ ``requests.get()`` through :func:`http_session`, with a default
+        timeout (``config.HTTP_FETCH_TIMEOUT``) and a body limited to
+        ``config.HTTP_FETCH_MAX_SIZE`` bytes (``0`` for no limit).
+
+        Raises :class:`ResponseTooLargeException` if the body is bigger.
+    """
+
+    if max_size is None:
+        max_size = config.HTTP_FETCH_MAX_SIZE
+
+    response = http_session().get(
+        url, stream=True, timeout=timeout or config.HTTP_FETCH_TIMEOUT,
+        **kwargs)
+
+    if max_size:
+        if int(response.headers.get('content-length', None) or 0) > max_size:
+            response.close()
+            raise ResponseTooLargeException(u'Response of %s is larger than '
+                                            u'%s bytes.' % (url, max_size),
+                                            response=response)
+
+        size   = 0
+        chunks = []
+
+        for chunk in response.iter_content(64 * 1024):
+            size += len(chunk)
+
+            if size > max_size:
+                response.close()
+                raise ResponseTooLargeException(u'Response of %s is larger '
+                                                u'than %s bytes.'
+                                                % (url, max_size),
+                                                response=response)
+
+            chunks.append(chunk)
+
+        # What `response.content` would have done, without the limit.
+        response._content = b''.join(chunks)
+
+    else:
+        # Read it now, for the connection to go back to the pool.
+        response.content
+
+    return response
+
+
+def http_pool_stats():
+    """ Connections reuse statistics of the current worker process pools.
+
+        ``connections`` were opened to serve ``requests``, the others
+        reused an alive one.
+    """
+
+    stats = {'hosts': 0, 'requests': 0, 'connections': 0, 'reused': 0}
+
+    with HTTP_SESSION_LOCK:
+        if HTTP_SESSION.get('pid') != os.getpid():
+            return stats
+
+        pools = HTTP_SESSION['adapter'].poolmanager.pools
+
+        for key in pools.keys():
+            pool = pools.get(key)
+
+            if pool is None:
+                continue
+
+            stats['hosts']       += 1
+            stats['requests']    += pool.num_requests
+            stats['connections'] += pool.num_connections
+
+    stats['reused'] = max(0, stats['requests'] - stats['connections'])
+
+    return stats
+
+
 class DocumentHelperMixin(object):
     """ Because, as of MongoEngine 0.8.3,
         subclassing `Document` is not possible o_O
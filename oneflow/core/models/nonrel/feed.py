@@ -19,16 +19,26 @@
 
 """
 
+import redis
+import hashlib
 import logging
+import calendar
 import requests
+import threading
 import feedparser
 
+from collections import OrderedDict
+from urlparse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from statsd import statsd
 from celery import task
 from constance import config
 
 from xml.sax import SAXParseException
 
+from pymongo.errors import DuplicateKeyError
+
 from mongoengine import Q, Document, NULLIFY, PULL
 from mongoengine.fields import (IntField, StringField, URLField, BooleanField,
                                 ListField, ReferenceField, DateTimeField)
@@ -37,11 +47,11 @@ from mongoengine.errors import ValidationError
 #from cache_utils.decorators import cached
 
 from django.conf import settings
+from django.utils.http import http_date
 from django.utils.translation import ugettext_lazy as _
 from django.core.validators import URLValidator
 
 from ....base.utils import (RedisExpiringLock,
-                            RedisSemaphore,
                             HttpResponseLogProcessor)
 
 from ....base.fields import IntRedisDescriptor, DatetimeRedisDescriptor
@@ -54,23 +64,31 @@ from .common import (DocumentHelperMixin,
                      FeedIsHtmlPageException,
                      FeedFetchException,
                      CONTENT_NOT_PARSED,
+                     REQUEST_BASE_HEADERS,
+                     http_get, http_pool_stats,
                      ORIGIN_TYPE_FEEDPARSER,
                      ORIGIN_TYPE_WEBIMPORT,
                      USER_FEEDS_SITE_URL,
                      SPECIAL_FEEDS_DATA)
                      # CACHE_ONE_WEEK)
 from .tag import Tag
-from .article import Article
+from .website import WebSite, WebSiteBusyException
+from .article import Article, OriginalData, article_post_create_task
 from .user import User
 
 LOGGER                = logging.getLogger(__name__)
 feedparser.USER_AGENT = settings.DEFAULT_USER_AGENT
 
+REDIS = redis.StrictRedis(host=settings.REDIS_HOST,
+                          port=settings.REDIS_PORT,
+                          db=settings.REDIS_DB)
+
 __all__ = ('feed_update_latest_article_date_published',
            'feed_update_recent_articles_count',
            'feed_update_subscriptions_count',
            'feed_update_all_articles_count',
            'feed_refresh',
+           'feed_refresh_many',
            'Feed',
 
            'feed_all_articles_count_default',
@@ -155,6 +173,12 @@ def feed_refresh(feed_id, *args, **kwargs):
     return feed.refresh(*args, **kwargs)
 
 
+@task(name='Feed.refresh_many', queue='medium')
+def feed_refresh_many(feeds_ids, *args, **kwargs):
+
+    return Feed.refresh_many(Feed.objects(id__in=feeds_ids), *args, **kwargs)
+
+
 class Feed(Document, DocumentHelperMixin):
     name           = StringField(verbose_name=_(u'name'))
     url            = URLField(unique=True, verbose_name=_(u'url'))
@@ -199,8 +223,12 @@ class Feed(Document, DocumentHelperMixin):
                               verbose_name=_(u'fetch interval'))
     last_fetch     = DateTimeField(verbose_name=_(u'last fetch'))
 
-    # TODO: move this into WebSite to avoid too much parallel fetches
-    # when using multiple feeds from the same origin website.
+    # Denormalized `last_fetch + fetch_interval`, maintained in pre_save,
+    # for refresh_all_feeds() to query only the feeds which are due.
+    next_fetch     = DateTimeField(verbose_name=_(u'next fetch'))
+
+    # Not used anymore: parallel fetches are
+    # limited per web site, see `WebSite.fetch_slot()`.
     fetch_limit_nr = IntField(default=config.FEED_FETCH_PARALLEL_LIMIT,
                               verbose_name=_(u'fetch limit'),
                               help_text=_(u'The maximum number of articles '
@@ -214,6 +242,9 @@ class Feed(Document, DocumentHelperMixin):
     last_etag      = StringField(verbose_name=_(u'last etag'))
     last_modified  = StringField(verbose_name=_(u'modified'))
 
+    # For servers that ignore conditional GETs but send the same bytes.
+    last_body_digest = StringField(verbose_name=_(u'last body digest'))
+
     mail_warned    = ListField(StringField())
     errors         = ListField(StringField())
     options        = ListField(IntField())
@@ -247,6 +278,7 @@ class Feed(Document, DocumentHelperMixin):
         'indexes': [
             'name',
             'site_url',
+            'next_fetch',
         ]
     }
 
@@ -372,34 +404,6 @@ class Feed(Document, DocumentHelperMixin):
             self.__refresh_lock = RedisExpiringLock(self, lock_name='fetch')
             return self.__refresh_lock
 
-    @property
-    def fetch_limit(self):
-        """ XXX: not used until correctly implemented.
-            I removed the code calling this method on 20130910.
-        """
-
-        try:
-            return self.__limit_semaphore
-
-        except AttributeError:
-            self.__limit_semaphore = RedisSemaphore(self, self.fetch_limit_nr)
-            return self.__limit_semaphore
-
-    def set_fetch_limit(self):
-        """ XXX: not used until correctly implemented.
-            I removed the code calling this method on 20130910.
-        """
-
-        new_limit = self.fetch_limit.set_limit()
-        cur_limit = self.fetch_limit_nr
-
-        if cur_limit != new_limit:
-            self.fetch_limit_nr = new_limit
-            self.save()
-
-            LOGGER.info(u'Feed %s parallel fetch limit set to %s.',
-                        self, new_limit)
-
     #
     # NOTE: this is hard-coded in the various feed creation methods.
     #
@@ -418,7 +422,7 @@ class Feed(Document, DocumentHelperMixin):
 
         URLValidator()(feed_url)
 
-        requests_response = requests.get(feed_url)
+        requests_response = http_get(feed_url)
 
         if not requests_response.ok or requests_response.status_code != 200:
             raise Exception(u'Requests response is not OK/200, aborting')
@@ -563,6 +567,26 @@ class Feed(Document, DocumentHelperMixin):
 
                     yield link.get('href')
 
+    @classmethod
+    def signal_pre_save_handler(cls, sender, document, **kwargs):
+
+        feed = document
+
+        if not (feed.pk is None or getattr(feed, '_created', False)
+                or set(('last_fetch', 'fetch_interval')).intersection(
+                    feed._changed_fields)):
+            # Don't overwrite the lease set by `refresh_all_feeds()`
+            # when the feed is saved for any other reason.
+            return
+
+        if feed.last_fetch is None:
+            # Never fetched: due immediately.
+            feed.next_fetch = None
+
+        else:
+            feed.next_fetch = feed.last_fetch + timedelta(
+                seconds=feed.fetch_interval)
+
     @classmethod
     def signal_post_save_handler(cls, sender, document,
                                  created=False, **kwargs):
@@ -610,23 +634,12 @@ class Feed(Document, DocumentHelperMixin):
             real numbers.
         """
 
-        #
-        # NOTE: sync the conditions with @Article.is_good
-        #       and invert them in @Feed.bad_articles
-        #
-
-        return self.articles(orphaned__ne=True, url_absolute=True).filter(
-            Q(duplicate_of__exists=False) | Q(duplicate_of=None))
+        return self.articles(is_good=True)
 
     @property
     def bad_articles(self):
 
-        #
-        # NOTE: invert these conditions in @Feed.good_articles
-        #
-
-        return self.articles(Q(orphaned=True) | Q(url_absolute=False)
-                             | Q(duplicate_of__ne=None))
+        return self.articles(is_good__ne=True)
 
     def get_articles(self, limit=None):
         """ A parameter-able version of the :attr:`articles` property. """
@@ -767,9 +780,10 @@ class Feed(Document, DocumentHelperMixin):
         # Don't forget the parenthesis else we return ``False`` everytime.
         return new_article, created or (None if mutualized else False)
 
-    def create_article_from_feedparser(self, article, feed_tags):
-        """ Take a feedparser item and a list of Feed subscribers and
-            feed tags, and create the corresponding Article and Read(s). """
+    def parse_feedparser_entry(self, article, feed_tags):
+        """ Extract from a feedparser item the values needed to create the
+            corresponding :class:`Article`, and return them as a ``dict``.
+        """
 
         feedparser_content = getattr(article, 'content', CONTENT_NOT_PARSED)
 
@@ -800,23 +814,105 @@ class Feed(Document, DocumentHelperMixin):
                     # http://dev.1flow.net/webapps/1flow/group/4082/
                     if t['term'] is not None), origin=self) | set(feed_tags))
 
-        try:
-            new_article, created = Article.create_article(
-                # Sometimes feedparser gives us URLs with spaces in them.
-                # Using the full `urlquote()` on an already url-quoted URL
-                # could be very destructive, thus we patch only this case.
-                #
-                # If there is no `.link`, we get '' to be able to `replace()`,
-                # but in fine `None` is a more regular "no value" mean. Sorry
-                # for the weird '' or None that just does the job.
-                url=getattr(article, 'link', '').replace(' ', '%20') or None,
+        return {
+            # Sometimes feedparser gives us URLs with spaces in them.
+            # Using the full `urlquote()` on an already url-quoted URL
+            # could be very destructive, thus we patch only this case.
+            #
+            # If there is no `.link`, we get '' to be able to `replace()`,
+            # but in fine `None` is a more regular "no value" mean. Sorry
+            # for the weird '' or None that just does the job.
+            'url': getattr(article, 'link', '').replace(' ', '%20') or None,
+
+            # We *NEED* a title, but as we have no article.lang yet,
+            # it must be language independant as much as possible.
+            'title': getattr(article, 'title', u' '),
+
+            'excerpt': content,
+            'date_published': date_published,
+            'tags': tags,
+        }
+
+    @staticmethod
+    def entry_fingerprint(entry):
+        """ A short hash of what identifies a feedparser entry and its
+            content. An edited entry gets a new fingerprint. """
 
-                # We *NEED* a title, but as we have no article.lang yet,
-                # it must be language independant as much as possible.
-                title=getattr(article, 'title', u' '),
+        contents = [c.get('value', u'') for c in entry.get('content', [])]
 
-                excerpt=content, date_published=date_published,
-                feeds=[self], tags=tags, origin_type=ORIGIN_TYPE_FEEDPARSER)
+        return hashlib.sha1(u'\n'.join(
+            unicode(part or u'') for part in [entry.get('id'),
+                                              entry.get('link'),
+                                              entry.get('title'),
+                                              entry.get('summary')]
+            + contents).encode('utf-8')).hexdigest()[:16]
+
+    @property
+    def seen_entries_key(self):
+
+        return 'feeds:seen:%s' % self.id
+
+    def filter_seen_entries(self, entries, force=False):
+        """ Drop the entries already processed by a previous refresh,
+            checking their fingerprints in one REDIS round-trip. Returns
+            ``(entries, fingerprints)``: the remaining entries, and their
+            fingerprints for :meth:`remember_seen_entries`.
+
+            With ``force``, nothing is dropped.
+        """
+
+        fingerprints = [Feed.entry_fingerprint(entry) for entry in entries]
+
+        if force or not fingerprints:
+            return list(entries), fingerprints
+
+        key  = self.seen_entries_key
+        pipe = REDIS.pipeline(transaction=False)
+
+        for fingerprint in fingerprints:
+            pipe.zscore(key, fingerprint)
+
+        unseen = [(entry, fingerprint) for entry, fingerprint, score
+                  in zip(entries, fingerprints, pipe.execute())
+                  if score is None]
+
+        return ([entry for entry, _ in unseen],
+                [fingerprint for _, fingerprint in unseen])
+
+    def remember_seen_entries(self, fingerprints):
+        """ Keep only the ``config.FEED_SEEN_ENTRIES_MAX`` most recently
+            seen, for ``config.FEED_SEEN_ENTRIES_TTL`` seconds after the
+            last refresh. """
+
+        if not fingerprints:
+            return
+
+        key   = self.seen_entries_key
+        score = calendar.timegm(now().utctimetuple())
+        args  = []
+
+        for fingerprint in fingerprints:
+            args.extend((score, fingerprint))
+
+        pipe = REDIS.pipeline()
+        pipe.zadd(key, *args)
+        pipe.zremrangebyrank(key, 0, -config.FEED_SEEN_ENTRIES_MAX - 1)
+        pipe.expire(key, config.FEED_SEEN_ENTRIES_TTL)
+        pipe.execute()
+
+    def create_article_from_feedparser(self, article, feed_tags):
+        """ Take a feedparser item and a list of Feed subscribers and
+            feed tags, and create the corresponding Article and Read(s). """
+
+        values = self.parse_feedparser_entry(article, feed_tags)
+        date_published = values['date_published']
+
+        try:
+            new_article, created = Article.create_article(
+                url=values['url'], title=values['title'],
+                excerpt=values['excerpt'], date_published=date_published,
+                feeds=[self], tags=values['tags'],
+                origin_type=ORIGIN_TYPE_FEEDPARSER)
 
         except:
             # NOTE: duplication handling is already
@@ -859,6 +955,205 @@ class Feed(Document, DocumentHelperMixin):
         # Don't forget the parenthesis else we return ``False`` everytime.
         return created or (None if mutualized else False)
 
+    def create_articles_from_feedparser_bulk(self, entries, feed_tags):
+        """ Batched version of :meth:`create_article_from_feedparser`, for
+            all entries of a fetch at once. Returns a ``(new_articles,
+            mutualized, duplicates)`` tuple, suitable for
+            :meth:`throttle_fetch_interval`.
+
+            All entries URLs are checked against the database in one query.
+            New articles are created with one bulk insert, mutualized ones
+            get the current feed with one multi-update, and the missing
+            reads of all subscribers are created in one bulk insert.
+
+            Entries without URL (they will be orphaned) and entries
+            inserted by a concurrent worker in the meantime go through
+            the unitary :meth:`create_article_from_feedparser`.
+
+            .. note:: raw inserts bypass the MongoEngine signals, thus the
+                post-create tasks of new articles are launched here.
+        """
+
+        # Avoid an import cycle.
+        from .read import Read
+
+        new_articles = 0
+        duplicates   = 0
+        mutualized   = 0
+        unitary      = []
+        entries_data = OrderedDict()
+
+        for entry in entries:
+            if not getattr(entry, 'link', None):
+                unitary.append(entry)
+                continue
+
+            values = self.parse_feedparser_entry(entry, feed_tags)
+            url    = clean_url(values['url'])
+
+            if url in entries_data:
+                # Some feeds carry the same item more than once.
+                duplicates += 1
+                continue
+
+            values['url']     = url
+            values['entry']   = entry
+            entries_data[url] = values
+
+        if entries_data:
+            # Entries coming through redirectors may already exist under
+            # their absolutized URL; look these up too, without fetching.
+            resolved = Article.resolved_urls_get(entries_data.keys())
+
+            existing = dict((doc['url'], doc) for doc
+                            in Article._get_collection().find(
+                                {'url': {'$in': list(set(
+                                    entries_data.keys() + resolved.values()
+                                ))}},
+                                fields=['url', 'feeds', 'tags',
+                                        'is_good']))
+        else:
+            resolved = {}
+            existing = {}
+
+        mutualized_ids = []
+        seen_ids       = set()
+        read_articles  = []
+        to_insert      = []
+        tags_ids       = set()
+
+        for url, values in entries_data.items():
+            doc = existing.get(url, None)
+
+            if doc is None and url in resolved:
+                doc = existing.get(resolved[url], None)
+
+            if doc is None:
+                article = Article(url=url, title=values['title'],
+                                  excerpt=values['excerpt'],
+                                  date_published=values['date_published'],
+                                  feeds=[self], tags=values['tags'],
+                                  origin_type=ORIGIN_TYPE_FEEDPARSER)
+                try:
+                    article.validate()
+
+                except ValidationError:
+                    unitary.append(values['entry'])
+
+                else:
+                    to_insert.append((values, article, article.to_mongo()))
+
+                continue
+
+            if doc['_id'] in seen_ids:
+                # Two entry URLs redirecting to the same article.
+                duplicates += 1
+                continue
+
+            seen_ids.add(doc['_id'])
+
+            if self.id in (getattr(f, 'id', f) for f in doc.get('feeds', [])):
+                duplicates += 1
+
+            else:
+                mutualized += 1
+                mutualized_ids.append(doc['_id'])
+
+            doc_tags_ids = [getattr(t, 'id', t) for t in doc.get('tags', [])]
+            tags_ids.update(doc_tags_ids)
+
+            read_articles.append((doc['_id'], doc.get('is_good', False),
+                                  doc_tags_ids))
+
+        if mutualized_ids:
+            Article.objects(id__in=mutualized_ids).update(
+                add_to_set__feeds=self)
+
+        if tags_ids:
+            # Reads need real documents for their generic references.
+            tags_by_id    = dict((t.id, t) for t in
+                                 Tag.objects(id__in=list(tags_ids)))
+            read_articles = [(article_id, is_good,
+                              [tags_by_id[t] for t in article_tags
+                               if t in tags_by_id])
+                             for article_id, is_good, article_tags
+                             in read_articles]
+
+        if to_insert:
+            documents = [document for _, _, document in to_insert]
+
+            try:
+                Article._get_collection().insert(documents,
+                                                 continue_on_error=True)
+
+            except DuplicateKeyError:
+                # Another feed created some of these articles in the
+                # meantime. Only the really inserted ones are ours.
+                inserted_ids = set(doc['_id'] for doc in
+                                   Article._get_collection().find(
+                                       {'_id': {'$in': [d['_id'] for d
+                                                        in documents]}},
+                                       fields=['_id']))
+            else:
+                inserted_ids = set(d['_id'] for d in documents)
+
+            original_data = []
+
+            for values, article, document in to_insert:
+                if document['_id'] not in inserted_ids:
+                    unitary.append(values['entry'])
+                    continue
+
+                article.id = document['_id']
+                new_articles += 1
+
+                original_data.append(OriginalData(
+                    article=article,
+                    feedparser=unicode(values['entry'])).to_mongo())
+
+                # Freshly created, the article can't be good yet.
+                read_articles.append((article.id, False, values['tags']))
+
+                date_published = values['date_published']
+
+                if date_published is not None and \
+                        date_published > self.latest_article_date_published:
+                    self.latest_article_date_published = date_published
+
+                article_post_create_task.delay(article.id)
+
+            if original_data:
+                try:
+                    OriginalData._get_collection().insert(
+                        original_data, continue_on_error=True)
+
+                except:
+                    # See create_article_from_feedparser() for why.
+                    LOGGER.exception(u'Could not create articles content '
+                                     u'in archive database.')
+
+        if new_articles or mutualized:
+            self.recent_articles_count += new_articles + mutualized
+            self.all_articles_count    += new_articles + mutualized
+
+        if read_articles:
+            Read.create_reads_bulk(read_articles,
+                                   self.subscriptions.select_related())
+
+        for entry in unitary:
+            created = self.create_article_from_feedparser(entry, feed_tags)
+
+            if created:
+                new_articles += 1
+
+            elif created is False:
+                duplicates += 1
+
+            else:
+                mutualized += 1
+
+        return new_articles, mutualized, duplicates
+
     def build_refresh_kwargs(self):
 
         kwargs = {}
@@ -904,7 +1199,7 @@ class Feed(Document, DocumentHelperMixin):
             if force:
                 LOGGER.warning(u'Forcing refresh for feed %s, despite of '
                                u'lock already acquired.', self)
-                self.refresh_lock.release()
+                self.refresh_lock.release(force=True)
                 self.refresh_lock.acquire()
             else:
                 LOGGER.info(u'Refresh for %s already running, aborting.', self)
@@ -1070,32 +1365,84 @@ class Feed(Document, DocumentHelperMixin):
 
         LOGGER.info(u'Refreshing feed %s…', self)
 
-        feedparser_kwargs, http_logger = self.build_refresh_kwargs()
-        parsed_feed = feedparser.parse(self.url, **feedparser_kwargs)
+        feedparser_kwargs = self.build_refresh_kwargs()[0]
 
-        # In case of a redirection, just check the last hop HTTP status.
         try:
-            feed_status = http_logger.log[-1]['status']
+            with WebSite.fetch_slot_for_url(self.url):
+                response = self.fetch_raw(feedparser_kwargs)
+
+        except WebSiteBusyException, e:
+            LOGGER.info(u'Refresh of feed %s deferred: %s', self, e)
+            self.refresh_lock.release()
+            raise feed_refresh.retry((self.id, ), exc=e, countdown=e.countdown)
 
-        except IndexError, e:
+        except (requests.ConnectionError, requests.Timeout), e:
             # The website could not be reached? Network
             # unavailable? on my production server???
 
             # self.refresh_lock.release() ???
             raise feed_refresh.retry((self.id, ), exc=e)
 
-        # Stop on HTTP errors before stopping on feedparser errors,
-        # because he is much more lenient in many conditions.
-        if feed_status in (400, 401, 402, 403, 404, 500, 502, 503):
-            self.error(u'HTTP %s on %s' % (http_logger.log[-1]['status'],
-                       http_logger.log[-1]['url']), last_fetch=True)
+        except Exception, e:
+            self.error(u'Could not fetch %s: %s' % (self.url, e),
+                       last_fetch=True)
             return
 
-        try:
-            Feed.check_feedparser_error(parsed_feed, self)
+        parsed_feed, feed_status, body_digest = self.parse_raw(response,
+                                                               force=force)
 
-        except Exception, e:
-            self.close(reason=str(e))
+        # In case of a redirection, `response` is the last hop.
+        self.refresh_process(parsed_feed, feed_status, response.url,
+                             force=force, body_digest=body_digest)
+
+    def parse_raw(self, response, force=False):
+        """ Parse a response of :meth:`fetch_raw` with feedparser. Returns
+            a ``(parsed_feed, status, body_digest)`` tuple, suitable for
+            :meth:`refresh_process`.
+
+            A body identical to the last processed one is reported as a
+            304, without parsing it. With ``force``, it is parsed anyway.
+        """
+
+        if response.status_code == 304:
+            return None, 304, None
+
+        body_digest = hashlib.sha1(response.content).hexdigest()
+
+        if response.status_code == 200 and not force \
+                and body_digest == self.last_body_digest:
+            LOGGER.info(u'Same content as last time in feed %s.', self)
+            statsd.incr('feeds.refresh.fetch.global.same_body')
+            return None, 304, None
+
+        parsed_feed = feedparser.parse(
+            response.content,
+            response_headers=dict((key, response.headers[key])
+                                  for key in ('content-location',
+                                              'content-type', 'etag',
+                                              'last-modified')
+                                  if key in response.headers))
+
+        return parsed_feed, response.status_code, body_digest
+
+    def refresh_process(self, parsed_feed, feed_status, feed_url,
+                        force=False, body_digest=None):
+        """ Second half of :meth:`refresh`: everything that happens once
+            the feed has been downloaded and parsed, from HTTP status
+            checks to articles creation, fetch interval throttling and
+            lock release.
+
+            :param feed_url: the URL of the last hop, in case of redirects.
+            :param parsed_feed: can be ``None`` when ``feed_status`` is 304.
+            :param body_digest: from :meth:`parse_raw`, stored once the
+                entries have been processed.
+        """
+
+        # Stop on HTTP errors before stopping on feedparser errors,
+        # because he is much more lenient in many conditions.
+        if feed_status in (400, 401, 402, 403, 404, 500, 502, 503):
+            self.error(u'HTTP %s on %s' % (feed_status, feed_url),
+                       last_fetch=True)
             return
 
         if feed_status == 304:
@@ -1105,6 +1452,13 @@ class Feed(Document, DocumentHelperMixin):
                 spipe.incr('feeds.refresh.fetch.global.unchanged')
 
         else:
+            try:
+                Feed.check_feedparser_error(parsed_feed, self)
+
+            except Exception, e:
+                self.close(reason=str(e))
+                return
+
             tags = Tag.get_tags_set(getattr(parsed_feed, 'tags', []),
                                     origin=self)
 
@@ -1120,28 +1474,52 @@ class Feed(Document, DocumentHelperMixin):
             new_articles  = 0
             duplicates    = 0
             mutualized    = 0
+            entries       = parsed_feed.entries
+            fingerprints  = None
+
+            if config.FEED_SEEN_ENTRIES_ENABLED:
+                entries, fingerprints = self.filter_seen_entries(entries,
+                                                                 force=force)
+
+            # Entries seen in a previous refresh are duplicates: the
+            # throttling needs them, not the database.
+            seen = len(parsed_feed.entries) - len(entries)
 
             with statsd.pipeline() as spipe:
                 spipe.incr('feeds.refresh.fetch.global.updated')
+                spipe.incr('feeds.refresh.global.seen', seen)
 
-            for article in parsed_feed.entries:
-                created = self.create_article_from_feedparser(article, tags)
+            if config.FEED_REFRESH_BULK_ENABLED:
+                new_articles, mutualized, duplicates = \
+                    self.create_articles_from_feedparser_bulk(entries, tags)
 
-                if created:
-                    new_articles += 1
+            else:
+                for article in entries:
+                    created = self.create_article_from_feedparser(article,
+                                                                  tags)
 
-                elif created is False:
-                    duplicates += 1
+                    if created:
+                        new_articles += 1
 
-                else:
-                    mutualized += 1
+                    elif created is False:
+                        duplicates += 1
+
+                    else:
+                        mutualized += 1
+
+            duplicates += seen
+
+            # Only now, for the entries to be processed again
+            # if something went wrong during their creation.
+            self.remember_seen_entries(fingerprints)
 
             # Store the date/etag for next cycle. Doing it after the full
             # refresh worked ensures that in case of any exception during
             # the loop, the retried refresh will restart on the same
             # entries without loosing anything.
-            self.last_modified = getattr(parsed_feed, 'modified', None)
-            self.last_etag     = getattr(parsed_feed, 'etag', None)
+            self.last_modified    = getattr(parsed_feed, 'modified', None)
+            self.last_etag        = getattr(parsed_feed, 'etag', None)
+            self.last_body_digest = body_digest
 
             if not force:
                 # forcing the refresh is most often triggered by admins
@@ -1182,6 +1560,131 @@ class Feed(Document, DocumentHelperMixin):
         # terminate if called too early.
         self.refresh_lock.release()
 
+    def fetch_raw(self, feedparser_kwargs, timeout=None):
+        """ Download the feed with :func:`http_get`, implementing the same
+            etag / last-modified / referrer logic as :func:`feedparser.parse`
+            does with the output of :meth:`build_refresh_kwargs`.
+
+            This method doesn't touch the database nor the feed attributes,
+            it is meant to be run in fetcher threads by :meth:`refresh_many`.
+        """
+
+        headers = REQUEST_BASE_HEADERS.copy()
+
+        etag = feedparser_kwargs.get('etag', None)
+
+        if etag:
+            headers['If-None-Match'] = etag
+
+        modified = feedparser_kwargs.get('modified', None)
+
+        if modified:
+            if isinstance(modified, datetime):
+                modified = http_date(calendar.timegm(modified.utctimetuple()))
+
+            headers['If-Modified-Since'] = modified
+
+        referrer = feedparser_kwargs.get('referrer', None)
+
+        if referrer:
+            headers['Referer'] = referrer
+
+        return http_get(self.url, headers=headers,
+                        timeout=timeout or config.FEED_FETCH_TIMEOUT)
+
+    @classmethod
+    def refresh_many(cls, feeds, force=False):
+        """ Refresh a batch of feeds, downloading them concurrently in a
+            thread pool, with at most ``FEED_FETCH_CONCURRENT_PER_HOST``
+            simultaneous connections to the same host.
+
+            Only the HTTP round-trips run in threads. Parsing and articles
+            creation happen sequentially in the calling thread, via the
+            same :meth:`refresh_process` that :meth:`refresh` uses.
+        """
+
+        to_fetch = []
+
+        for feed in feeds:
+            feed.safe_reload()
+
+            if feed.refresh_must_abort(force=force):
+                feed.refresh_lock.release()
+                continue
+
+            to_fetch.append(feed)
+
+        if not to_fetch:
+            return
+
+        per_host  = config.FEED_FETCH_CONCURRENT_PER_HOST
+        timeout   = config.FEED_FETCH_TIMEOUT
+        hosts_sem = {}
+
+        for feed in to_fetch:
+            host = urlparse(feed.url).netloc
+
+            if host not in hosts_sem:
+                hosts_sem[host] = threading.BoundedSemaphore(per_host)
+
+        def fetch_one(feed, feedparser_kwargs):
+
+            with hosts_sem[urlparse(feed.url).netloc]:
+                with WebSite.fetch_slot_for_url(feed.url):
+                    return feed.fetch_raw(feedparser_kwargs, timeout=timeout)
+
+        LOGGER.info(u'Refreshing %s feeds concurrently…', len(to_fetch))
+
+        with ThreadPoolExecutor(
+                max_workers=config.FEED_FETCH_CONCURRENT_WORKERS) as executor:
+
+            futures = {}
+
+            for feed in to_fetch:
+                feedparser_kwargs = feed.build_refresh_kwargs()[0]
+
+                futures[executor.submit(fetch_one, feed,
+                                        feedparser_kwargs)] = feed
+
+            for future in as_completed(futures):
+                feed = futures[future]
+
+                try:
+                    response = future.result()
+
+                except WebSiteBusyException, e:
+                    LOGGER.info(u'Refresh of feed %s deferred: %s', feed, e)
+                    feed.refresh_lock.release()
+                    feed_refresh.apply_async((feed.id, force),
+                                             countdown=e.countdown)
+                    continue
+
+                except Exception, e:
+                    feed.error(u'Could not fetch %s: %s' % (feed.url, e),
+                               last_fetch=True)
+                    continue
+
+                try:
+                    parsed_feed, feed_status, body_digest = feed.parse_raw(
+                        response, force=force)
+
+                    feed.refresh_process(parsed_feed, feed_status,
+                                         response.url, force=force,
+                                         body_digest=body_digest)
+
+                except:
+                    LOGGER.exception(u'Concurrent refresh of feed %s '
+                                     u'failed.', feed)
+
+        pool_stats = http_pool_stats()
+
+        with statsd.pipeline() as spipe:
+            spipe.incr('feeds.refresh.concurrent.batches')
+            spipe.incr('feeds.refresh.concurrent.feeds', len(to_fetch))
+            spipe.gauge('http.pool.hosts', pool_stats['hosts'])
+            spipe.gauge('http.pool.requests', pool_stats['requests'])
+            spipe.gauge('http.pool.reused', pool_stats['reused'])
+
 
 # ——————————————————————————————————————————————————————— external delete rules
 #                                            Defined here to avoid import loops
@@ -20,12 +20,14 @@
 """
 
 import sys
+import redis
 import logging
 import operator
 import feedparser
 
 from celery import task
 
+from bson import ObjectId
 from pymongo.errors import DuplicateKeyError
 
 from mongoengine import Document, Q, CASCADE
@@ -35,26 +37,40 @@ from mongoengine.fields import (StringField, BooleanField,
                                 GenericReferenceField, DBRef)
 from mongoengine.errors import NotUniqueError, ValidationError
 
+from constance import config
+
 #from cache_utils.decorators import cached
 
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _, pgettext_lazy
 
+from ....base.fields import IntRedisDescriptor
 from ....base.utils.dateutils import now, timedelta, naturaldelta
 
 from .common import DocumentHelperMixin  # , CACHE_ONE_DAY
 
 from .folder import Folder
+from .preferences import Preferences
+from .feed import Feed
 from .subscription import Subscription, generic_check_subscriptions_method
 from .article import Article
-from .user import User
+from .user import User, user_reconcile_counters
 from .tag import Tag
 
 LOGGER                = logging.getLogger(__name__)
 feedparser.USER_AGENT = settings.DEFAULT_USER_AGENT
 
+REDIS = redis.StrictRedis(host=settings.REDIS_HOST,
+                          port=settings.REDIS_PORT,
+                          db=settings.REDIS_DB)
+
+READ_POST_CREATE_PENDING_KEY   = 'reads:post_create:pending'
+READ_POST_CREATE_SCHEDULED_KEY = 'reads:post_create:scheduled'
+READ_POST_CREATE_ATTEMPTS_KEY  = 'reads:post_create:attempts'
+READ_POST_CREATE_FAILED_KEY    = 'reads:post_create:failed'
+
 
-__all__ = ('read_post_create_task', 'Read', )
+__all__ = ('read_post_create_task', 'read_post_create_many_task', 'Read', )
 
 
 READ_BOOKMARK_TYPE_CHOICES = (
@@ -71,6 +87,12 @@ def read_post_create_task(read_id, *args, **kwargs):
     return read.post_create_task(*args, **kwargs)
 
 
+@task(name='Read.post_create_many', queue='high')
+def read_post_create_many_task(*args, **kwargs):
+
+    return Read.post_create_flush(*args, **kwargs)
+
+
 class Read(Document, DocumentHelperMixin):
     user = ReferenceField('User', reverse_delete_rule=CASCADE)
     article = ReferenceField('Article', unique_with='user',
@@ -525,9 +547,12 @@ class Read(Document, DocumentHelperMixin):
         'indexes': [
             'user',
             ('user', 'is_good'),
-            ('user', 'is_good', 'is_read'),
-            ('user', 'is_good', 'is_starred'),
-            ('user', 'is_good', 'is_bookmarked'),
+
+            # Reading lists, paginated from the last displayed read.
+            ('user', 'is_good', '-id'),
+            ('user', 'is_good', 'is_read', '-id'),
+            ('user', 'is_good', 'is_starred', '-id'),
+            ('user', 'is_good', 'is_bookmarked', '-id'),
             'article',
             ('article', 'is_good'),
         ]
@@ -564,7 +589,608 @@ class Read(Document, DocumentHelperMixin):
 
         if created:
             if read._db_name != settings.MONGODB_NAME_ARCHIVE:
-                read_post_create_task.delay(read.id)
+                cls.post_create_dispatch([read.id])
+
+    @classmethod
+    def create_reads_bulk(cls, articles, subscriptions, **kwargs):
+        """ Batched version of :meth:`Subscription.create_read`, for many
+            articles and many subscriptions at once. Returns the number of
+            created reads.
+
+            :param articles: an iterable of ``(article_id, is_good, tags)``
+                tuples, ``tags`` beiing :class:`Tag` documents.
+
+            :param subscriptions: an iterable of :class:`Subscription`,
+                whose ``user`` should already be dereferenced (eg. via
+                ``select_related()``) to avoid one query for each of them.
+
+            Existing reads are looked up in one query; those which miss
+            one of the subscriptions get it with one update for each
+            subscription. Missing reads are created in one bulk insert.
+            ``kwargs`` are set on new reads, as in ``create_read()``.
+
+            .. note:: raw inserts bypass the MongoEngine signals, thus the
+                post-create tasks of new reads are launched here.
+        """
+
+        articles = list(articles)
+
+        if not articles:
+            return 0
+
+        subscriptions_by_id   = {}
+        subscriptions_by_user = {}
+
+        for subscription in subscriptions:
+            subscriptions_by_id[subscription.id] = subscription
+            subscriptions_by_user.setdefault(subscription.user.id,
+                                             []).append(subscription)
+
+        if not subscriptions_by_user:
+            return 0
+
+        known     = set()
+        to_attach = {}
+
+        for read in cls._get_collection().find(
+                {'article': {'$in': [a[0] for a in articles]},
+                 'user': {'$in': subscriptions_by_user.keys()}},
+                fields=['article', 'user', 'subscriptions']):
+
+            known.add((read['user'], read['article']))
+
+            read_subscriptions = [getattr(s, 'id', s) for s
+                                  in read.get('subscriptions', [])]
+
+            # If another feed has already created the read, be sure the
+            # current one is registered in the read via the subscriptions.
+            for subscription in subscriptions_by_user.get(read['user'], []):
+                if subscription.id not in read_subscriptions:
+                    to_attach.setdefault(subscription.id,
+                                         []).append(read['_id'])
+
+        for subscription_id, reads_ids in to_attach.items():
+            cls.objects(id__in=reads_ids).update(
+                add_to_set__subscriptions=subscriptions_by_id[
+                    subscription_id])
+
+        new_reads = []
+
+        for article_id, is_good, tags in articles:
+            # XXX: todo remove this 'is not None', when database is clean…
+            tags = [t for t in tags if t is not None]
+
+            for user_id, user_subscriptions in subscriptions_by_user.items():
+                if (user_id, article_id) in known:
+                    continue
+
+                new_read = cls(article=article_id,
+                               user=user_subscriptions[0].user,
+                               subscriptions=user_subscriptions,
+                               tags=tags, is_good=is_good)
+
+                for key, value in kwargs.items():
+                    setattr(new_read, key, value)
+
+                new_reads.append((new_read, new_read.to_mongo()))
+
+        if not new_reads:
+            return 0
+
+        documents = [document for _, document in new_reads]
+
+        try:
+            cls._get_collection().insert(documents, continue_on_error=True)
+
+        except DuplicateKeyError:
+            # A concurrent worker created some of them in the meantime.
+            inserted_ids = set(doc['_id'] for doc in cls._get_collection(
+                               ).find({'_id': {'$in': [d['_id'] for d
+                                                       in documents]}},
+                                      fields=['_id']))
+        else:
+            inserted_ids = set(d['_id'] for d in documents)
+
+        created  = {}
+        unread   = {}
+        is_read  = kwargs.get('is_read', False)
+        new_ids  = []
+
+        for new_read, document in new_reads:
+            if document['_id'] not in inserted_ids:
+                continue
+
+            for subscription in new_read.subscriptions:
+                created[subscription.id] = created.get(subscription.id, 0) + 1
+
+                if not is_read:
+                    unread[subscription.id] = unread.get(subscription.id,
+                                                         0) + 1
+
+            new_ids.append(document['_id'])
+
+        cls.post_create_dispatch(new_ids)
+
+        # Update cached descriptors, once for each subscription.
+        for subscription_id, count in created.items():
+            subscription = subscriptions_by_id[subscription_id]
+            subscription.all_articles_count += count
+
+            if subscription_id in unread:
+                subscription.unread_articles_count += unread[subscription_id]
+
+        return len(inserted_ids)
+
+    @classmethod
+    def prefetch(cls, reads, user=None):
+        """ Dereference the articles (and their sources), subscriptions,
+            feeds, users and preferences of many reads with one ``$in``
+            query per collection, instead of one query per read and per
+            attribute when rendering a reading list. Returns the reads
+            as a ``list``.
+
+            :param user: the owner of the reads, if already loaded.
+        """
+
+        reads = list(reads)
+
+        if not reads:
+            return reads
+
+        def ref_id(value):
+            return getattr(value, 'id', value)
+
+        def in_bulk(document_class, ids):
+            ids = set(ids)
+            ids.discard(None)
+
+            return document_class.objects.in_bulk(list(ids)) if ids else {}
+
+        def attach(document, name, by_id):
+            """ Replace raw references by documents, without marking the
+                attribute as changed. Lists are left untouched if one
+                of their documents is missing. """
+
+            raw = document._data.get(name)
+
+            if raw is None:
+                return
+
+            if isinstance(raw, (list, tuple)):
+                documents = [by_id.get(ref_id(v)) for v in raw]
+
+                if None not in documents:
+                    document._data[name] = documents
+
+            elif ref_id(raw) in by_id:
+                document._data[name] = by_id[ref_id(raw)]
+
+        articles = in_bulk(Article, (ref_id(read._data.get('article'))
+                                     for read in reads))
+
+        sources = in_bulk(Article, (ref_id(article._data.get('source'))
+                                    for article in articles.values()))
+
+        subscriptions = in_bulk(Subscription, (
+            ref_id(subscription) for read in reads
+            for subscription in read._data.get('subscriptions') or []))
+
+        feeds = in_bulk(Feed, [ref_id(subscription._data.get('feed'))
+                               for subscription in subscriptions.values()]
+                        + [ref_id(feed) for article in articles.values()
+                           for feed in article._data.get('feeds') or []])
+
+        if user is None:
+            users = in_bulk(User, (ref_id(read._data.get('user'))
+                                   for read in reads))
+
+            preferences = in_bulk(Preferences, (
+                ref_id(one_user._data.get('preferences_data'))
+                for one_user in users.values()))
+
+            for one_user in users.values():
+                attach(one_user, 'preferences_data', preferences)
+
+        else:
+            # The same instance everywhere: its
+            # preferences are dereferenced only once.
+            users = {user.id: user}
+
+        for article in articles.values():
+            attach(article, 'source', sources)
+            attach(article, 'feeds', feeds)
+
+        for subscription in subscriptions.values():
+            attach(subscription, 'feed', feeds)
+
+        for read in reads:
+            attach(read, 'article', articles)
+            attach(read, 'subscriptions', subscriptions)
+            attach(read, 'user', users)
+
+        return reads
+
+    @classmethod
+    def activate_reads_bulk(cls, reads_ids):
+        """ Batched version of :meth:`activate`, for reads whose article is
+            already known to be good. Returns the number of activated reads.
+
+            Counters are computed with one aggregation grouped by user and
+            subscriptions, then the reads are switched with one multi
+            update; folders of a read are incremented only once, like in
+            :meth:`update_cached_descriptors`.
+        """
+
+        if not reads_ids:
+            return 0
+
+        collection = cls._get_collection()
+        spec       = {'_id': {'$in': list(reads_ids)}, 'is_good': {'$ne': True}}
+
+        groups = collection.aggregate([
+            {'$match': spec},
+            {'$project': {
+                'user': 1,
+                'subscriptions': 1,
+                'starred': {'$cond': [{'$eq': ['$is_starred', True]}, 1, 0]},
+                'bookmarked': {'$cond': [{'$eq': ['$is_bookmarked', True]},
+                                         1, 0]},
+                'unread': {'$cond': [{'$eq': ['$is_read', True]}, 0, 1]},
+            }},
+            {'$group': {
+                '_id': {'user': '$user', 'subscriptions': '$subscriptions'},
+                'all': {'$sum': 1},
+                'starred': {'$sum': '$starred'},
+                'bookmarked': {'$sum': '$bookmarked'},
+                'unread': {'$sum': '$unread'},
+            }},
+        ])['result']
+
+        activated = collection.update(spec, {'$set': {'is_good': True}},
+                                      multi=True)['n']
+
+        counts_names    = ('all', 'starred', 'bookmarked', 'unread')
+        by_user         = {}
+        by_subscription = {}
+        by_folder       = {}
+
+        def add_counts(holder, key, group):
+            counts = holder.setdefault(key, dict.fromkeys(counts_names, 0))
+
+            for name in counts_names:
+                counts[name] += group[name]
+
+        subscriptions_folders = {}
+        subscriptions_ids     = set()
+
+        for group in groups:
+            subscriptions_ids.update(getattr(s, 'id', s) for s
+                                     in group['_id'].get('subscriptions', []))
+
+        for subscription in Subscription._get_collection().find(
+                {'_id': {'$in': list(subscriptions_ids)}},
+                fields=['folders']):
+            subscriptions_folders[subscription['_id']] = [
+                getattr(f, 'id', f) for f in subscription.get('folders', [])]
+
+        for group in groups:
+            add_counts(by_user, getattr(group['_id']['user'], 'id',
+                                        group['_id']['user']), group)
+
+            folders_ids = set()
+
+            for subscription_id in (getattr(s, 'id', s) for s
+                                    in group['_id'].get('subscriptions', [])):
+                add_counts(by_subscription, subscription_id, group)
+                folders_ids.update(subscriptions_folders.get(subscription_id,
+                                                             []))
+
+            for folder_id in folders_ids:
+                add_counts(by_folder, folder_id, group)
+
+        for klass, counts_by_id in ((User, by_user),
+                                    (Subscription, by_subscription),
+                                    (Folder, by_folder)):
+            for instance in klass.objects(id__in=counts_by_id.keys()):
+                for name, count in counts_by_id[instance.id].items():
+                    if count:
+                        attr_name = name + '_articles_count'
+                        setattr(instance, attr_name,
+                                getattr(instance, attr_name) + count)
+
+        return activated
+
+    @classmethod
+    def replace_duplicates_bulk(cls, duplicates):
+        """ Batched version of the reads part of
+            :meth:`Article.replace_duplicate_everywhere`.
+
+            :param duplicates: a ``{duplicate_id: master_id}`` dict.
+
+            The reads of duplicates are fetched with one projected query,
+            then the reads of their owners on the masters with another.
+            Reads of users who have no read on the master yet are
+            retargeted with one multi update for each master; the others
+            are deleted at once, and the counters of their owners are
+            reconciled in the background.
+
+            Returns a tuple ``(fixed_duplicates_ids, retargeted, deleted)``.
+        """
+
+        if not duplicates:
+            return set(), 0, 0
+
+        collection = cls._get_collection()
+
+        # Projected cursors are streamed, instead of one aggregation
+        # result which would hit the 16Mb document limit on big articles.
+        dupe_reads = {}
+
+        for read in collection.find({'article': {'$in': duplicates.keys()}},
+                                    fields=['user', 'article', 'is_good']):
+            dupe_reads.setdefault(read['user'], []).append(read)
+
+        if not dupe_reads:
+            return set(), 0, 0
+
+        # Only the users who have a read on a duplicate matter here.
+        masters_seen = {}
+
+        for read in collection.find({'article': {'$in': list(set(
+                                    duplicates.values()))},
+                                    'user': {'$in': dupe_reads.keys()}},
+                                    fields=['user', 'article']):
+            masters_seen.setdefault(read['user'], set()).add(read['article'])
+
+        fixed     = set()
+        retarget  = {}
+        to_delete = []
+        reconcile = set()
+
+        for user_id, reads in dupe_reads.iteritems():
+            user_masters = masters_seen.setdefault(user_id, set())
+
+            for read in reads:
+                master_id = duplicates[read['article']]
+                fixed.add(read['article'])
+
+                if master_id in user_masters:
+                    # Already registered, simply delete the read.
+                    to_delete.append(read['_id'])
+
+                    if read.get('is_good', False):
+                        reconcile.add(user_id)
+
+                else:
+                    retarget.setdefault(master_id, []).append(read['_id'])
+                    user_masters.add(master_id)
+
+        retargeted = 0
+
+        for master_id, reads_ids in retarget.items():
+            try:
+                retargeted += collection.update(
+                    {'_id': {'$in': reads_ids}},
+                    {'$set': {'article': master_id}}, multi=True)['n']
+
+            except DuplicateKeyError:
+                # A read on the master was created in the meantime;
+                # the next run will delete the remaining duplicate ones.
+                LOGGER.exception(u'Could not replace article %s in some '
+                                 u'reads!', master_id)
+
+        deleted = 0
+
+        if to_delete:
+            deleted = collection.remove({'_id': {'$in': to_delete}})['n']
+
+        # Raw removals bypass the pre_delete signal and its counters update.
+        for user_id in reconcile:
+            user_reconcile_counters.delay(user_id)
+
+        return fixed, retargeted, deleted
+
+    @classmethod
+    def post_create_dispatch(cls, reads_ids):
+        """ Run the post-create processing of new reads. With
+            ``config.READ_POST_CREATE_COALESCE``, their IDs are buffered in
+            REDIS and processed in batches by :meth:`post_create_flush`,
+            instead of sending one celery message for each read.
+        """
+
+        if not reads_ids:
+            return
+
+        if not config.READ_POST_CREATE_COALESCE:
+            for read_id in reads_ids:
+                read_post_create_task.delay(read_id)
+
+            return
+
+        pipe = REDIS.pipeline()
+        pipe.rpush(READ_POST_CREATE_PENDING_KEY,
+                   *[str(read_id) for read_id in reads_ids])
+        cls.post_create_schedule(pipe=pipe)
+
+    @classmethod
+    def post_create_schedule(cls, countdown=None, pipe=None):
+        """ Launch a :meth:`post_create_flush` task, unless one is already
+            pending. The flag expires in case the task gets lost. """
+
+        if countdown is None:
+            countdown = config.READ_POST_CREATE_DELAY
+
+        if pipe is None:
+            pipe = REDIS.pipeline()
+
+        pipe.set(READ_POST_CREATE_SCHEDULED_KEY, 1, nx=True,
+                 ex=countdown * 10 + 60)
+
+        if pipe.execute()[-1]:
+            read_post_create_many_task.apply_async(countdown=countdown)
+
+    @classmethod
+    def post_create_flush(cls):
+        """ Process one batch of the buffered new reads, and launch
+            another task if the buffer is not empty. Returns the number
+            of processed reads.
+
+            If the batch fails, its reads are processed one by one. The
+            failing ones go back at the end of the buffer, or to the
+            ``READ_POST_CREATE_FAILED_KEY`` list after
+            ``config.READ_POST_CREATE_MAX_ATTEMPTS``.
+        """
+
+        batch_size = config.READ_POST_CREATE_BATCH_SIZE
+
+        # Clear the flag before popping: reads buffered from now on will
+        # schedule another task, those buffered before are ours.
+        REDIS.delete(READ_POST_CREATE_SCHEDULED_KEY)
+
+        pipe = REDIS.pipeline()
+        pipe.lrange(READ_POST_CREATE_PENDING_KEY, 0, batch_size - 1)
+        pipe.ltrim(READ_POST_CREATE_PENDING_KEY, batch_size, -1)
+        reads_ids = pipe.execute()[0]
+
+        failed = []
+
+        try:
+            if reads_ids:
+                cls.post_create_many([ObjectId(read_id)
+                                      for read_id in reads_ids])
+
+        except:
+            LOGGER.exception(u'Post-create of %s reads failed, processing '
+                             u'them one by one.', len(reads_ids))
+
+            for read_id in reads_ids:
+                try:
+                    cls.post_create_many([ObjectId(read_id)])
+
+                except:
+                    LOGGER.exception(u'Post-create of read %s failed.',
+                                     read_id)
+                    failed.append(read_id)
+
+            if failed:
+                cls.post_create_failed(failed)
+
+        finally:
+            if REDIS.llen(READ_POST_CREATE_PENDING_KEY):
+                # Don't retry failed reads right away.
+                cls.post_create_schedule(countdown=None if failed else 0)
+
+        return len(reads_ids) - len(failed)
+
+    @classmethod
+    def post_create_failed(cls, reads_ids):
+        """ Count a failed attempt for each read of :param:`reads_ids`;
+            retry them later, or give up after too many attempts. """
+
+        pipe = REDIS.pipeline()
+
+        for read_id in reads_ids:
+            pipe.hincrby(READ_POST_CREATE_ATTEMPTS_KEY, read_id, 1)
+
+        # Forget the attempts of reads which succeeded since.
+        pipe.expire(READ_POST_CREATE_ATTEMPTS_KEY, 86400)
+
+        attempts = pipe.execute()[:-1]
+        retry    = []
+        dead     = []
+
+        for read_id, count in zip(reads_ids, attempts):
+            if count >= config.READ_POST_CREATE_MAX_ATTEMPTS:
+                dead.append(read_id)
+
+            else:
+                retry.append(read_id)
+
+        pipe = REDIS.pipeline()
+
+        if retry:
+            # At the end, not to block the reads buffered meanwhile.
+            pipe.rpush(READ_POST_CREATE_PENDING_KEY, *retry)
+
+        if dead:
+            LOGGER.error(u'Giving up the post-create of reads %s, moved to '
+                         u'%s.', u', '.join(dead), READ_POST_CREATE_FAILED_KEY)
+
+            pipe.rpush(READ_POST_CREATE_FAILED_KEY, *dead)
+            pipe.hdel(READ_POST_CREATE_ATTEMPTS_KEY, *dead)
+
+        pipe.execute()
+
+    @classmethod
+    def post_create_many(cls, reads_ids):
+        """ Batched version of :meth:`post_create_task`.
+
+            Articles and subscriptions are fetched in one query each, and
+            reads sharing the same rating and subscriptions are updated
+            together. As in :meth:`post_create_task`, counters are left
+            to :meth:`activate`.
+        """
+
+        reads = list(cls._get_collection().find(
+                     {'_id': {'$in': reads_ids}},
+                     fields=['user', 'article']))
+
+        if not reads:
+            return 0
+
+        articles = dict((article['_id'], article) for article
+                        in Article._get_collection().find(
+                            {'_id': {'$in': list(set(read['article']
+                                                     for read in reads))}},
+                            fields=['default_rating', 'feeds']))
+
+        feeds_ids = set(feed_id for article in articles.values()
+                        for feed_id in article.get('feeds', []))
+
+        users_feeds_subscriptions = {}
+
+        for subscription in Subscription._get_collection().find(
+                {'user': {'$in': list(set(read['user'] for read in reads))},
+                 'feed': {'$in': list(feeds_ids)}},
+                fields=['user', 'feed']):
+
+            users_feeds_subscriptions.setdefault(
+                (subscription['user'], subscription['feed']),
+                []).append(subscription['_id'])
+
+        to_update = {}
+
+        for read in reads:
+            article = articles.get(read['article'])
+
+            if article is None:
+                # Deleted in the meantime, the read went with it.
+                continue
+
+            # Same as set_subscriptions().
+            subscriptions = []
+
+            for feed_id in article.get('feeds', []):
+                for subscription_id in users_feeds_subscriptions.get(
+                        (read['user'], feed_id), []):
+                    if subscription_id not in subscriptions:
+                        subscriptions.append(subscription_id)
+
+            to_update.setdefault((article.get('default_rating', 0.0),
+                                  tuple(subscriptions)),
+                                 []).append(read['_id'])
+
+        for (rating, subscriptions), ids in to_update.items():
+            cls._get_collection().update(
+                {'_id': {'$in': ids}},
+                {'$set': {'rating': rating,
+                          'subscriptions': list(subscriptions)}},
+                multi=True)
+
+        LOGGER.info(u'Post-processed %s new reads in %s updates.',
+                    len(reads), len(to_update))
+
+        return len(reads)
 
     def post_create_task(self):
         """ Method meant to be run from a celery task. """
@@ -1063,3 +1689,78 @@ def Subscription_create_read_method(self, article, verbose=True, **kwargs):
         return new_read, True
 
 Subscription.create_read = Subscription_create_read_method
+
+
+def User_reconcile_counters_method(self):
+    """ Recompute the user, subscriptions and folders counters from one
+        aggregation on the user good reads, grouped by subscriptions, and
+        fix the REDIS values which drifted. Returns the number of fixed
+        counters.
+
+        This replaces one ``count()`` query per counter and container
+        (see ``compute_cached_descriptors()``).
+    """
+
+    counts_names = ('all', 'unread', 'starred', 'archived', 'bookmarked')
+
+    groups = Read._get_collection().aggregate([
+        {'$match': {'user': self.id, 'is_good': True}},
+        {'$project': {
+            'subscriptions': 1,
+            'unread': {'$cond': [{'$eq': ['$is_read', True]}, 0, 1]},
+            'starred': {'$cond': [{'$eq': ['$is_starred', True]}, 1, 0]},
+            'archived': {'$cond': [{'$eq': ['$is_archived', True]}, 1, 0]},
+            'bookmarked': {'$cond': [{'$eq': ['$is_bookmarked', True]},
+                                     1, 0]},
+        }},
+        {'$group': {
+            '_id': '$subscriptions',
+            'all': {'$sum': 1},
+            'unread': {'$sum': '$unread'},
+            'starred': {'$sum': '$starred'},
+            'archived': {'$sum': '$archived'},
+            'bookmarked': {'$sum': '$bookmarked'},
+        }},
+    ])['result']
+
+    subscriptions = list(Subscription.objects(user=self).no_dereference())
+    folders       = list(Folder.objects(owner=self))
+
+    # Every container gets a value, even those without any read.
+    totals = dict((instance, dict.fromkeys(counts_names, 0))
+                  for instance in [self] + subscriptions + folders)
+
+    subscriptions_by_id = dict((s.id, s) for s in subscriptions)
+    folders_by_id       = dict((f.id, f) for f in folders)
+
+    def add_counts(instance, group):
+        for name in counts_names:
+            totals[instance][name] += group[name]
+
+    for group in groups:
+        add_counts(self, group)
+
+        folders_ids = set()
+
+        for subscription_id in (getattr(s, 'id', s)
+                                for s in group['_id'] or []):
+            subscription = subscriptions_by_id.get(subscription_id, None)
+
+            if subscription is None:
+                # Dangling reference, handled by the subscriptions checker.
+                continue
+
+            add_counts(subscription, group)
+            folders_ids.update(getattr(f, 'id', f)
+                               for f in subscription.folders)
+
+        for folder_id in folders_ids:
+            if folder_id in folders_by_id:
+                add_counts(folders_by_id[folder_id], group)
+
+    return IntRedisDescriptor.set_many(
+        (instance, name + '_articles_count', count)
+        for instance, counts in totals.items()
+        for name, count in counts.items())
+
+User.reconcile_counters = User_reconcile_counters_method
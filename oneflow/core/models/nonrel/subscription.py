@@ -30,6 +30,8 @@ from mongoengine.fields import (StringField, ListField, ReferenceField,
                                 GenericReferenceField, DBRef)
 from mongoengine.errors import NotUniqueError
 
+from constance import config
+
 #from cache_utils.decorators import cached
 
 from django.conf import settings
@@ -41,6 +43,7 @@ from ....base.utils.dateutils import (timedelta, today, combine,
 
 from .common import DocumentHelperMixin  # , CACHE_ONE_DAY
 from .folder import Folder
+from .tag import Tag
 from .user import User
 from .feed import Feed
 
@@ -308,12 +311,31 @@ class Subscription(Document, DocumentHelperMixin):
         #
         #self.compute_cached_descriptors(unread=True)
 
-        self.unread_articles_count -= impacted_count
+        IntRedisDescriptor.incr_many(
+            self.counters_deltas(unread=-impacted_count))
+
+    def counters_deltas(self, subscription=True, folders=True,
+                        user=True, **deltas):
+        """ Return ``(instance, attr_name, delta)`` tuples, suitable for
+            :meth:`IntRedisDescriptor.incr_many`, to apply ``deltas`` (eg.
+            ``all=1, unread=-2``) to the counters of the subscription, its
+            folders and its user.
+        """
+
+        instances = []
+
+        if subscription:
+            instances.append(self)
+
+        if folders:
+            instances.extend(self.folders)
 
-        for folder in self.folders:
-            folder.unread_articles_count -= impacted_count
+        if user:
+            instances.append(self.user)
 
-        self.user.unread_articles_count -= impacted_count
+        return [(instance, name + '_articles_count', delta)
+                for instance in instances
+                for name, delta in deltas.items()]
 
     def check_reads(self, articles=None, force=False, extended_check=False):
         """ Also available as a task for background execution. """
@@ -341,6 +363,16 @@ class Subscription(Document, DocumentHelperMixin):
         if articles is None:
             articles = self.feed.good_articles.order_by('-id')
 
+            if not extended_check:
+                # Only what is needed to create the reads. Tags are
+                # resolved once for each chunk, not for each article.
+                articles = articles.only(
+                    'id', 'date_published', 'tags', 'is_good'
+                ).no_dereference()
+
+        if not extended_check:
+            return self.check_reads_bulk(articles, yesterday, my_now)
+
         for article in articles:
             #
             # NOTE: `is_good` is checked at a lower level in
@@ -405,15 +437,16 @@ class Subscription(Document, DocumentHelperMixin):
             else:
                 failed += 1
 
-        if missing or rechecked:
-            #
-            # TODO: don't recompute everything, just
-            #    add or subscribe the changed counts.
-            #
-            self.compute_cached_descriptors(all=True, unread=True)
-
-            for folder in self.folders:
-                folder.compute_cached_descriptors(all=True, unread=True)
+        if missing:
+            # create_read() has already counted the new reads in the
+            # subscription, all as unread. Folders and user were not
+            # touched. Reads activated via the extended check have been
+            # counted everywhere by Read.activate().
+            IntRedisDescriptor.incr_many(
+                self.counters_deltas(folders=False, user=False,
+                                     unread=-reads)
+                + self.counters_deltas(subscription=False,
+                                       all=missing, unread=unreads))
 
         LOGGER.info(u'Checked subscription #%s. '
                     u'%s/%s non-existing/re-checked, '
@@ -423,6 +456,97 @@ class Subscription(Document, DocumentHelperMixin):
 
         return missing, rechecked, reads, unreads, failed
 
+    def check_reads_bulk(self, articles, yesterday, my_now):
+        """ Bulk version of the :meth:`check_reads` loop: for each chunk of
+            articles, existing reads are found in one query and the missing
+            ones are created in one insert (see
+            :meth:`Read.create_reads_bulk`). Counters are updated once at
+            the end. Returns the same tuple as :meth:`check_reads`.
+        """
+
+        # Avoid an import cycle.
+        from .read import Read
+
+        chunk_size = config.CHECK_READS_BULK_CHUNK_SIZE
+        is_older   = False
+        checked    = 0
+        missing    = 0
+        reads      = 0
+        chunk      = []
+
+        def create_chunk_reads(chunk):
+
+            # Tags are either documents or DBRefs, both have an `id`.
+            tags_ids = list(set(getattr(t, 'id', t)
+                                for article, is_read in chunk
+                                for t in article.tags))
+            tags = Tag.objects.in_bulk(tags_ids) if tags_ids else {}
+
+            created_reads   = 0
+            created_unreads = 0
+
+            for is_read in (True, False):
+                params = {
+                    'is_read':        True,
+                    'is_auto_read':   True,
+                    'date_read':      my_now,
+                    'date_auto_read': my_now,
+                } if is_read else {}
+
+                created = Read.create_reads_bulk(
+                    ((article.id, article.is_good,
+                      [tags.get(getattr(t, 'id', t)) for t in article.tags])
+                     for article, article_is_read in chunk
+                     if article_is_read is is_read), [self], **params)
+
+                if is_read:
+                    created_reads += created
+
+                else:
+                    created_unreads += created
+
+            return created_reads, created_unreads
+
+        for article in articles:
+            checked += 1
+
+            # Same date rules as in check_reads(): articles being ordered
+            # by date, once one is older, all the following ones are.
+            if is_older or article.date_published is None:
+                is_read = True
+
+            else:
+                is_older = is_read = article.date_published < yesterday
+
+            chunk.append((article, is_read))
+
+            if len(chunk) >= chunk_size:
+                created_reads, created_unreads = create_chunk_reads(chunk)
+                reads   += created_reads
+                missing += created_reads + created_unreads
+                chunk    = []
+
+        if chunk:
+            created_reads, created_unreads = create_chunk_reads(chunk)
+            reads   += created_reads
+            missing += created_reads + created_unreads
+
+        unreads = missing - reads
+
+        if missing:
+            # create_reads_bulk() has already counted the new reads
+            # in the subscription. Folders and user were not touched.
+            IntRedisDescriptor.incr_many(
+                self.counters_deltas(subscription=False,
+                                     all=missing, unread=unreads))
+
+        LOGGER.info(u'Bulk-checked subscription #%s. '
+                    u'%s/%s non-existing/re-checked, '
+                    u'%s/%s read/unread.',
+                    self.id, missing, checked - missing, reads, unreads)
+
+        return missing, checked - missing, reads, unreads, 0
+
 
 # ————————————————————————————————————————————————————————— external properties
 #                                            Defined here to avoid import loops
@@ -23,6 +23,7 @@ import logging
 
 from celery import task
 from statsd import statsd
+from constance import config
 
 from pymongo.errors import DuplicateKeyError
 
@@ -35,6 +36,8 @@ from django.conf import settings
 from django.utils.text import slugify
 from django.utils.translation import ugettext_lazy as _
 
+from ....base.utils import RedisGenerationLRUCache
+
 from .common import DocumentHelperMixin
 
 
@@ -119,25 +122,57 @@ class Tag(Document, DocumentHelperMixin):
 
             statsd.gauge('tags.counts.total', 1, delta=True)
 
+    @classmethod
+    def signal_post_delete_handler(cls, sender, document, **kwargs):
+
+        # The deleted tag could be in any worker cache.
+        cls.names_cache.invalidate()
+
     @classmethod
     def get_tags_set(cls, tags_names, origin=None):
+        """ Return a set of :class:`Tag` from a list of names, creating the
+            missing tags on the fly. Duplicates are resolved to their master.
 
-        tags = set()
+            Resolved tags are kept in a process-local LRU cache, which is
+            invalidated in all workers when a tag is renamed, marked as a
+            duplicate or deleted. All names unknown to the cache are looked
+            up in the database with only one query.
+        """
+
+        tags    = set()
+        missing = set()
+        cache   = cls.names_cache
+
+        cache.check_generation()
 
         for tag_name in tags_names:
             tag_name = tag_name.lower()
+            tag      = cache.get(tag_name)
 
-            try:
-                tag = cls.objects.get(name=tag_name)
+            if tag is None:
+                missing.add(tag_name)
 
-            except cls.DoesNotExist:
-                try:
-                    tag = cls(name=tag_name, origin=origin).save()
+            else:
+                tags.add(tag)
 
-                except (NotUniqueError, DuplicateKeyError):
-                    tag = cls.objects.get(name=tag_name)
+        if missing:
+            found = dict((tag.name, tag) for tag
+                         in cls.objects(name__in=list(missing)))
 
-            tags.add(tag.duplicate_of or tag)
+            for tag_name in missing:
+                tag = found.get(tag_name, None)
+
+                if tag is None:
+                    try:
+                        tag = cls(name=tag_name, origin=origin).save()
+
+                    except (NotUniqueError, DuplicateKeyError):
+                        tag = cls.objects.get(name=tag_name)
+
+                tag = tag.duplicate_of or tag
+
+                cache.set(tag_name, tag)
+                tags.add(tag)
 
         return tags
 
@@ -151,8 +186,14 @@ class Tag(Document, DocumentHelperMixin):
                 removal.
         """
 
+        invalidate = self.id is not None and (
+            set(('name', 'duplicate_of')) & set(self._get_changed_fields()))
+
         super(Tag, self).save(*args, **kwargs)
 
+        if invalidate:
+            Tag.names_cache.invalidate()
+
         for parent in self.parents:
             if self in parent.children:
                 continue
@@ -215,3 +256,8 @@ class Tag(Document, DocumentHelperMixin):
 
         if full_reload:
             self.safe_reload()
+
+
+# Names → resolved tags, shared by all get_tags_set() calls of a worker.
+Tag.names_cache = RedisGenerationLRUCache('tag_names',
+                                          max_size=config.TAG_NAMES_CACHE_SIZE)
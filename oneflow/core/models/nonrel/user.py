@@ -50,6 +50,7 @@ DjangoUser = get_user_model()
 
 __all__ = (
     'user_post_create_task',
+    'user_reconcile_counters',
     'User', 'Group',
     'user_all_articles_count_default',
     'user_unread_articles_count_default',
@@ -190,6 +191,13 @@ def user_post_create_task(user_id, *args, **kwargs):
     return user.post_create_task(*args, **kwargs)
 
 
+@task(name='User.reconcile_counters', queue='low')
+def user_reconcile_counters(user_id, *args, **kwargs):
+
+    user = User.objects.get(id=user_id)
+    return user.reconcile_counters(*args, **kwargs)
+
+
 class User(Document, DocumentHelperMixin):
 
     # Attributes synchronized between the Django User class and this one.
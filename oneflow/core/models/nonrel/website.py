@@ -19,27 +19,50 @@
 
 """
 
+import time
 import logging
 
+from urlparse import urlparse
+from contextlib import contextmanager
+
 from celery import task
 from statsd import statsd
+from constance import config
 
 from pymongo.errors import DuplicateKeyError
 
 from mongoengine import Document, NULLIFY
-from mongoengine.fields import StringField, ReferenceField, URLField
+from mongoengine.fields import (StringField, ReferenceField, URLField,
+                                IntField, FloatField)
 from mongoengine.errors import ValidationError, NotUniqueError
 
 from django.conf import settings
 from django.utils.text import slugify
 from django.utils.translation import ugettext_lazy as _
 
+from ....base.utils import (RedisSemaphore, RedisTokenBucket,
+                            NoResourceAvailableException)
+
 from .common import DocumentHelperMixin
 
 LOGGER = logging.getLogger(__name__)
 
+# hostname -> (expiry timestamp, parallel limit, rate), for the current
+# process. See `WebSite.fetch_limits_for_host()`.
+WEBSITE_FETCH_LIMITS = {}
+
+
+__all__ = ('website_post_create_task', 'WebSite', 'WebSiteBusyException', )
+
+
+class WebSiteBusyException(NoResourceAvailableException):
+    """ Raised by :meth:`WebSite.fetch_slot` when the web site has too many
+        requests in flight or exceeded its rate. Callers should defer
+        their work by :attr:`countdown` seconds instead of waiting. """
 
-__all__ = ('website_post_create_task', 'WebSite', )
+    def __init__(self, message, countdown):
+        super(WebSiteBusyException, self).__init__(message)
+        self.countdown = countdown
 
 
 @task(name='WebSite.post_create', queue='high')
@@ -55,7 +78,6 @@ class WebSite(Document, DocumentHelperMixin):
 
     .. todo::
         - replace Feed.site_url by Feed.website
-        - set_fetch_limit goes into website (can be common to many feeds)
     """
 
     name = StringField()
@@ -64,11 +86,133 @@ class WebSite(Document, DocumentHelperMixin):
     duplicate_of = ReferenceField('WebSite',
                                   reverse_delete_rule=NULLIFY)
 
+    # When unset, the `WEBSITE_FETCH_*` configuration values apply.
+    fetch_limit_nr = IntField(verbose_name=_(u'fetch limit'),
+                              help_text=_(u'Maximum number of simultaneous '
+                                          u'requests to this web site.'))
+    fetch_rate     = FloatField(verbose_name=_(u'fetch rate'),
+                                help_text=_(u'Maximum number of requests '
+                                            u'per second to this web site.'))
+
     def __unicode__(self):
         return u'%s #%s (%s)%s' % (self.name or u'<UNSET>', self.id, self.url,
                                    (_(u'(dupe of #%s)') % self.duplicate_of.id)
                                    if self.duplicate_of else u'')
 
+    @staticmethod
+    def fetch_hostname(url):
+        """ Return the lowercased host name of :param:`url`, without port,
+            as a ``str`` suitable for REDIS keys, or ``None``. """
+
+        try:
+            hostname = urlparse(url).hostname
+
+        except:
+            return None
+
+        if not hostname:
+            return None
+
+        return hostname.encode('utf-8')
+
+    @classmethod
+    def fetch_limits_for_host(cls, hostname):
+        """ Return the ``(parallel_limit, rate)`` overrides of the web site
+            of :param:`hostname`, or ``(None, None)`` for the defaults.
+
+            Web sites are looked up by host name, whatever their scheme,
+            and never created here. Results are cached in the current
+            process for ``config.WEBSITE_FETCH_LIMITS_CACHE_TTL`` seconds,
+            to avoid one database query for each fetch.
+        """
+
+        cached = WEBSITE_FETCH_LIMITS.get(hostname, None)
+
+        if cached is not None and cached[0] > time.time():
+            return cached[1:]
+
+        limits = (None, None)
+
+        for website in cls.objects(url__in=['http://' + hostname,
+                                            'https://' + hostname]).only(
+                'fetch_limit_nr', 'fetch_rate', 'duplicate_of'):
+            website = website.duplicate_of or website
+            limits  = (website.fetch_limit_nr, website.fetch_rate)
+            break
+
+        WEBSITE_FETCH_LIMITS[hostname] = (
+            time.time() + config.WEBSITE_FETCH_LIMITS_CACHE_TTL, ) + limits
+
+        return limits
+
+    @classmethod
+    @contextmanager
+    def fetch_slot_for_host(cls, hostname, limit=None, rate=None):
+        """ Hold one of the in-flight slots of :param:`hostname` during the
+            block, after having taken a token from its rate limiter. Raises
+            :class:`WebSiteBusyException` if any of them is exhausted.
+
+            The limits are shared by all schemes and ports of a host, and
+            by all workers, without needing the :class:`WebSite` itself.
+        """
+
+        semaphore = RedisSemaphore(
+            hostname, limit or config.WEBSITE_FETCH_PARALLEL_LIMIT,
+            expire_time=config.WEBSITE_FETCH_SLOT_TTL)
+
+        if not semaphore.acquire():
+            raise WebSiteBusyException(u'Too many requests in flight to %s.'
+                                       % hostname,
+                                       config.WEBSITE_FETCH_DEFER_DELAY)
+
+        try:
+            wait = RedisTokenBucket(hostname,
+                                    rate or config.WEBSITE_FETCH_RATE,
+                                    config.WEBSITE_FETCH_BURST).consume()
+
+            if wait:
+                raise WebSiteBusyException(u'Request rate exceeded for %s.'
+                                           % hostname, int(wait) + 1)
+
+            yield
+
+        finally:
+            semaphore.release()
+
+    @contextmanager
+    def fetch_slot(self):
+        """ :meth:`fetch_slot_for_host` of the current web site, with its
+            own limits. """
+
+        hostname = self.fetch_hostname(self.url)
+
+        if hostname is None:
+            yield
+
+        else:
+            with self.fetch_slot_for_host(hostname, self.fetch_limit_nr,
+                                          self.fetch_rate):
+                yield
+
+    @classmethod
+    @contextmanager
+    def fetch_slot_for_url(cls, url):
+        """ :meth:`fetch_slot_for_host` of the host of :param:`url`. Does
+            nothing if the limits are disabled or the URL has no host. """
+
+        hostname = None
+
+        if not config.WEBSITE_FETCH_LIMIT_DISABLED:
+            hostname = cls.fetch_hostname(url)
+
+        if hostname is None:
+            yield
+
+        else:
+            with cls.fetch_slot_for_host(
+                    hostname, *cls.fetch_limits_for_host(hostname)):
+                yield
+
     @staticmethod
     def split_url(url, split_port=False):
 
@@ -69,11 +69,31 @@ def feed_distribution_by_last_fetch():
         None
     )
 
-    results = {}
+    mynow  = now()
+    bounds = [(mynow - delta) if delta else None for delta in delta_lengths]
+
+    # MongoDB has no $bucket operator: nested $cond give the index of the
+    # first upper bound the last fetch is more recent than. The feeds of
+    # the last bucket (no upper bound) fall in the innermost `else`.
+    bucket = len(bounds) - 1
+
+    for index in reversed(xrange(len(bounds) - 1)):
+        bucket = {'$cond': [{'$gt': ['$last_fetch', bounds[index]]},
+                            index, bucket]}
+
+    buckets = dict((group['_id'], group) for group in
+                   Feed._get_collection().aggregate([
+                       {'$match': {'last_fetch': {'$ne': None}}},
+                       {'$project': {'bucket': bucket,
+                                     'fetch_interval': 1}},
+                       {'$group': {'_id': '$bucket',
+                                   'count': {'$sum': 1},
+                                   'avg_fi': {'$avg': '$fetch_interval'}}},
+                   ])['result'])
 
-    for delta in delta_lengths:
+    results = {}
 
-        upper_value = (now() - delta) if delta else None
+    for upper_value in bounds:
 
         if lower_value is None:
             kwargs = {'last_fetch__gt': upper_value}
@@ -85,13 +105,14 @@ def feed_distribution_by_last_fetch():
             kwargs = {'last_fetch__lte': lower_value,
                       'last_fetch__gt': upper_value}
 
-        feeds   = Feed.objects(**kwargs)
-        count   = feeds.count()
-        percent = float(count * 100.0 / open_feeds_count)
-        avg_fi  = sum(f.fetch_interval for f in feeds) * 1.0 / (count or 1.0)
+        group   = buckets.get(loop_count, {})
+        count   = group.get('count', 0)
+        percent = float(count * 100.0 / (open_feeds_count or 1))
+        avg_fi  = group.get('avg_fi', None) or 0.0
 
         results[loop_count] = [
-            feeds,
+            # Not evaluated until someone drills into the bucket.
+            Feed.objects(**kwargs),
             count,
             percent,
             lower_value,
@@ -161,12 +182,13 @@ class PythonErrorClassifier(object):
     ERR_PYTHON_MAX_RECURSION = u'Python maximum recursion loop'
     ERR_NO_ERROR_STRING      = u'<NO_ERROR_STRING_PROVIDED>'
 
-    def __init__(self, iterables=None, attribute_name=None):
+    def __init__(self, iterables=None, attribute_name=None, samples=None):
         """ Calls class.reset() then class.classify(*args, **kwargs) """
 
         self.stored_instances = {}
         self.iterables        = iterables
         self.attribute_name   = attribute_name
+        self.samples          = samples
 
     def reset(self):
         """ clears all stored instances from the class. """
@@ -178,7 +200,10 @@ class PythonErrorClassifier(object):
             class' :attr:`stored_instances`. """
 
         if error_string:
-            self.stored_instances.setdefault(error_string, []).append(objekt)
+            stored = self.stored_instances.setdefault(error_string, [])
+
+            if self.samples is None or len(stored) < self.samples:
+                stored.append(objekt)
 
     def classify(self, objekts=None, attribute_name=None):
         """ Runs :meth:`classify_one` on each member of the
@@ -217,6 +242,52 @@ class PythonErrorClassifier(object):
             u'stored_instances': self.stored_instances,
         }
 
+    def classify_collection(self, document_class, attribute_name=None):
+        """ Streaming version of :meth:`classify`, for all documents of
+            :param:`document_class` having a non-empty error attribute.
+
+            Only the ``_id`` and the error attribute are fetched, through
+            a raw cursor. Each distinct error string is classified once,
+            and only the ids of the documents are stored (up to
+            :attr:`samples` of them for each error type, if set). Returns
+            the same ``dict`` as :meth:`classify`.
+        """
+
+        start_time   = pytime.time()
+        seen_objects = 0
+        error_types  = {}
+        known_errors = {}
+
+        if attribute_name is None:
+            attribute_name = self.attribute_name
+
+        assert attribute_name is not None
+
+        for document in document_class._get_collection().find(
+                {attribute_name: {'$ne': ''}}, fields=[attribute_name]):
+
+            error_string = document.get(attribute_name) or u''
+
+            try:
+                error = known_errors[error_string]
+
+            except KeyError:
+                error = known_errors[error_string] = self.classify_one(
+                    error_string, document['_id'])
+
+            else:
+                self.store(error, document['_id'])
+
+            error_types[error] = error_types.setdefault(error, 0) + 1
+            seen_objects += 1
+
+        return {
+            u'duration': pytime.time() - start_time,
+            u'seen_objects': seen_objects,
+            u'error_types': error_types,
+            u'stored_instances': self.stored_instances,
+        }
+
     def classify_one(self, error_string, objekt):
         """ As the root of all classifiers, this one has a special behaviour
             to be sure *any* error gets stored in the end, if not already
@@ -434,9 +505,9 @@ def article_url_error_types():
     #    'NoneType' object has no attribute 'findAll': 137
 
     return UrlErrorClassifier(
-        Article.objects(url_error__ne='').no_cache(),
-        'url_error'
-    ).classify()
+        attribute_name='url_error',
+        samples=config.ERROR_CLASSIFIER_SAMPLES
+    ).classify_collection(Article)
 
 
 def article_url_error_types_display(results=None):
@@ -452,9 +523,9 @@ def article_url_error_types_display(results=None):
 def article_content_error_types():
 
     return ContentErrorClassifier(
-        Article.objects(content_error__ne='').no_cache(),
-        'content_error'
-    ).classify()
+        attribute_name='content_error',
+        samples=config.ERROR_CLASSIFIER_SAMPLES
+    ).classify_collection(Article)
 
 
 def article_content_error_types_display(results=None):
@@ -467,69 +538,99 @@ def article_content_error_types_display(results=None):
     return results, output
 
 
-def synchronize_statsd_articles_gauges(full=False):
+def count_in_one_pass(document_class, conditions):
+    """ Count the documents of :param:`document_class` matching each of
+        :param:`conditions` (a dict of aggregation boolean expressions,
+        by name) with one ``$group`` on the whole collection, instead of
+        one ``count()`` (and one collection scan) for each of them.
 
-    with benchmark('synchronize statsd gauges for Article.*'):
+        The result dict has one key for each condition, plus ``total``.
+    """
 
-        empty               = Article.objects(content_type=0).no_cache()
-        #empty_pending       = empty.filter(content_error='', url_error='')
-        #empty_content_error = empty.filter(content_error__ne='')
-        #empty_url_error     = empty.filter(url_error__ne='')
+    group = {'_id': None, 'total': {'$sum': 1}}
 
-        parsed             = Article.objects(content_type__ne=CONTENT_TYPE_NONE)
-        html               = parsed.filter(content_type=CONTENT_TYPE_HTML)
-        markdown           = parsed.filter(content_type=CONTENT_TYPE_MARKDOWN)
+    for name, condition in conditions.items():
+        group[name] = {'$sum': {'$cond': [condition, 1, 0]}}
 
-        absolutes          = Article.objects(url_absolute=True).no_cache()
-        duplicates         = Article.objects(duplicate_of__ne=None).no_cache()
-        orphaned           = Article.objects(orphaned=True).no_cache()
-        content_errors     = Article.objects(content_error__ne='').no_cache()
-        url_errors         = Article.objects(url_error__ne='').no_cache()
+    result = document_class._get_collection().aggregate([
+        {'$group': group}])['result']
 
-        statsd.gauge('articles.counts.total', Article._get_collection().count())
-        statsd.gauge('articles.counts.markdown', markdown.count())
-        statsd.gauge('articles.counts.html', html.count())
-        statsd.gauge('articles.counts.empty', empty.count())
-        statsd.gauge('articles.counts.content_errors', content_errors.count())
-        statsd.gauge('articles.counts.url_errors', url_errors.count())
+    if result:
+        counts = result[0]
+        del counts['_id']
+        return counts
 
-        if full:
-            statsd.gauge('articles.counts.orphaned', orphaned.count())
-            statsd.gauge('articles.counts.absolutes', absolutes.count())
-            statsd.gauge('articles.counts.duplicates', duplicates.count())
+    # Empty collection.
+    return dict((name, 0) for name in group if name != '_id')
 
 
-def synchronize_statsd_tags_gauges(full=False):
+def is_set(field_name):
+    """ Aggregation expression, ``True`` if the field exists and is not
+        ``null`` (equivalent of ``field__ne=None`` in a query). """
+
+    return {'$ifNull': ['$' + field_name, False]}
+
+
+def synchronize_statsd_articles_gauges(full=False):
+
+    with benchmark('synchronize statsd gauges for Article.*'):
 
-    with benchmark('synchronize statsd gauges for Tag.*'):
+        counts = count_in_one_pass(Article, {
+            'empty': {'$eq': ['$content_type', CONTENT_TYPE_NONE]},
+            'html': {'$eq': ['$content_type', CONTENT_TYPE_HTML]},
+            'markdown': {'$eq': ['$content_type', CONTENT_TYPE_MARKDOWN]},
+            'content_errors': {'$ne': ['$content_error', '']},
+            'url_errors': {'$ne': ['$url_error', '']},
+            'orphaned': {'$eq': ['$orphaned', True]},
+            'absolutes': {'$eq': ['$url_absolute', True]},
+            'duplicates': is_set('duplicate_of'),
+        })
 
-        statsd.gauge('tags.counts.total', Tag._get_collection().count())
+        names = ['total', 'markdown', 'html', 'empty',
+                 'content_errors', 'url_errors']
 
         if full:
-            duplicates = Tag.objects(duplicate_of__ne=None).no_cache()
-            statsd.gauge('tags.counts.duplicates', duplicates.count())
+            names.extend(('orphaned', 'absolutes', 'duplicates'))
 
+        with statsd.pipeline() as spipe:
+            for name in names:
+                spipe.gauge('articles.counts.' + name, counts[name])
 
-def synchronize_statsd_websites_gauges(full=False):
 
-    with benchmark('synchronize statsd gauges for WebSite.*'):
+def synchronize_statsd_duplicates_gauges(document_class, prefix, full=False):
+    """ Total and duplicates gauges of a class which has
+        a ``duplicate_of`` field, computed in one pass. """
 
-        statsd.gauge('websites.counts.total', WebSite._get_collection().count())
+    with benchmark('synchronize statsd gauges for %s.*'
+                   % document_class.__name__):
 
         if full:
-            duplicates = WebSite.objects(duplicate_of__ne=None).no_cache()
-            statsd.gauge('websites.counts.duplicates', duplicates.count())
+            counts = count_in_one_pass(document_class, {
+                'duplicates': is_set('duplicate_of')})
 
+        else:
+            # Without the duplicates, the collection
+            # metadata count is enough (and free).
+            counts = {'total': document_class._get_collection().count()}
 
-def synchronize_statsd_authors_gauges(full=False):
+        with statsd.pipeline() as spipe:
+            for name, count in counts.items():
+                spipe.gauge('%s.counts.%s' % (prefix, name), count)
 
-    with benchmark('synchronize statsd gauges for Author.*'):
 
-        statsd.gauge('authors.counts.total', Author._get_collection().count())
+def synchronize_statsd_tags_gauges(full=False):
 
-        if full:
-            duplicates = Author.objects(duplicate_of__ne=None).no_cache()
-            statsd.gauge('authors.counts.duplicates', duplicates.count())
+    synchronize_statsd_duplicates_gauges(Tag, 'tags', full=full)
+
+
+def synchronize_statsd_websites_gauges(full=False):
+
+    synchronize_statsd_duplicates_gauges(WebSite, 'websites', full=full)
+
+
+def synchronize_statsd_authors_gauges(full=False):
+
+    synchronize_statsd_duplicates_gauges(Author, 'authors', full=full)
 
 
 @task(queue='low')
@@ -23,14 +23,14 @@ import redis
 import logging
 import time as pytime
 
-from random import randrange
 from constance import config
 
+from bson import ObjectId
 from pymongo.errors import DuplicateKeyError
 from mongoengine.fields import DBRef
-from mongoengine.errors import OperationError, NotUniqueError, ValidationError
+from mongoengine.errors import OperationError
 from mongoengine.queryset import Q
-from mongoengine.context_managers import no_dereference
+from mongoengine.connection import get_db
 
 from libgreader import GoogleReader, OAuth2Method
 from libgreader.url import ReaderUrl
@@ -44,9 +44,8 @@ from django.core.mail import mail_managers
 from django.contrib.auth import get_user_model
 from django.utils.translation import ugettext_lazy as _
 
-from .models import (RATINGS,
-                     Article,
-                     Feed, feed_refresh,
+from .models import (RATINGS, Article,
+                     Feed, feed_refresh, feed_refresh_many,
                      Subscription, Read, User as MongoUser)
 from .stats import synchronize_statsd_articles_gauges
 
@@ -610,7 +609,7 @@ def refresh_all_feeds(limit=None, force=False):
 
     if not my_lock.acquire():
         if force:
-            my_lock.release()
+            my_lock.release(force=True)
             my_lock.acquire()
             LOGGER.warning(_(u'Forcing all feed refresh…'))
 
@@ -621,65 +620,73 @@ def refresh_all_feeds(limit=None, force=False):
             LOGGER.warning(u'refresh_all_feeds() is already locked, aborting.')
             return
 
+    mynow = now()
     feeds = Feed.objects.filter(closed__ne=True, is_internal__ne=True)
 
+    if not force:
+        # `next_fetch` is None for never-fetched feeds,
+        # they sort first and are thus refreshed first.
+        feeds = feeds.filter(Q(next_fetch=None) | Q(next_fetch__lte=mynow))
+
+    feeds = feeds.order_by('next_fetch')
+
     if limit:
         feeds = feeds.limit(limit)
 
-    # No need for caching and cluttering CPU/memory for a one-shot thing.
-    feeds.no_cache()
+    # When > 0, due feeds are refreshed in batches by the concurrent
+    # fetcher instead of one celery task per feed.
+    batch_size = config.FEED_FETCH_CONCURRENT_BATCH
 
     with benchmark('refresh_all_feeds()'):
 
         try:
-            count = 0
-            mynow = now()
-
-            for feed in feeds:
+            due_ids = list(feeds.scalar('id'))
 
-                if feed.refresh_lock.is_locked():
-                    LOGGER.info(u'Feed %s already locked, skipped.', feed)
-                    continue
-
-                interval = timedelta(seconds=feed.fetch_interval)
+            # Feeds still refreshing from a previous tick are left alone;
+            # their refresh will set a new `next_fetch` anyway.
+            locked = RedisExpiringLock.locked_among(Feed, due_ids, 'fetch')
 
-                if feed.last_fetch is None:
+            if locked:
+                due_ids = [feed_id for feed_id in due_ids
+                           if feed_id not in locked]
 
-                    feed_refresh.delay(feed.id)
-
-                    LOGGER.info(u'Launched immediate refresh of feed %s which '
-                                u'has never been refreshed.', feed)
+            if not due_ids:
+                LOGGER.info(u'No feed to refresh.')
+                return
 
-                elif force or feed.last_fetch + interval < mynow:
+            # Lease the feeds, for the next ticks not to launch them again
+            # while their refresh is still waiting in the queue. A completed
+            # refresh resets `next_fetch` from its new `last_fetch`.
+            Feed.objects(id__in=due_ids).update(
+                set__next_fetch=mynow + timedelta(
+                    seconds=config.FEED_REFRESH_LEASE))
 
-                    how_late = feed.last_fetch + interval - mynow
-                    how_late = how_late.days * 86400 + how_late.seconds
+            if batch_size > 0:
+                jobs = [due_ids[index:index + batch_size]
+                        for index in xrange(0, len(due_ids), batch_size)]
 
-                    if config.FEED_REFRESH_RANDOMIZE:
-                        countdown = randrange(
-                            config.FEED_REFRESH_RANDOMIZE_DELAY)
+            else:
+                jobs = due_ids
 
-                        feed_refresh.apply_async((feed.id, force),
-                                                 countdown=countdown)
+            # Spread the launches evenly over the period, instead of
+            # hammering the workers with all of them at once.
+            period = config.FEED_REFRESH_SPREAD_PERIOD
+            step   = float(period) / len(jobs)
 
-                    else:
-                        countdown = 0
-                        feed_refresh.delay(feed.id, force)
+            for index, job in enumerate(jobs):
+                if batch_size > 0:
+                    feed_refresh_many.apply_async((job, force),
+                                                  countdown=int(index * step))
 
-                    LOGGER.info(u'%s refresh of feed %s %s (%s late).',
-                                u'Scheduled randomized'
-                                if countdown else u'Launched',
-                                feed,
-                                u' in {0}'.format(naturaldelta(countdown))
-                                if countdown else u'in the background',
-                                naturaldelta(how_late))
-                    count += 1
+                else:
+                    feed_refresh.apply_async((job, force),
+                                             countdown=int(index * step))
 
         finally:
             my_lock.release()
 
-        LOGGER.info(u'Launched %s refreshes out of %s feed(s) checked.',
-                    count, feeds.count())
+        LOGGER.info(u'Launched %s refreshes of %s feed(s) over %s seconds.',
+                    len(jobs), len(due_ids), period)
 
 
 @task(queue='high')
@@ -698,6 +705,7 @@ def global_checker_task(*args, **kwargs):
 
         global_subscriptions_checker.si(),
         global_reads_checker.si(),
+        global_counters_reconciler.si(),
     )
 
     return global_check_chain.delay()
@@ -792,7 +800,7 @@ def global_subscriptions_checker(force=False, limit=None, from_feeds=True,
 
     if not my_lock.acquire():
         if force:
-            my_lock.release()
+            my_lock.release(force=True)
             my_lock.acquire()
             LOGGER.warning(u'Forcing subscriptions checks…')
 
@@ -906,7 +914,7 @@ def global_duplicates_checker(limit=None, force=False):
 
     if not my_lock.acquire():
         if force:
-            my_lock.release()
+            my_lock.release(force=True)
             my_lock.acquire()
             LOGGER.warning(u'Forcing duplicates check…')
 
@@ -921,44 +929,61 @@ def global_duplicates_checker(limit=None, force=False):
     if limit is None:
         limit = 0
 
-    duplicates = Article.objects(duplicate_of__ne=None).no_cache()
+    # Only the (duplicate, master) pairs are needed, not the documents.
+    duplicates = Article._get_collection().find(
+        {'duplicate_of': {'$ne': None}}, fields=['duplicate_of'])
 
+    chunk_size        = config.CHECK_DUPLICATES_CHUNK_SIZE
     total_dupes_count = duplicates.count()
     total_reads_count = 0
     processed_dupes   = 0
     done_dupes_count  = 0
 
+    def replace_chunk(chunk):
+        fixed, retargeted, deleted = Read.replace_duplicates_bulk(chunk)
+
+        # Only duplicates which still had reads need their feeds merged,
+        # the others were fully handled when they were registered.
+        Article.merge_duplicates_feeds(dict((dupe_id, chunk[dupe_id])
+                                            for dupe_id in fixed))
+
+        return len(fixed), retargeted + deleted
+
     with benchmark(u"Check {0}/{1} duplicates".format(limit,
                    total_dupes_count)):
 
         try:
-            for duplicate in duplicates:
-                reads = Read.objects(article=duplicate)
+            chunk = {}
 
+            for duplicate in duplicates:
+                chunk[duplicate['_id']] = getattr(duplicate['duplicate_of'],
+                                                  'id',
+                                                  duplicate['duplicate_of'])
                 processed_dupes += 1
 
-                if reads:
-                    done_dupes_count  += 1
-                    reads_count        = reads.count()
+                if len(chunk) >= chunk_size:
+                    fixed_count, reads_count = replace_chunk(chunk)
+                    done_dupes_count  += fixed_count
                     total_reads_count += reads_count
-
-                    LOGGER.info(u'Duplicate article %s still has %s '
-                                u'reads, fixing…', duplicate, reads_count)
-
-                    duplicate.duplicate_of.replace_duplicate_everywhere(
-                        duplicate)
+                    chunk              = {}
 
                     if limit and done_dupes_count >= limit:
                         break
 
+            if chunk:
+                fixed_count, reads_count = replace_chunk(chunk)
+                done_dupes_count  += fixed_count
+                total_reads_count += reads_count
+
         finally:
             my_lock.release()
 
     LOGGER.info(u'global_duplicates_checker(): %s/%s duplicates processed '
                 u'(%.2f%%), %s corrected (%.2f%%), %s reads altered.',
                 processed_dupes, total_dupes_count,
-                processed_dupes * 100.0 / total_dupes_count,
-                done_dupes_count, done_dupes_count * 100.0 / processed_dupes,
+                processed_dupes * 100.0 / (total_dupes_count or 1),
+                done_dupes_count,
+                done_dupes_count * 100.0 / (processed_dupes or 1),
                 total_reads_count)
 
 
@@ -977,7 +1002,7 @@ def global_reads_checker(limit=None, force=False, verbose=False,
 
     if not my_lock.acquire():
         if force:
-            my_lock.release()
+            my_lock.release(force=True)
             my_lock.acquire()
             LOGGER.warning(u'Forcing reads check…')
 
@@ -992,6 +1017,29 @@ def global_reads_checker(limit=None, force=False, verbose=False,
     if limit is None:
         limit = 0
 
+    # Reads are activated from the stored `Article.is_good`. It is set by
+    # the `sync_articles_is_good` management command at deploy; this only
+    # repairs the articles modified behind the pre_save handler since.
+    try:
+        fixed_good, fixed_bad = Article.sync_is_good()
+
+    except:
+        LOGGER.exception(u'Could not synchronize articles `is_good`.')
+
+    else:
+        if fixed_good or fixed_bad:
+            LOGGER.info(u'global_reads_checker(): fixed `is_good` of %s '
+                        u'good and %s bad articles.', fixed_good, fixed_bad)
+
+    if config.CHECK_READS_SET_BASED and not extended_check:
+        try:
+            global_reads_checker_set_based(limit=limit, verbose=verbose)
+
+        finally:
+            my_lock.release()
+
+        return
+
     bad_reads = Read.objects(Q(is_good__exists=False)
                              | Q(is_good__ne=True)).no_cache()
 
@@ -1085,38 +1133,246 @@ def global_reads_checker(limit=None, force=False, verbose=False,
                 skipped_count * 100.0 / processed_reads)
 
 
+def global_reads_checker_set_based(limit=0, verbose=False):
+    """ Set-based version of :func:`global_reads_checker`, without the
+        extended check. Bad reads are streamed (ids only) in chunks; for
+        each chunk, the articles are looked up in one query, reads of
+        missing articles are deleted and reads of good articles are
+        activated via :meth:`Read.activate_reads_bulk`.
+    """
+
+    chunk_size = config.CHECK_READS_CHUNK_SIZE
+
+    bad_reads = Read._get_collection().find(
+        {'is_good': {'$ne': True}}, fields=['article'])
+
+    total_reads_count   = bad_reads.count()
+    processed_reads     = 0
+    wiped_reads_count   = 0
+    changed_reads_count = 0
+
+    def process_chunk(chunk):
+
+        articles_ids = set(article_id for _, article_id in chunk)
+        articles     = dict((article['_id'], article) for article
+                            in Article._get_collection().find(
+                                {'_id': {'$in': list(articles_ids)}},
+                                fields=['is_good']))
+
+        to_wipe     = []
+        to_activate = []
+
+        for read_id, article_id in chunk:
+            article = articles.get(article_id, None)
+
+            if article is None:
+                to_wipe.append(read_id)
+
+            elif article.get('is_good', False):
+                to_activate.append(read_id)
+
+        if to_wipe:
+            LOGGER.error(u'Wiping %s read(s) with dangling reference to '
+                         u'non-existing article(s).', len(to_wipe))
+
+            # Bad reads are not accounted in counters, no need to go
+            # through Read.delete() and its pre_delete signal.
+            Read._get_collection().remove({'_id': {'$in': to_wipe},
+                                           'is_good': {'$ne': True}})
+
+        activated = Read.activate_reads_bulk(to_activate)
+
+        if verbose:
+            LOGGER.info(u'Chunk of %s bad reads: %s activated, %s wiped.',
+                        len(chunk), activated, len(to_wipe))
+
+        return len(to_wipe), activated
+
+    with benchmark(u"Check {0}/{1} reads (set-based)".format(
+                   limit, total_reads_count)):
+        chunk = []
+
+        for read in bad_reads:
+            processed_reads += 1
+            chunk.append((read['_id'], getattr(read.get('article'), 'id',
+                                               read.get('article'))))
+
+            if len(chunk) >= chunk_size:
+                wiped, changed = process_chunk(chunk)
+                wiped_reads_count   += wiped
+                changed_reads_count += changed
+                chunk = []
+
+                if limit and changed_reads_count >= limit:
+                    break
+
+        if chunk:
+            wiped, changed = process_chunk(chunk)
+            wiped_reads_count   += wiped
+            changed_reads_count += changed
+
+    LOGGER.info(u'global_reads_checker_set_based(): %s/%s reads processed, '
+                u'%s corrected, %s deleted.', processed_reads,
+                total_reads_count, changed_reads_count, wiped_reads_count)
+
+    return processed_reads, changed_reads_count, wiped_reads_count
+
+
+@task(queue='low')
+def global_counters_reconciler(limit=None, force=False):
+    """ Fix the drift of the incrementally-maintained counters, with one
+        aggregation per user (see :meth:`User.reconcile_counters`). """
+
+    my_lock = RedisExpiringLock('global_counters_reconciler',
+                                expire_time=3600 * 6)
+
+    if not my_lock.acquire():
+        if force:
+            my_lock.release(force=True)
+            my_lock.acquire()
+            LOGGER.warning(u'Forcing counters reconciliation…')
+
+        else:
+            LOGGER.warning(u'global_counters_reconciler() is already '
+                           u'locked, aborting.')
+            return
+
+    users = MongoUser.objects.all().no_cache()
+
+    if limit:
+        users = users.limit(limit)
+
+    users_count = 0
+    fixed_count = 0
+
+    with benchmark(u'Reconcile counters of all users'):
+        try:
+            for user in users:
+                users_count += 1
+
+                try:
+                    fixed_count += user.reconcile_counters()
+
+                except:
+                    LOGGER.exception(u'Could not reconcile counters of '
+                                     u'user %s.', user)
+
+        finally:
+            my_lock.release()
+
+    LOGGER.info(u'global_counters_reconciler(): %s counters fixed for %s '
+                u'user(s).', fixed_count, users_count)
+
+
 # ••••••••••••••••••••••••••••••••••••••••••••••••••• Move things to Archive DB
 
 
-def archive_article_one_internal(article, counts):
+def archive_articles_internal(kind, spec, limit, counts):
     """ internal function. Do not use directly
-        unless you know what you're doing. """
+        unless you know what you're doing.
+
+        Streams the articles matching :param:`spec` sorted by ``_id``,
+        copies them to the archive database by chunks (one bulk insert
+        each, already archived articles are skipped) and deletes exactly
+        the archived ids from production, with their delete rules.
+
+        The last handled ``_id`` is checkpointed in REDIS, the next run
+        resumes from there; the checkpoint is cleared once the stream is
+        exhausted. ``config.ARTICLE_ARCHIVE_OPS_PER_SECOND`` limits the
+        write rate on both databases. Returns the number of archived
+        articles.
+    """
 
-    delete_anyway = True
-    article.switch_db('archive')
+    production     = Article._get_collection()
+    archive        = get_db('archive')[production.name]
+    chunk_size     = config.ARTICLE_ARCHIVE_CHUNK_SIZE
+    ops_per_second = config.ARTICLE_ARCHIVE_OPS_PER_SECOND
+    checkpoint_key = 'archive_articles:%s:checkpoint' % kind
+    checkpoint     = REDIS.get(checkpoint_key)
+    query          = dict(spec)
 
-    try:
-        article.save()
+    if checkpoint:
+        query['_id'] = {'$gt': ObjectId(checkpoint)}
 
-    except (NotUniqueError, DuplicateKeyError):
-        counts['archived_dupes'] += 1
+        LOGGER.info(u'Archiving of %s articles resumed after %s.',
+                    kind, checkpoint)
 
-    except ValidationError:
-        # If the article doesn't validate in the archive database, how
-        # the hell did it make its way into the production one?? Perhaps
-        # a scoria of the GR import which did update_one(set_*…), which
-        # bypassed the validation phase.
-        # Anyway, beiing here means the article is duplicate or orphaned.
-        # So just forget the validation error and wipe it from production.
-        LOGGER.exception(u'Article archiving failed for %s', article)
-        counts['bad_articles'] += 1
+    def archive_chunk(chunk):
+        start = pytime.time()
+        ids   = [document['_id'] for document in chunk]
 
-    except:
-        delete_anyway = False
+        existing = set(document['_id'] for document in archive.find(
+                       {'_id': {'$in': ids}}, fields=['_id']))
+
+        counts['archived_dupes'] += len(existing)
+
+        to_insert = [document for document in chunk
+                     if document['_id'] not in existing]
+
+        archived_ids = ids
+
+        if to_insert:
+            try:
+                archive.insert(to_insert, continue_on_error=True)
+
+            except DuplicateKeyError:
+                # Some of them are already archived under another `_id`
+                # (eg. same URL); as before, forget the production ones.
+                pass
+
+            except:
+                LOGGER.exception(u'Bulk archiving of %s %s articles '
+                                 u'failed, deleting only the archived '
+                                 u'ones.', len(to_insert), kind)
+
+                archived_ids = [document['_id'] for document in archive.find(
+                                {'_id': {'$in': ids}}, fields=['_id'])]
+
+        if archived_ids:
+            # Not a raw remove(): the delete rules must apply, for the
+            # reads, comments and sources of the archived articles to be
+            # cleaned, and the counters of their owners to be updated.
+            Article.objects(id__in=archived_ids).delete()
 
-    if delete_anyway:
-        article.switch_db('default')
-        article.delete()
+        REDIS.set(checkpoint_key, str(ids[-1]))
+
+        if ops_per_second:
+            # One insert and one delete for each article.
+            remaining = (2.0 * len(ids) / ops_per_second
+                         - (pytime.time() - start))
+
+            if remaining > 0:
+                pytime.sleep(remaining)
+
+        return len(archived_ids)
+
+    cursor = production.find(query, sort=[('_id', 1)], limit=limit)
+    cursor.batch_size(chunk_size)
+
+    archived = 0
+    seen     = 0
+    chunk    = []
+
+    with benchmark(u'Archiving of %s articles' % kind):
+        for document in cursor:
+            chunk.append(document)
+            seen += 1
+
+            if len(chunk) >= chunk_size:
+                archived += archive_chunk(chunk)
+                chunk     = []
+
+                LOGGER.info(u'Archived %s %s articles so far.',
+                            archived, kind)
+
+        if chunk:
+            archived += archive_chunk(chunk)
+
+    if not limit or seen < limit:
+        # The whole stream was handled, next run starts a new pass.
+        REDIS.delete(checkpoint_key)
+
+    return archived
 
 
 @task(queue='clean')
@@ -1125,70 +1381,34 @@ def archive_articles(limit=None):
     counts = {
         'duplicates': 0,
         'orphaned': 0,
-        'bad_articles': 0,
         'archived_dupes': 0,
     }
 
     if limit is None:
         limit = config.ARTICLE_ARCHIVE_BATCH_SIZE
 
-    with no_dereference(Article) as ArticleOnly:
-        if config.ARTICLE_ARCHIVE_OLDER_THAN > 0:
-            older_than = now() - timedelta(
-                            days=config.ARTICLE_ARCHIVE_OLDER_THAN)
+    duplicates = {'duplicate_of': {'$ne': None}}
+    orphaned   = {'orphaned': True}
 
-            duplicates = ArticleOnly.objects(
-                            duplicate_of__ne=None,
-                            date_published__lt=older_than).limit(limit)
-            orphaned   = ArticleOnly.objects(
-                            orphaned=True,
-                            date_published__lt=older_than).limit(limit)
+    if config.ARTICLE_ARCHIVE_OLDER_THAN > 0:
+        older_than = now() - timedelta(
+            days=config.ARTICLE_ARCHIVE_OLDER_THAN)
 
-        else:
-            duplicates = ArticleOnly.objects(duplicate_of__ne=None
-                                             ).limit(limit)
-            orphaned   = ArticleOnly.objects(orphaned=True).limit(limit)
-
-    duplicates.no_cache()
-    orphaned.no_cache()
-
-    counts['duplicates'] = duplicates.count()
-    counts['orphaned']   = orphaned.count()
-
-    if counts['duplicates']:
-        current = 0
-        LOGGER.info(u'Archiving of %s duplicate article(s) started.',
-                    counts['duplicates'])
-
-        with benchmark('Archiving of %s duplicate article(s)'
-                       % counts['duplicates']):
-            for article in duplicates:
-                archive_article_one_internal(article, counts)
-                current += 1
-                if current % 50 == 0:
-                    LOGGER.info(u'Archived %s/%s duplicate articles so far.',
-                                current, counts['duplicates'])
-
-    if counts['orphaned']:
-        current = 0
-        LOGGER.info(u'Archiving of %s orphaned article(s) started.',
-                    counts['orphaned'])
-
-        with benchmark('Archiving of %s orphaned article(s)'
-                       % counts['orphaned']):
-            for article in orphaned:
-                archive_article_one_internal(article, counts)
-                current += 1
-                if current % 50 == 0:
-                    LOGGER.info(u'Archived %s/%s orphaned articles so far.',
-                                current, counts['duplicates'])
+        duplicates['date_published'] = {'$lt': older_than}
+        orphaned['date_published']   = {'$lt': older_than}
+
+    counts['duplicates'] = archive_articles_internal('duplicate', duplicates,
+                                                     limit, counts)
+    counts['orphaned']   = archive_articles_internal('orphaned', orphaned,
+                                                     limit, counts)
 
     if counts['duplicates'] or counts['orphaned']:
         synchronize_statsd_articles_gauges(full=True)
 
-        LOGGER.info('%s already archived and %s bad articles were found '
-                    u'during the operation.', counts['archived_dupes'],
-                    counts['bad_articles'])
+        LOGGER.info(u'%s duplicate and %s orphaned articles archived, %s '
+                    u'of them were already in the archive database.',
+                    counts['duplicates'], counts['orphaned'],
+                    counts['archived_dupes'])
 
     else:
         LOGGER.info(u'No article to archive.')
@@ -1209,7 +1429,7 @@ def archive_documents(limit=None, force=False):
 
     if not my_lock.acquire():
         if force:
-            my_lock.release()
+            my_lock.release(force=True)
             my_lock.acquire()
             LOGGER.warning(u'archive_documents() force unlock/re-acquire, '
                            u'be careful with that.')
@@ -21,13 +21,11 @@
 
 import re
 import logging
-import difflib
 import mistune
 
 from math import pow
 
 from constance import config
-from markdown_deux import markdown as mk2_markdown
 
 from django import template
 #from django.conf import settings
@@ -438,58 +436,19 @@ def read_action_toggle_url(read):
     return u'data-url-action-toggle={0}'.format(url_base)
 
 
-#@cached(CACHE_ONE_WEEK)
 def article_full_content_display(article):
 
     if article.content_type == CONTENT_TYPE_MARKDOWN:
 
         if len(article.content) > config.READ_ARTICLE_MIN_LENGTH:
 
-            # START temporary measure.
-            # TODO: please get rid of this…
-
-            title_len = len(article.title)
-
-            transient_content = article.content
-
-            if title_len > 10:
-                search_len = title_len * 2
-
-                diff = difflib.SequenceMatcher(None,
-                                               article.content[:search_len],
-                                               article.title)
-
-                if diff.ratio() > 0.51:
-                    for blk in reversed(diff.matching_blocks):
-                        # Sometimes, last match is the empty string… Skip it.
-                        if blk[-1] != 0:
-                            transient_content = article.content[
-                                blk[0] + blk[2]:
-                            ]
-                            break
-
-            # END temporary measure.
+            # Cached, and warmed at Markdown conversion time.
+            html = article.render_content()
 
-            try:
+            if html is not None:
                 # On large screens, make the article start a little far from
                 # the top of the screen, it makes a better reading experience.
-                return (u'<div class="spacer50 visible-lg"></div>'
-                        + mistune.markdown(transient_content))
-
-            except:
-                LOGGER.exception(u'Live Markdown to HTML conversion '
-                                 u'failed for article %s, trying '
-                                 u'alternate parser.', article)
-
-                try:
-                    return (u'<div class="spacer50 visible-lg"></div>'
-                            + mk2_markdown(transient_content))
-
-                except:
-                    LOGGER.exception(u'Alternate live Markdown to HTML '
-                                     u'conversion failed for article %s',
-                                     article)
-                    return None
+                return u'<div class="spacer50 visible-lg"></div>' + html
 
 
 @register.simple_tag
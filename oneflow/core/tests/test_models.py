@@ -20,7 +20,11 @@
 
 """
 
+import time
 import logging
+import requests
+import threading
+import feedparser
 
 from constance import config
 
@@ -31,16 +35,31 @@ from django.contrib.auth import get_user_model
 
 from oneflow.core.models import (Feed, Subscription, PseudoQuerySet,
                                  Article, Read, Folder, TreeCycleException,
-                                 User, Group, Tag, WebSite, Author)
-from oneflow.core.tasks import global_feeds_checker
-from oneflow.base.utils import RedisStatsCounter
+                                 User, Group, Tag, WebSite, Author,
+                                 WebSiteBusyException, CONTENT_TYPE_MARKDOWN)
+from oneflow.core.models.nonrel import feed as feed_models
+from oneflow.core.models.nonrel import read as read_models
+from oneflow.core.models.nonrel import website as website_models
+from oneflow.core import tasks as core_tasks
+from oneflow.core.tasks import global_feeds_checker, archive_articles_internal
+from oneflow.base.utils import (RedisStatsCounter, RedisGenerationLRUCache,
+                                RedisSemaphore, RedisTokenBucket,
+                                RedisExpiringLock)
 from oneflow.base.tests import (connect_mongodb_testsuite, TEST_REDIS)
+from oneflow.base.utils.dateutils import now, timedelta
 
 DjangoUser = get_user_model()
 LOGGER     = logging.getLogger(__file__)
 
 # Use the test database not to pollute the production/development one.
 RedisStatsCounter.REDIS = TEST_REDIS
+RedisGenerationLRUCache.REDIS = TEST_REDIS
+RedisSemaphore.REDIS = TEST_REDIS
+RedisTokenBucket.REDIS = TEST_REDIS
+RedisExpiringLock.REDIS = TEST_REDIS
+core_tasks.REDIS = TEST_REDIS
+feed_models.REDIS = TEST_REDIS
+read_models.REDIS = TEST_REDIS
 
 TEST_REDIS.flushdb()
 
@@ -380,6 +399,11 @@ class FeedsTest(TestCase):
                                            email='%s@test.1flow.io' % username)
 
     def tearDown(self):
+        TEST_REDIS.delete(self.feed.seen_entries_key,
+                          read_models.READ_POST_CREATE_PENDING_KEY,
+                          read_models.READ_POST_CREATE_SCHEDULED_KEY,
+                          read_models.READ_POST_CREATE_ATTEMPTS_KEY,
+                          read_models.READ_POST_CREATE_FAILED_KEY)
         Subscription.drop_collection()
         Feed.drop_collection()
         Read.drop_collection()
@@ -406,6 +430,330 @@ class FeedsTest(TestCase):
         #self.assertEqual( mail.outbox[0].to, [ "test@foo.bar" ] )
         #self.assertTrue( "test@foo.bar" in mail.outbox[0].to )
 
+    def test_next_fetch(self):
+
+        self.feed.last_fetch = None
+        self.feed.save()
+
+        self.assertEquals(self.feed.next_fetch, None)
+
+        self.feed.last_fetch     = now()
+        self.feed.fetch_interval = 3600
+        self.feed.save()
+        self.feed.reload()
+
+        self.assertEquals(self.feed.next_fetch - self.feed.last_fetch,
+                          timedelta(seconds=3600))
+
+        # Unrelated saves keep the lease of `refresh_all_feeds()`.
+        lease = self.feed.last_fetch + timedelta(seconds=7200)
+        self.feed.update(set__next_fetch=lease)
+        self.feed.reload()
+
+        self.feed.name = u'1flow test feed, renamed'
+        self.feed.save()
+        self.feed.reload()
+
+        self.assertEquals(self.feed.next_fetch - self.feed.last_fetch,
+                          timedelta(seconds=7200))
+
+    def test_create_reads_bulk(self):
+
+        for index in xrange(2, 5):
+            Subscription(user=User.objects.get(
+                         username='test_user_%s' % index),
+                         feed=self.feed).save()
+
+        self.assertEquals(Read.objects(article=self.article1).count(), 1)
+
+        created = Read.create_reads_bulk(
+            [(self.article1.id, False, [])],
+            self.feed.subscriptions.select_related())
+
+        # test_user_1 already had his read.
+        self.assertEquals(created, 3)
+        self.assertEquals(Read.objects(article=self.article1).count(), 4)
+
+        # The existing read got its subscription attached.
+        for read in Read.objects(article=self.article1):
+            self.assertEquals(len(read.subscriptions), 1)
+
+        # Running it again is harmless.
+        self.assertEquals(Read.create_reads_bulk(
+                          [(self.article1.id, False, [])],
+                          self.feed.subscriptions.select_related()), 0)
+
+    def test_seen_entries(self):
+
+        entries = [feedparser.FeedParserDict(id=u'entry-%s' % index,
+                                             link=u'http://1flow.io/e%s'
+                                             % index, title=u'Entry')
+                   for index in xrange(3)]
+
+        unseen, fingerprints = self.feed.filter_seen_entries(entries)
+
+        self.assertEquals(len(unseen), 3)
+        self.assertEquals(len(set(fingerprints)), 3)
+
+        self.feed.remember_seen_entries(fingerprints[:2])
+
+        unseen, fingerprints = self.feed.filter_seen_entries(entries)
+
+        self.assertEquals(unseen, entries[2:])
+
+        # An edited entry is not the same anymore.
+        entries[0]['title'] = u'Entry, edited'
+
+        self.assertEquals(len(self.feed.filter_seen_entries(entries)[0]), 2)
+        self.assertEquals(len(self.feed.filter_seen_entries(
+                          entries, force=True)[0]), 3)
+
+    def test_parse_raw_same_body(self):
+
+        response = requests.models.Response()
+        response.status_code = 200
+        response._content = (b'<?xml version="1.0"?><rss version="2.0">'
+                             b'<channel><title>test</title><item><title>'
+                             b'item</title><link>http://1flow.io/i1</link>'
+                             b'</item></channel></rss>')
+
+        parsed_feed, status, digest = self.feed.parse_raw(response)
+
+        self.assertEquals(status, 200)
+        self.assertEquals(len(parsed_feed.entries), 1)
+
+        self.feed.last_body_digest = digest
+
+        self.assertEquals(self.feed.parse_raw(response), (None, 304, None))
+        self.assertEquals(self.feed.parse_raw(response, force=True)[1], 200)
+
+    def test_refresh_many(self):
+
+        state     = {'running': {}, 'max_running': 0}
+        lock      = threading.Lock()
+        processed = []
+        deferred  = []
+
+        class FakeRefreshTask(object):
+            def delay(self, *args, **kwargs):
+                pass
+
+            def apply_async(self, args, countdown=None):
+                deferred.append((args, countdown))
+
+        def fetch_raw(feed, feedparser_kwargs, timeout=None):
+
+            if feed.url.endswith('busy'):
+                raise WebSiteBusyException(u'busy', 42)
+
+            host = feed.url.split('/')[2]
+
+            with lock:
+                state['running'][host] = state['running'].get(host, 0) + 1
+                state['max_running'] = max(state['max_running'],
+                                           state['running'][host])
+
+            # Let the other threads pile up on the same host.
+            time.sleep(0.1)
+
+            with lock:
+                state['running'][host] -= 1
+
+            response = requests.models.Response()
+            response.status_code = 304
+            response.url = feed.url
+
+            return response
+
+        def refresh_process(feed, *args, **kwargs):
+            processed.append(feed.id)
+            return original_refresh_process(feed, *args, **kwargs)
+
+        original_fetch_raw       = Feed.__dict__['fetch_raw']
+        original_refresh_process = Feed.__dict__['refresh_process']
+        original_feed_refresh    = feed_models.feed_refresh
+
+        # No real refresh of the new feeds at creation.
+        feed_models.feed_refresh = FakeRefreshTask()
+        Feed.fetch_raw           = fetch_raw
+        Feed.refresh_process     = refresh_process
+
+        try:
+            feeds = [self.feed] + [
+                Feed(name='1flow test feed %s' % index,
+                     url='http://blog.1flow.io/rss%s' % index).save()
+                for index in xrange(2, 7)]
+
+            busy = Feed(name='1flow busy feed',
+                        url='http://blog.1flow.io/busy').save()
+
+            Feed.refresh_many(feeds + [busy], force=True)
+
+        finally:
+            feed_models.feed_refresh = original_feed_refresh
+            Feed.fetch_raw           = original_fetch_raw
+            Feed.refresh_process     = original_refresh_process
+
+        self.assertEquals(sorted(processed), sorted(f.id for f in feeds))
+        self.assertTrue(0 < state['max_running']
+                        <= config.FEED_FETCH_CONCURRENT_PER_HOST)
+
+        # The busy feed was released and re-scheduled, not processed.
+        self.assertEquals(deferred, [((busy.id, True), 42)])
+        self.assertFalse(busy.refresh_lock.is_locked())
+
+    def test_create_articles_bulk_resolved_url(self):
+
+        feed2 = Feed(name='1flow test feed 2',
+                     url='http://blog.1flow.io/rss2').save()
+
+        redirectors = [u'http://feedproxy.google.com/~r/1flow/~3/bulk%s/'
+                       % index for index in xrange(2)]
+
+        for redirector in redirectors:
+            Article.resolved_url_set(redirector, self.article1.url)
+
+        entries = [feedparser.FeedParserDict(link=redirector,
+                                             title=u'Redirected')
+                   for redirector in redirectors]
+
+        # Both entries resolve to article1: one mutualized, one duplicate.
+        self.assertEquals(feed2.create_articles_from_feedparser_bulk(
+                          entries, []), (0, 1, 1))
+
+        self.assertEquals(Article.objects(url__in=redirectors).count(), 0)
+
+        self.article1.reload()
+
+        self.assertTrue(feed2 in self.article1.feeds)
+
+    def test_post_create_many(self):
+
+        self.article1.update(set__default_rating=2.5)
+
+        read = Read.objects.get(article=self.article1)
+
+        # The read was created before the subscription.
+        self.assertEquals(read.subscriptions, [])
+
+        self.assertEquals(Read.post_create_many([read.id]), 1)
+
+        read.reload()
+
+        self.assertEquals(read.rating, 2.5)
+        self.assertEquals(len(read.subscriptions), 1)
+        self.assertEquals(read.subscriptions[0].feed, self.feed)
+
+    def test_post_create_flush_failed(self):
+
+        read = Read.objects.get(article=self.article1)
+
+        TEST_REDIS.rpush(read_models.READ_POST_CREATE_PENDING_KEY,
+                         'not-an-id', str(read.id))
+
+        flushes = 0
+
+        # With eager tasks, the first flush already runs the next ones.
+        while TEST_REDIS.llen(read_models.READ_POST_CREATE_PENDING_KEY):
+            Read.post_create_flush()
+            flushes += 1
+
+            self.assertTrue(flushes <= config.READ_POST_CREATE_MAX_ATTEMPTS)
+
+        # The failing read did not prevent the other one to be processed.
+        read.reload()
+
+        self.assertEquals(len(read.subscriptions), 1)
+        self.assertEquals(TEST_REDIS.lrange(
+                          read_models.READ_POST_CREATE_FAILED_KEY, 0, -1),
+                          ['not-an-id'])
+
+    def test_check_reads_bulk(self):
+
+        subscription = Subscription(user=User.objects.get(
+                                    username='test_user_2'),
+                                    feed=self.feed).save()
+
+        # No publication date: the new read is created already read.
+        self.assertEquals(subscription.check_reads([self.article1],
+                                                   force=True),
+                          (1, 0, 1, 0, 0))
+        self.assertEquals(Read.objects(article=self.article1).count(), 2)
+        self.assertTrue(Read.objects.get(article=self.article1,
+                                         user=subscription.user).is_read)
+
+        # Running it again only re-checks.
+        self.assertEquals(subscription.check_reads([self.article1],
+                                                   force=True),
+                          (0, 1, 0, 0, 0))
+
+    def test_prefetch(self):
+
+        read = Read.objects.get(article=self.article1)
+        read.update(set__subscriptions=[Subscription.objects.get(
+                    user=read.user)])
+
+        reads = Read.prefetch(Read.objects(article=self.article1))
+
+        self.assertEquals(len(reads), 1)
+
+        # References are documents already, nothing left to dereference.
+        self.assertTrue(isinstance(reads[0]._data['article'], Article))
+        self.assertTrue(isinstance(reads[0]._data['user'], User))
+        self.assertTrue(isinstance(reads[0]._data['subscriptions'][0],
+                                   Subscription))
+        self.assertTrue(isinstance(
+                        reads[0]._data['subscriptions'][0]._data['feed'],
+                        Feed))
+
+        self.assertEquals(reads[0].article, self.article1)
+        self.assertEquals(reads[0].subscriptions[0].feed, self.feed)
+        self.assertEquals(Read.prefetch([]), [])
+
+    def test_article_is_good(self):
+
+        self.assertFalse(self.article1.is_good)
+        self.assertEquals(self.feed.good_articles.count(), 0)
+
+        self.article1.url_absolute = True
+        self.article1.content_type = CONTENT_TYPE_MARKDOWN
+        self.article1.save()
+
+        self.assertTrue(self.article1.is_good)
+        self.assertEquals(self.feed.good_articles.count(), 1)
+        self.assertEquals(self.feed.bad_articles.count(), 0)
+
+        # Written behind our back, the stored value gets fixed.
+        Article._get_collection().update({'_id': self.article1.id},
+                                         {'$unset': {'is_good': 1}})
+
+        self.assertEquals(Article.sync_is_good(), (1, 0))
+        self.assertEquals(Article.sync_is_good(), (0, 0))
+
+    def test_activate_reads_bulk(self):
+
+        read         = Read.objects.get(article=self.article1)
+        subscription = Subscription.objects.get(user=read.user)
+
+        read.update(set__is_good=False,
+                    set__subscriptions=[subscription])
+
+        all_count    = subscription.all_articles_count
+        unread_count = subscription.unread_articles_count
+
+        self.assertEquals(Read.activate_reads_bulk([read.id]), 1)
+
+        read.reload()
+        subscription = Subscription.objects.get(id=subscription.id)
+
+        self.assertTrue(read.is_good)
+        self.assertEquals(subscription.all_articles_count, all_count + 1)
+        self.assertEquals(subscription.unread_articles_count,
+                          unread_count + 1)
+
+        # Already good reads are not counted twice.
+        self.assertEquals(Read.activate_reads_bulk([read.id]), 0)
+
     def test_feeds_creation(self):
 
         # .setUp() creates one already.
@@ -561,6 +909,105 @@ class ArticleDuplicateTest(TestCase):
         # TODO: finish this test case.
         #
 
+    def test_replace_duplicates_bulk(self):
+
+        # test_user_1 already has a read on the master.
+        Read(user=User.objects.get(username='test_user_1'),
+             article=self.article2).save()
+
+        fixed, retargeted, deleted = Read.replace_duplicates_bulk(
+            {self.article2.id: self.article1.id})
+
+        self.assertEquals(fixed, set([self.article2.id]))
+        self.assertEquals((retargeted, deleted), (5, 1))
+        self.assertEquals(self.article1.reads.count(), 10)
+        self.assertEquals(self.article2.reads.count(), 0)
+
+        self.assertEquals(Article.merge_duplicates_feeds(
+                          {self.article2.id: self.article1.id}), 1)
+
+        self.article1.safe_reload()
+
+        self.assertEquals(len(self.article1.feeds), 10)
+
+    def test_render_content(self):
+
+        self.article3.content = (u'test3 title is not long enough\n\n'
+                                 u'Some *Markdown* content.')
+
+        cache_key = self.article3.rendered_content_cache_key
+        html      = self.article3.render_content()
+
+        self.assertTrue(u'<em>Markdown</em>' in html)
+        self.assertEquals(html, self.article3.render_content_raw())
+
+        # The key follows the content.
+        self.article3.content += u' More.'
+
+        self.assertNotEquals(cache_key,
+                             self.article3.rendered_content_cache_key)
+
+
+@override_settings(STATICFILES_STORAGE=
+                   'pipeline.storage.NonPackagingPipelineStorage',
+                   CELERY_EAGER_PROPAGATES_EXCEPTIONS=True,
+                   CELERY_ALWAYS_EAGER=True,
+                   BROKER_BACKEND='memory',)
+class ArchiveArticlesTest(TestCase):
+
+    def setUp(self):
+
+        self.articles = [Article(title='test%s' % index, orphaned=True,
+                                 url='http://1flow.io/archive%s' % index
+                                 ).save() for index in xrange(3)]
+
+        du = DjangoUser.objects.create(username='test_user_1',
+                                       email='test_user_1@test.1flow.io')
+        self.user = du.mongo
+
+        Read(user=self.user, article=self.articles[0]).save()
+
+        self.archive = core_tasks.get_db('archive')[
+            Article._get_collection_name()]
+
+        # The last one was archived by a previous run which failed
+        # before deleting it from production.
+        self.archive.insert(self.articles[2].to_mongo())
+
+        self.counts = {'archived_dupes': 0}
+
+    def tearDown(self):
+        self.archive.remove({'_id': {'$in': [a.id for a in self.articles]}})
+        TEST_REDIS.delete('archive_articles:test:checkpoint')
+        Read.drop_collection()
+        Article.drop_collection()
+        User.drop_collection()
+
+    def test_archive_articles_internal(self):
+
+        self.assertEquals(archive_articles_internal(
+                          'test', {'orphaned': True}, 1, self.counts), 1)
+
+        # Stopped at the limit, the next run resumes from there.
+        self.assertEquals(TEST_REDIS.get('archive_articles:test:checkpoint'),
+                          str(self.articles[0].id))
+        self.assertEquals(Article.objects(orphaned=True).count(), 2)
+
+        # The delete rules applied: no read left on the archived article.
+        self.assertEquals(Read.objects(article=self.articles[0]).count(), 0)
+
+        self.assertEquals(archive_articles_internal(
+                          'test', {'orphaned': True}, 0, self.counts), 2)
+
+        self.assertEquals(self.counts['archived_dupes'], 1)
+        self.assertEquals(Article.objects(orphaned=True).count(), 0)
+        self.assertEquals(self.archive.find({'_id': {'$in': [
+                          a.id for a in self.articles]}}).count(), 3)
+
+        # The stream was exhausted, the next pass starts over.
+        self.assertEquals(TEST_REDIS.get('archive_articles:test:checkpoint'),
+                          None)
+
 
 @override_settings(STATICFILES_STORAGE=
                    'pipeline.storage.NonPackagingPipelineStorage',
@@ -622,6 +1069,29 @@ class AbsolutizeTest(TestCase):
         self.assertEquals(self.article4.url_absolute, False)
         self.assertEquals(self.article4.url_error[:108], u"HTTPConnectionPool(host='host.non.exixstentz.com', port=80): Max retries exceeded with url: /absolutize_test") # NOQA
 
+    def test_create_article_resolved_url(self):
+
+        redirector = u'http://feedproxy.google.com/~r/1flow/~3/resolved_test/'
+        final      = Article(title=u'test6',
+                             url=u'http://1flow.io/resolved_test').save()
+
+        Article.resolved_url_set(redirector, final.url)
+
+        article, created = Article.create_article(u'test6 again',
+                                                  redirector, [])
+
+        self.assertEquals(article, final)
+        self.assertEquals(created, False)
+        self.assertEquals(Article.objects(url=redirector).count(), 0)
+
+        Article.resolved_url_set(redirector, None, u'HTTP Error 404', True)
+
+        article, created = Article.create_article(u'test6 again',
+                                                  redirector, [])
+
+        self.assertNotEquals(article, final)
+        self.assertEquals(created, True)
+
 
 @override_settings(STATICFILES_STORAGE=
                    'pipeline.storage.NonPackagingPipelineStorage',
@@ -638,6 +1108,7 @@ class TagsTest(TestCase):
 
     def tearDown(self):
         Tag.drop_collection()
+        Tag.names_cache.invalidate()
 
     def test_add_parent(self):
 
@@ -661,6 +1132,46 @@ class TagsTest(TestCase):
         self.assertEquals(self.t2 in self.t1.children, True)
         self.assertEquals(self.t3 in self.t1.children, True)
 
+    def test_get_tags_set(self):
+
+        tags = Tag.get_tags_set([u'Test1', u'test2', u'test4'])
+
+        self.assertEquals(tags, set([self.t1, self.t2,
+                                     Tag.objects.get(name=u'test4')]))
+        self.assertTrue(u'test4' in Tag.names_cache)
+
+        # Cache hits and misses mixed in the same call.
+        self.assertEquals(Tag.get_tags_set([u'test1', u'test3']),
+                          set([self.t1, self.t3]))
+
+        # Duplicates are resolved, even if the name was already cached.
+        self.t1.register_duplicate(self.t2)
+
+        self.assertFalse(u'test2' in Tag.names_cache)
+        self.assertEquals(Tag.get_tags_set([u'test2']), set([self.t1]))
+
+    def test_replace_duplicate_in_articles(self):
+
+        article = Article(title='TagsTest #1', url='http://test-tags.com/1',
+                          tags=[self.t2, self.t3]).save()
+        du      = DjangoUser.objects.create(username='test_tags_user',
+                                            email='test_tags@test.1flow.io')
+        read    = Read(user=du.mongo, article=article,
+                       tags=[self.t2]).save()
+
+        self.assertEquals(self.t1.replace_duplicate_in_articles(self.t2),
+                          (1, 1))
+
+        article.reload()
+        read.reload()
+
+        self.assertEquals(set(article.tags), set([self.t1, self.t3]))
+        self.assertEquals(read.tags, [self.t1])
+
+        Read.drop_collection()
+        Article.drop_collection()
+        User.drop_collection()
+
 
 @override_settings(STATICFILES_STORAGE=
                    'pipeline.storage.NonPackagingPipelineStorage',
@@ -734,6 +1245,26 @@ class WebSitesTest(TestCase):
         # TODO: finish this test case.
         #
 
+    def test_fetch_slot_for_url(self):
+
+        self.ws1.update(set__fetch_limit_nr=1)
+        website_models.WEBSITE_FETCH_LIMITS.clear()
+
+        # Limits are per host, whatever the scheme, port or case.
+        with WebSite.fetch_slot_for_url('http://TEST1.com/example-article'):
+            with self.assertRaises(WebSiteBusyException):
+                with WebSite.fetch_slot_for_url('https://test1.com:8443/'):
+                    pass
+
+        with WebSite.fetch_slot_for_url('http://test1.com/example-article'):
+            pass
+
+        # Fetching never creates web sites.
+        with WebSite.fetch_slot_for_url('http://test4.com/example-article'):
+            pass
+
+        self.assertEquals(WebSite.objects(url__contains='test4').count(), 0)
+
     def test_websites_duplicates(self):
         pass
 
@@ -28,7 +28,8 @@ from django.test.utils import override_settings
 from oneflow.base.tests import connect_mongodb_testsuite
 from oneflow.core.models import Article
 from oneflow.core.stats import (PythonErrorClassifier, GenericErrorClassifier,
-                                UrlErrorClassifier, ContentErrorClassifier)
+                                UrlErrorClassifier, ContentErrorClassifier,
+                                count_in_one_pass)
 
 LOGGER = logging.getLogger(__file__)
 
@@ -72,6 +73,12 @@ class ErrorClassifierTests(TestCase):
     def tearDown(self):
         Article.drop_collection()
 
+    def test_count_in_one_pass(self):
+
+        self.assertEquals(count_in_one_pass(Article, {
+                          'url_errors': {'$ne': ['$url_error', '']}}),
+                          {'total': 6, 'url_errors': 5})
+
     def test_python_errors_classifiers(self):
 
         results = PythonErrorClassifier(Article.objects(url_error__ne=''),
@@ -126,6 +133,23 @@ class ErrorClassifierTests(TestCase):
         err401 = stored.get(UrlErrorClassifier.ERR_NETWORK_HTTP401)
         self.assertEquals(err401, None)
 
+    def test_url_error_classifier_collection(self):
+
+        results = UrlErrorClassifier(attribute_name='url_error',
+                                     samples=1).classify_collection(Article)
+
+        self.assertEquals(results.get('seen_objects'), 5)
+        self.assertEquals(len(results.get('error_types')), 4)
+        self.assertEquals(results.get('error_types').get(
+                          UrlErrorClassifier.ERR_NETWORK_HTTP404), 2)
+
+        # Only IDs are stored, and no more than the samples number.
+        err404 = results.get('stored_instances').get(
+            UrlErrorClassifier.ERR_NETWORK_HTTP404)
+
+        self.assertEquals(len(err404), 1)
+        self.assertTrue(err404[0] in (self.a3.id, self.a4.id))
+
     def test_content_error_classifier(self):
 
         # NOTE: these errors strings are directly taken from the production
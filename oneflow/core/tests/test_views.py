@@ -178,6 +178,21 @@ class HomeAndPreferencesViewTest(TestCase):
 
         self.assertContains(response, u' articles')
 
+    def test_read_cursor_pagination(self):
+
+        self.client.login(username='testuser', password='testpass')
+
+        response = self.client.get(reverse('read'), {'after': ''},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context[u'next_after'], None)
+
+        response = self.client.get(reverse('read'), {'after': 'not-an-id'},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        self.assertEqual(response.status_code, 400)
+
 
 @override_settings(STATICFILES_STORAGE=
                    'pipeline.storage.NonPackagingPipelineStorage',
@@ -27,6 +27,8 @@ import gdata.gauth
 from random import choice as random_choice
 from constance import config
 from mongoengine import Q
+from bson import ObjectId
+from bson.errors import InvalidId
 
 from django.http import (HttpResponseRedirect,
                          HttpResponsePermanentRedirect,
@@ -70,6 +72,7 @@ from .models.nonrel import (Feed, Subscription, FeedIsHtmlPageException,
                             TreeCycleException,
                             CONTENT_TYPES_FINAL)
 from .models.reldb import HelpContent
+from ..base.fields import RedisCachedDescriptor
 from ..base.utils import word_match_consecutive_once
 from ..base.utils.dateutils import now
 
@@ -201,14 +204,26 @@ def source_selector(request, **kwargs):
     mongo_user     = request.user.mongo
     selector_prefs = mongo_user.preferences.selector
 
-    return render(request, template, {
-        'subscriptions':               mongo_user.subscriptions,
-        'nofolder_open_subscriptions': mongo_user.nofolder_open_subscriptions,
-        'closed_subscriptions':        mongo_user.nofolder_closed_subscriptions,
-        'show_closed_streams':         selector_prefs.show_closed_streams,
-        'titles_show_unread_count':    selector_prefs.titles_show_unread_count,
-        'folders_show_unread_count':   selector_prefs.folders_show_unread_count,
-    })
+    # The selector displays nearly all counters of the user, of
+    # his subscriptions and of his folders: get them all at once.
+    with RedisCachedDescriptor.batch():
+        RedisCachedDescriptor.prefetch(
+            [mongo_user]
+            + list(Subscription.objects(user=mongo_user).no_dereference())
+            + list(Folder.objects(owner=mongo_user).no_dereference()))
+
+        return render(request, template, {
+            'subscriptions':               mongo_user.subscriptions,
+            'nofolder_open_subscriptions':
+                mongo_user.nofolder_open_subscriptions,
+            'closed_subscriptions':
+                mongo_user.nofolder_closed_subscriptions,
+            'show_closed_streams':         selector_prefs.show_closed_streams,
+            'titles_show_unread_count':
+                selector_prefs.titles_show_unread_count,
+            'folders_show_unread_count':
+                selector_prefs.folders_show_unread_count,
+        })
 
 
 def manage_folder(request, **kwargs):
@@ -729,8 +744,10 @@ def read_with_endless_pagination(request, **kwargs):
 
         # LOGGER.info(u'Refining reads by folder %s', folder)
 
+        # IDs only: avoids loading the subscriptions
+        # documents just to build the `$in` clause.
         query_kwargs[u'subscriptions__in'] = \
-            Subscription.objects(folders=folder)
+            list(Subscription.objects(folders=folder).scalar('id'))
 
     # ——————————————————————————————————————————————————————————————— the query
 
@@ -755,6 +772,9 @@ def read_with_endless_pagination(request, **kwargs):
         # are we rendering the first "main"
         # page, or just a subset via ajax?
         u'initial': False,
+
+        u'cursor_pagination': (config.READ_CURSOR_PAGINATION_ENABLED
+                               and order_by == u'-id'),
     }
 
     # ——————————————————————————————————————————————————————————— Ajax requests
@@ -810,6 +830,32 @@ def read_with_endless_pagination(request, **kwargs):
 
             return HttpResponse('DONE')
 
+        elif u'after' in request.GET:
+            template = u'snippets/read/read-endless-page.html'
+
+            # Keyset pagination: reads are ordered by `-id`, the next
+            # page starts just after the last displayed one. No skip().
+            per_fetch = config.READ_INFINITE_ITEMS_PER_FETCH
+            after     = request.GET.get('after')
+            offset    = request.GET.get('offset', u'0')
+
+            if after:
+                try:
+                    reads = reads.filter(id__lt=ObjectId(after))
+
+                except InvalidId:
+                    return HttpResponseBadRequest(u'Bad cursor')
+
+            # One query per collection for the whole page, instead
+            # of dereferencing each read attributes in the template.
+            reads = Read.prefetch(reads.limit(per_fetch + 1), user=user)
+
+            context[u'reads']          = reads[:per_fetch]
+            context[u'tenths_counter'] = int(offset) if offset.isdigit() else 0
+            context[u'next_offset']    = context[u'tenths_counter'] + per_fetch
+            context[u'next_after']     = reads[per_fetch - 1].id \
+                if len(reads) > per_fetch else None
+
         else:
             template = u'snippets/read/read-endless-page.html'
 
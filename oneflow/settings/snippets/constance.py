@@ -40,6 +40,10 @@ CONSTANCE_CONFIG = {
                               u'disabling this does not prevent any malicious '
                               u'code which bypasses this configuration flag.')),
 
+    'ERROR_CLASSIFIER_SAMPLES': (100, ugettext(u'How many article IDs the '
+                                 u'error classifiers of the staff statistics '
+                                 u'keep for each error type.')),
+
 
     # ———————————————————————————————————————————————————— System announcements
 
@@ -166,6 +170,12 @@ CONSTANCE_CONFIG = {
                                       ugettext(u'Number of items per ajax '
                                       u'fetch on infinite pagination pages.')),
 
+    'READ_CURSOR_PAGINATION_ENABLED': (True, ugettext(u'Load next pages of '
+                                       u'reading lists from the last '
+                                       u'displayed item (keyset pagination) '
+                                       u'instead of a page number, which '
+                                       u'gets slower as the user scrolls.')),
+
     'READ_ARTICLE_MIN_LENGTH': (24, ugettext(u'Minimum length of an article '
                                 u'content. Set to 0 to always display '
                                 u'Markdown content to users, whatever it is.')),
@@ -217,20 +227,105 @@ CONSTANCE_CONFIG = {
                                   u'time. Workers should adjust the value '
                                   u'automatically as time passes.')),
 
+    'FEED_FETCH_TIMEOUT': (30, ugettext(u'Timeout in seconds of the HTTP '
+                           u'requests made by the concurrent feed fetcher.')),
+
+    'FEED_FETCH_CONCURRENT_BATCH': (0, ugettext(u'If greater than 0, the '
+                                    u'global refresh task will refresh due '
+                                    u'feeds in batches of this size, each '
+                                    u'batch downloaded concurrently in one '
+                                    u'worker. 0 keeps one task per feed.')),
+
+    'FEED_FETCH_CONCURRENT_WORKERS': (32, ugettext(u'Number of download '
+                                      u'threads of the concurrent feed '
+                                      u'fetcher, in each worker process.')),
+
+    'FEED_FETCH_CONCURRENT_PER_HOST': (2, ugettext(u'Maximum simultaneous '
+                                       u'connections to the same host in '
+                                       u'the concurrent feed fetcher.')),
+
+    'HTTP_FETCH_TIMEOUT': (30, ugettext(u'Timeout in seconds of the HTTP '
+                           u'requests made to absolutize articles URLs and '
+                           u'fetch their content.')),
+
+    'HTTP_FETCH_MAX_SIZE': (10485760, ugettext(u'Maximum size in bytes of '
+                            u'a fetched web page or feed. Bigger ones are '
+                            u'considered in error. Set to 0 for no limit.')),
+
+    'HTTP_POOL_HOSTS': (64, ugettext(u'Number of hosts for which each '
+                        u'worker process keeps alive connections. Applied at '
+                        u'worker restart.')),
+
+    'HTTP_POOL_PER_HOST': (4, ugettext(u'Number of alive connections each '
+                           u'worker process keeps for one host. Applied at '
+                           u'worker restart.')),
+
+    'WEBSITE_FETCH_LIMIT_DISABLED': (False, ugettext(u'Disable the per web '
+                                     u'site limits applied to feed '
+                                     u'refreshes, URL absolutizations and '
+                                     u'articles content fetches.')),
+
+    'WEBSITE_FETCH_PARALLEL_LIMIT': (4, ugettext(u'Default maximum number '
+                                     u'of simultaneous requests to the same '
+                                     u'web site, across all workers.')),
+
+    'WEBSITE_FETCH_RATE': (2.0, ugettext(u'Default number of requests per '
+                           u'second allowed to the same web site, across '
+                           u'all workers.')),
+
+    'WEBSITE_FETCH_BURST': (10, ugettext(u'Number of requests that can be '
+                            u'sent at once to a web site which has not '
+                            u'been hit recently, before WEBSITE_FETCH_RATE '
+                            u'applies.')),
+
+    'WEBSITE_FETCH_DEFER_DELAY': (30, ugettext(u'Delay in seconds before a '
+                                  u'task which found its web site busy is '
+                                  u'run again.')),
+
+    'WEBSITE_FETCH_SLOT_TTL': (300, ugettext(u'Number of seconds after '
+                               u'which a web site request slot is freed, '
+                               u'in case its worker died while holding '
+                               u'it.')),
+
+    'WEBSITE_FETCH_LIMITS_CACHE_TTL': (600, ugettext(u'Number of seconds '
+                                       u'each worker process keeps the '
+                                       u'fetch limits of a web site before '
+                                       u'reading them again from the '
+                                       u'database.')),
+
+    'FEED_SEEN_ENTRIES_ENABLED': (True, ugettext(u'Remember the entries '
+                                  u'fingerprints of each feed in REDIS, and '
+                                  u'skip the known ones at next refresh '
+                                  u'without touching the database.')),
+
+    'FEED_SEEN_ENTRIES_MAX': (500, ugettext(u'Maximum number of entries '
+                              u'fingerprints remembered for each feed.')),
+
+    'FEED_SEEN_ENTRIES_TTL': (1209600, ugettext(u'Seconds after its last '
+                              u'refresh before a feed forgets its seen '
+                              u'entries.')),
+
+    'FEED_REFRESH_BULK_ENABLED': (True, ugettext(u'Create the articles and '
+                                  u'reads of a feed refresh in batches (a '
+                                  u'few database operations for the whole '
+                                  u'fetch) instead of one by one. Disable '
+                                  u'to get back to the unitary creation, '
+                                  u'eg. for debugging purposes.')),
+
     # •••••••••••••••••••••••••••••••••••••••••••••••• Feed admin configuration
 
-    'FEED_REFRESH_RANDOMIZE': (True, ugettext(u'Set this to False if you want '
-                               u'all feeds with the same fetch interval to '
-                               u'fetch at the same time. Default is to '
-                               u'randomize the refreshs not to hammer our '
-                               u'machines.')),
+    'FEED_REFRESH_SPREAD_PERIOD': (60, ugettext(u'The due feeds found by '
+                                   u'the global refresher are launched '
+                                   u'evenly over this number of seconds. '
+                                   u'Keep it lower or equal to the '
+                                   u'periodicity of the feed refresher.')),
 
-    'FEED_REFRESH_RANDOMIZE_DELAY': (40, ugettext(u'Number of seconds max for '
-                                     u'the randomization (eg. between 0 and '
-                                     u'this number). Warning: keep this '
-                                     u'lower than the peridicity of the feed '
-                                     u'refresher, else some tasks will be '
-                                     u'duplicated.')),
+    'FEED_REFRESH_LEASE': (900, ugettext(u'Once launched, a feed is not '
+                           u'considered due again before this number of '
+                           u'seconds, unless its refresh completes before. '
+                           u'Keep it higher than the usual tasks queue '
+                           u'latency, else some refreshes will be '
+                           u'duplicated.')),
 
     'FEED_ADMIN_LIST_PER_PAGE': (100, ugettext(u'How many feeds per page in '
                                  u'the Django admin. Increase only if '
@@ -280,16 +375,56 @@ CONSTANCE_CONFIG = {
                                   u'to Markdown internal conversion. '
                                   u'Default: enabled in normal conditions.')),
 
+    'ARTICLE_RESOLVED_URL_CACHE_TTL': (604800, ugettext(u'Number of '
+                                       u'seconds the final URL of an '
+                                       u'absolutized article URL stays in '
+                                       u'the cache. 0 disables the cache.')),
+
+    'ARTICLE_RESOLVED_URL_ERROR_CACHE_TTL': (3600, ugettext(u'Number of '
+                                             u'seconds an URL absolutization '
+                                             u'error stays in the cache. '
+                                             u'0 to always retry.')),
+
+    'ARTICLE_RENDERED_CACHE_TTL': (604800, ugettext(u'Number of seconds the '
+                                   u'HTML rendering of an article content '
+                                   u'stays in the cache. Renders are keyed '
+                                   u'on the content, edits never serve a '
+                                   u'stale version.')),
+
     'ARTICLE_ARCHIVE_BATCH_SIZE': (100 if DEBUG else 50000,
                                    ugettext(u'how much articles will be '
                                    u'archived at each archive task run.')),
 
+    'ARTICLE_ARCHIVE_CHUNK_SIZE': (1000, ugettext(u'how much articles are '
+                                   u'copied to the archive database and '
+                                   u'deleted from production at once.')),
+
+    'ARTICLE_ARCHIVE_OPS_PER_SECOND': (2000, ugettext(u'Maximum number of '
+                                       u'article inserts and deletes per '
+                                       u'second while archiving, to keep '
+                                       u'the production database '
+                                       u'responsive. Set to 0 to disable '
+                                       u'the throttling.')),
+
     'ARTICLE_ARCHIVE_OLDER_THAN': (62, ugettext(u'Only articles older than '
                                    u'that will be archived, regarding their '
                                    u'`date_published` field. This delta is '
                                    u'expressed in days. Set to 0 to archive '
                                    u'everything without mercy.')),
 
+    # •••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••• Tags
+
+    'TAG_NAMES_CACHE_SIZE': (16384, ugettext(u'How many tag names each '
+                             u'worker process keeps in memory to avoid '
+                             u'database lookups when resolving tags of '
+                             u'fetched articles. Applied at worker '
+                             u'restart.')),
+
+    'TAG_MERGE_CHUNK_SIZE': (5000, ugettext(u'Number of articles whose '
+                             u'tags (and those of their reads) are '
+                             u'rewritten at once when merging a duplicate '
+                             u'tag into its master.')),
+
     # ••••••••••••••••••••••••••••••••••••••••••• Various checks and core tasks
 
     'CHECK_SUBSCRIPTIONS_DISABLED': (False, ugettext(u'Disable or not the '
@@ -305,11 +440,45 @@ CONSTANCE_CONFIG = {
                                   u'no read left in the system. Default: '
                                   u'let it run (=enabled).')),
 
+    'CHECK_DUPLICATES_CHUNK_SIZE': (5000, ugettext(u'Number of duplicate '
+                                    u'articles whose reads are replaced at '
+                                    u'once by the duplicates check.')),
+
     'CHECK_READS_DISABLED': (False, ugettext(u'Disable or not the night '
                              u'reads check that will switch on-and-off their '
                              u'`is_good` attribute. Default: let it run '
                              u'(=enabled).')),
 
+    'CHECK_READS_SET_BASED': (True, ugettext(u'Check reads with a few '
+                              u'multi-documents queries for each chunk of '
+                              u'reads, instead of one by one. The extended '
+                              u'check always runs one by one.')),
+
+    'CHECK_READS_CHUNK_SIZE': (5000, ugettext(u'Number of bad reads '
+                               u'processed at once by the set-based reads '
+                               u'check.')),
+
+    'READ_POST_CREATE_COALESCE': (True, ugettext(u'Buffer the IDs of new '
+                                  u'reads in REDIS and post-process them in '
+                                  u'batches, instead of one task per read.')),
+
+    'READ_POST_CREATE_BATCH_SIZE': (500, ugettext(u'Number of new reads '
+                                    u'post-processed by one task when '
+                                    u'coalescing.')),
+
+    'READ_POST_CREATE_DELAY': (5, ugettext(u'Seconds to wait for more new '
+                               u'reads before post-processing a batch.')),
+
+    'READ_POST_CREATE_MAX_ATTEMPTS': (5, ugettext(u'Number of failed '
+                                      u'post-processings of a new read '
+                                      u'before it is moved aside to '
+                                      u'`reads:post_create:failed` in '
+                                      u'REDIS.')),
+
+    'CHECK_READS_BULK_CHUNK_SIZE': (1000, ugettext(u'Number of articles '
+                                    u'whose missing reads are created at once '
+                                    u'by the subscriptions reads check.')),
+
     # ——————————————————————————————————————————————————————— Exerpt generation
 
     'EXCERPT_PARAGRAPH_MIN_LENGTH': (64, ugettext(u'Number of characters '